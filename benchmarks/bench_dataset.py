@@ -0,0 +1,82 @@
+'''Benchmark of the per-particle memory of ParticleDataset and of its view
+operations (subset, get_random_subset, union, complement, balance) on
+synthetic datasets, without parsing star files. The former
+representation (a DataFrame of STAR_COLUMNS, stack names as a
+fixed-width np.str_ array, pandas selection of random subsets) is
+measured on a smaller dataset, its memory is reported per particle.
+
+    python benchmarks/bench_dataset.py --rows 10000000 50000000
+'''
+import argparse
+import numpy as np
+import pandas as pd
+from time import perf_counter
+from cryosieve.ParticleDataset import ParticleDataset
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description = 'benchmark of ParticleDataset views')
+    parser.add_argument('--rows',        type = int, nargs = '+', default = [10000000], help = 'numbers of particles, 10000000 by default')
+    parser.add_argument('--former_rows', type = int, default = 1000000, help = 'number of particles of the former representation, 1000000 by default')
+    parser.add_argument('--stack_size',  type = int, default = 200,     help = 'number of particles per stack, 200 by default')
+    return parser.parse_args()
+
+def stack_name(k):
+    return f'Extract/job010/Movies/stack_{k:07d}.mrcs'
+
+def synthetic(n, stack_size):
+    '''A dataset of n particles, parameters are not materialized.'''
+    rng = np.random.default_rng(0)
+    dataset = ParticleDataset.__new__(ParticleDataset)
+    dataset.paras = np.broadcast_to(np.zeros(16), (n, 16))
+    dataset.i_slcs = (np.arange(n) % stack_size + 1).astype(np.int32)
+    dataset.stack_codes = (np.arange(n) // stack_size).astype(np.int32)
+    dataset.stack_names = np.array([stack_name(k) for k in range(dataset.stack_codes[-1] + 1)])
+    dataset.random_subsets = rng.integers(1, 3, n, dtype = np.int32)
+    dataset.indices = np.arange(n, dtype = np.int64)
+    dataset.store = None
+    return dataset
+
+def timed(name, f):
+    time0 = perf_counter()
+    result = f()
+    print(f'  {name:<20s} {perf_counter() - time0:8.3f} s')
+    return result
+
+def main():
+    args = parse_arguments()
+
+    n = args.former_rows
+    time0 = perf_counter()
+    names = np.array([stack_name(k // args.stack_size) for k in range(n)])
+    particles = pd.DataFrame({
+        'rlnImageName'    : [f'{k % args.stack_size + 1:06d}@{stack_name(k // args.stack_size)}' for k in range(n)],
+        'rlnRandomSubset' : np.random.default_rng(0).integers(1, 3, n)
+    })
+    for label in ['rlnOriginXAngst', 'rlnOriginYAngst', 'rlnAngleRot', 'rlnAngleTilt', 'rlnAnglePsi',
+                  'rlnDefocusU', 'rlnDefocusV', 'rlnDefocusAngle', 'rlnOpticsGroup']:
+        particles[label] = 0.
+    former = names.nbytes + particles.memory_usage(deep = True).sum() + 4 * n
+    print(f'Former, {n} particles: {former / n:.1f} bytes/particle besides paras')
+    indices = np.arange(n, dtype = np.int64)
+    timed('get_random_subset', lambda: indices[particles['rlnRandomSubset'].iloc[indices] == 1])
+    n_sample = particles['rlnRandomSubset'].value_counts().min()
+    timed('balance', lambda: particles.groupby('rlnRandomSubset').sample(n = n_sample).sort_index())
+    del names, particles, indices
+    print(f'  (built in {perf_counter() - time0:.1f} s)')
+
+    for n in args.rows:
+        dataset = synthetic(n, args.stack_size)
+        arrays = dataset.i_slcs.nbytes + dataset.stack_codes.nbytes + dataset.stack_names.nbytes + dataset.random_subsets.nbytes + dataset.indices.nbytes
+        print(f'Lean, {n} particles: {arrays / n:.1f} bytes/particle besides paras and row spans')
+        half1 = timed('get_random_subset', lambda: dataset.get_random_subset(1))
+        half2 = timed('get_random_subset', lambda: dataset.get_random_subset(2))
+        timed('subset (mask)', lambda: half1.subset(np.arange(len(half1)) % 10 != 0))
+        timed('union', lambda: half1.union(half2))
+        timed('complement', lambda: half1.complement())
+        timed('n_random_subset', lambda: dataset.n_random_subset())
+        timed('stack_order', lambda: dataset.stack_order())
+        timed('balance', lambda: dataset.balance())
+        del dataset, half1, half2
+
+if __name__ == '__main__':
+    main()
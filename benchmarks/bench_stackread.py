@@ -0,0 +1,73 @@
+'''Microbenchmark of reading particle slices: mrcfile memory maps
+(utility.mrcread, the former path of ParticleDataset) against offset
+reads into a preallocated buffer (utility.StackFile).
+
+    python benchmarks/bench_stackread.py --n 256 --num_images 2000 --mode 2
+'''
+import argparse
+import os
+import tempfile
+import numpy as np
+from time import perf_counter
+from cryosieve.utility import MRC_MODES, StackFile, mrc_header, mrcread
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description = 'benchmark of particle stack readers')
+    parser.add_argument('--n',          type = int, default = 256,  help = 'image size, 256 by default')
+    parser.add_argument('--num_images', type = int, default = 2000, help = 'number of images in the stack, 2000 by default')
+    parser.add_argument('--mode',       type = int, default = 2, choices = [0, 1, 2, 12], help = 'MRC mode of the stack, 2 by default')
+    parser.add_argument('--run',        type = int, default = 50,   help = 'number of consecutive slices per read in the run benchmark, 50 by default')
+    parser.add_argument('--dir',        type = str,                 help = 'directory of the temporary stack, system temporary directory by default')
+    return parser.parse_args()
+
+def report(name, seconds, num_images, nbytes):
+    print(f'{name:<28s} {seconds / num_images * 1e6:9.1f} us/image {nbytes / seconds / 2 ** 20:9.1f} MB/s')
+
+def main():
+    import mrcfile
+    args = parse_arguments()
+    dtype = np.dtype(MRC_MODES[args.mode])
+    rng = np.random.default_rng(0)
+    data = (rng.normal(size = (args.num_images, args.n, args.n)) * 10).astype(dtype)
+    nbytes = data.nbytes
+
+    with tempfile.TemporaryDirectory(dir = args.dir) as directory:
+        path = os.path.join(directory, 'stack.mrcs')
+        with mrcfile.new(path) as mrc:
+            mrc.set_data(data)
+        del data
+        order = rng.permutation(args.num_images)
+        out = np.empty((1, args.n, args.n), dtype = np.float64)
+
+        handles = dict()
+        time0 = perf_counter()
+        for i in order:
+            out[0] = np.asarray(mrcread(path, int(i), handles), dtype = np.float64)
+        report('mrcread, random slices', perf_counter() - time0, args.num_images, nbytes)
+        for mrc in handles.values():
+            mrc.close()
+
+        stack = StackFile(path, mrc_header(path))
+        time0 = perf_counter()
+        for i in order:
+            stack.readinto(out, int(i))
+        report('StackFile, random slices', perf_counter() - time0, args.num_images, nbytes)
+
+        runs = range(0, args.num_images - args.run + 1, args.run)
+        buffer = np.empty((args.run, args.n, args.n), dtype = np.float64)
+        handles = dict()
+        time0 = perf_counter()
+        for start in runs:
+            buffer[...] = np.asarray(mrcread(path, slice(start, start + args.run), handles), dtype = np.float64)
+        report(f'mrcread, runs of {args.run}', perf_counter() - time0, len(runs) * args.run, buffer.size * len(runs) * dtype.itemsize)
+        for mrc in handles.values():
+            mrc.close()
+
+        time0 = perf_counter()
+        for start in runs:
+            stack.readinto(buffer, start, args.run)
+        report(f'StackFile, runs of {args.run}', perf_counter() - time0, len(runs) * args.run, buffer.size * len(runs) * dtype.itemsize)
+        stack.close()
+
+if __name__ == '__main__':
+    main()
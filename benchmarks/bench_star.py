@@ -0,0 +1,110 @@
+'''Benchmark of reading a RELION 3.1 particle star file: starfile.read
+(the former path of ParticleDataset) against star.read_star of all
+columns and of the columns parsed by ParticleDataset. Each reader runs
+in a fresh process, so that its peak memory is reported separately.
+Then writing a random 90% subset of particles: starfile.write (the
+former path of ParticleDataset.save) against star.write_star_rows, with
+a plain copy of the star file as reference.
+
+    python benchmarks/bench_star.py --rows 5000000
+'''
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+from time import perf_counter
+
+READERS = ['starfile', 'read_star', 'read_star (STAR_COLUMNS)']
+WRITERS = ['starfile.write', 'write_star_rows', 'copyfile']
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description = 'benchmark of star file readers')
+    parser.add_argument('--rows', type = int, default = 2000000, help = 'number of particles, 2000000 by default')
+    parser.add_argument('--dir',  type = str,                    help = 'directory of the temporary star file, system temporary directory by default')
+    parser.add_argument('--run',  type = str, nargs = 2, metavar = ('READER', 'PATH'), help = argparse.SUPPRESS)
+    return parser.parse_args()
+
+def write_star(path, rows, chunk = 500000):
+    '''A star file of `rows` particles with the columns of a typical RELION 3.1 refinement.'''
+    rng = np.random.default_rng(0)
+    with open(path, 'w') as f:
+        f.write('\ndata_optics\n\nloop_\n_rlnOpticsGroup #1\n_rlnOpticsGroupName #2\n_rlnAmplitudeContrast #3\n'
+                '_rlnSphericalAberration #4\n_rlnVoltage #5\n_rlnImagePixelSize #6\n_rlnImageSize #7\n_rlnImageDimensionality #8\n'
+                '1 opticsGroup1 0.100000 2.700000 300.000000 1.060000 256 2\n\n'
+                '\ndata_particles\n\nloop_\n')
+        labels = ['rlnImageName', 'rlnMicrographName', 'rlnCoordinateX', 'rlnCoordinateY', 'rlnAngleRot', 'rlnAngleTilt',
+                  'rlnAnglePsi', 'rlnOriginXAngst', 'rlnOriginYAngst', 'rlnDefocusU', 'rlnDefocusV', 'rlnDefocusAngle',
+                  'rlnPhaseShift', 'rlnCtfBfactor', 'rlnCtfScalefactor', 'rlnCtfMaxResolution', 'rlnCtfFigureOfMerit',
+                  'rlnAutopickFigureOfMerit', 'rlnClassNumber', 'rlnGroupNumber', 'rlnOpticsGroup', 'rlnRandomSubset',
+                  'rlnLogLikeliContribution', 'rlnMaxValueProbDistribution', 'rlnNrOfSignificantSamples', 'rlnNormCorrection']
+        f.writelines(f'_{label} #{i + 1}\n' for i, label in enumerate(labels))
+        for start in range(0, rows, chunk):
+            m = min(chunk, rows - start)
+            i = np.arange(start, start + m)
+            table = pd.DataFrame({label : rng.uniform(-180, 180, m) for label in labels})
+            table['rlnImageName'] = [f'{k % 1000 + 1:06d}@Extract/job010/Movies/stack_{k // 1000:05d}.mrcs' for k in i]
+            table['rlnMicrographName'] = [f'MotionCorr/job002/Movies/mic_{k // 1000:05d}.mrc' for k in i]
+            for label in ['rlnClassNumber', 'rlnGroupNumber', 'rlnOpticsGroup', 'rlnNrOfSignificantSamples']:
+                table[label] = 1
+            table['rlnRandomSubset'] = i % 2 + 1
+            table.to_csv(f, sep = '\t', header = False, index = False, float_format = '%.6f')
+
+def run(reader, path):
+    from cryosieve.ParticleDataset import STAR_COLUMNS
+    from cryosieve.star import read_star
+    time0 = perf_counter()
+    if reader == 'starfile':
+        import starfile
+        star = starfile.read(path, always_dict = True)
+    elif reader == 'read_star':
+        star = read_star(path)
+    else:
+        star = read_star(path, STAR_COLUMNS)
+    seconds = perf_counter() - time0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 20
+    particles = star['particles']
+    print(f'{reader:<28s} {seconds:8.2f} s {peak:8.2f} GB peak RSS {particles.shape[1]:4d} columns {particles.memory_usage(deep = True).sum() / 2 ** 30:8.2f} GB')
+
+def write(writer, path):
+    from cryosieve.star import read_star, write_star_rows
+    output_path = path + '.out'
+    if writer == 'starfile.write':
+        import starfile
+        star = starfile.read(path, always_dict = True)
+    elif writer == 'write_star_rows':
+        star, spans = read_star(path, ['rlnRandomSubset'], row_spans = True)
+    rows = np.flatnonzero(np.random.default_rng(1).uniform(size = len(star['particles'])) < 0.9) if writer != 'copyfile' else None
+
+    time0 = perf_counter()
+    if writer == 'starfile.write':
+        star['particles'] = star['particles'].iloc[rows]
+        starfile.write(star, output_path, overwrite = True)
+    elif writer == 'write_star_rows':
+        write_star_rows(path, output_path, spans['particles'], rows)
+    else:
+        shutil.copyfile(path, output_path)
+    seconds = perf_counter() - time0
+    print(f'{writer:<28s} {seconds:8.2f} s {os.path.getsize(output_path) / 2 ** 30:8.2f} GB written')
+    os.remove(output_path)
+
+def main():
+    args = parse_arguments()
+    if args.run is not None:
+        (run if args.run[0] in READERS else write)(*args.run)
+        return
+
+    with tempfile.TemporaryDirectory(dir = args.dir) as directory:
+        path = os.path.join(directory, 'particles.star')
+        time0 = perf_counter()
+        write_star(path, args.rows)
+        print(f'Wrote {args.rows} particles ({os.path.getsize(path) / 2 ** 30:.2f} GB) in {perf_counter() - time0:.1f} s')
+        for reader in READERS + WRITERS:
+            subprocess.run([sys.executable, __file__, '--run', reader, path], check = True)
+
+if __name__ == '__main__':
+    main()
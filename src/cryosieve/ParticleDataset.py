@@ -1,21 +1,52 @@
 import os
-import starfile
 import numpy as np
 import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 from pathlib import Path
+from time import time
 from os import PathLike
-from typing import Optional
-from numpy.typing import NDArray
-from .utility import mrcread
+from typing import Optional, Tuple
+from numpy.typing import DTypeLike, NDArray
+from .kernels import ceil_div
+from .handle_cache import HandleCache
+from .logger import logger
+from .star import read_star, write_star_rows
+from .star_cache import file_digest, file_key, load_star_cache, save_star_cache
+from .utility import mrc_header, stackread
+
+# Columns of star files parsed by ParticleDataset, other columns are only copied by save.
+STAR_COLUMNS = (
+    'rlnImageName', 'rlnOriginX', 'rlnOriginY', 'rlnOriginXAngst', 'rlnOriginYAngst',
+    'rlnAngleRot', 'rlnAngleTilt', 'rlnAnglePsi', 'rlnVoltage', 'rlnDefocusU',
+    'rlnDefocusV', 'rlnDefocusAngle', 'rlnSphericalAberration', 'rlnAmplitudeContrast',
+    'rlnPhaseShift', 'rlnImagePixelSize', 'rlnOpticsGroup', 'rlnRandomSubset'
+)
 
 class ParticleDataset(object):
     '''
     Dataset class for particles.
 
     The parameters of particles, like ctfs, will be loaded when
-    the object is created. However, the data of particles will not
-    be loaded until the __getitem__ method is called.
+    the object is created, parsing only STAR_COLUMNS of the star file
+    (save copies rows of the star file verbatim). If `star_cache` (a
+    directory) is given, parsed parameters are saved into a star cache of
+    the star file (and of files written by save) in it, and are loaded
+    from it while the star file is unchanged. However, the data of particles
+    will not be loaded until the __getitem__ method is called, and are
+    then converted to `dtype` if given. If `store` is given, particles are
+    read from that particle store of cryosieve-pack instead of stacks.
+    Otherwise headers of all stacks are checked when the object is
+    created, or when particles are first read if `index_stacks` is False.
+    Up to `max_open_stacks` stacks are kept open, in a HandleCache shared
+    by subsets, if `enable_cache` is True.
+
+    Particles are held as arrays over rows of the star file: paras,
+    int32 slice numbers, int32 codes of stacks into the table of distinct
+    stack names, and random subsets. A dataset is a view of these arrays
+    by `indices`, so subset, union, complement and balance only build
+    index arrays.
     '''
 
     def __init__(
@@ -23,11 +54,17 @@ class ParticleDataset(object):
         star_path : str,
         data_dir : Optional[PathLike] = None,
         pixel_size : Optional[float] = None,
-        enable_cache : bool = True
+        enable_cache : bool = True,
+        dtype : Optional[DTypeLike] = None,
+        store : Optional[PathLike] = None,
+        index_stacks : bool = True,
+        max_open_stacks : int = 512,
+        star_cache : Optional[PathLike] = None
     ):
         if not os.path.exists(star_path):
             raise FileNotFoundError(f'{star_path} does not exist')
-        star = starfile.read(star_path, always_dict = True)
+        self.star_path = star_path
+        self.star_mtime = os.stat(star_path).st_mtime_ns
 
         if data_dir is not None:
             self.data_dir = Path(data_dir)
@@ -37,29 +74,64 @@ class ParticleDataset(object):
             self.data_dir = Path('.')
 
         self.pixel_size = pixel_size
+        self.dtype = None if dtype is None else np.dtype(dtype)
+
+        self.star_cache = star_cache
+        cache = self._load_star_cache(star_path)
+        if cache is None:
+            self._read_star()
+            # Arrays are then mapped from the new cache rather than kept in memory.
+            cache = self._load_star_cache(star_path)
+        if cache is not None:
+            self._load_cache(cache)
+
+        self.store = None
+        if store is not None:
+            store = Path(store)
+            if not (store / 'index.npz').is_file():
+                raise FileNotFoundError(f'Invalid particle store: {str(store)}')
+            self.store = np.load(store / 'images.npy', mmap_mode = 'r')
+            self.store_names = pd.Index(np.load(store / 'index.npz')['names'])
+
+        # Rows of particles in the particle store.
+        if self.store is not None:
+            self.store_rows = self.store_names.get_indexer(self.image_names)
+            if np.any(self.store_rows < 0):
+                raise ValueError(f'{np.count_nonzero(self.store_rows < 0)} particle(s) missed in particle store')
+
+        self.indices = np.arange(len(self.paras), dtype = np.int64)
+        self.handle_cache = HandleCache(max_open_stacks) if enable_cache else None
+        if index_stacks and self.store is None:
+            self._index_stacks()
+
+    def _read_star(self):
+        '''
+        Read STAR_COLUMNS of the star file, parse parameters of particles,
+        and save them into the star cache if enabled.
+        '''
+        star_path = self.star_path
+        digest = None if self.star_cache is None else file_digest()
+        star, spans = read_star(star_path, STAR_COLUMNS, row_spans = True, digest = digest)
+        self.optics, particles = self._blocks(star)
+        _, self.row_spans = self._blocks(spans)
 
         # <Relion 3.1
-        # For supporting starfile>=0.5 in the future.
-        if len(star) == 1 and (0 in star or '' in star or 'images' in star):
+        if self.optics is None:
             self.version = 2
-            self.optics = None
-            self.particles = star[0] if 0 in star else star[''] if '' in star else star['images']
 
             # Check keys.
             for key in ['rlnOriginX', 'rlnOriginY', 'rlnAngleRot', 'rlnAngleTilt',
                         'rlnAnglePsi', 'rlnVoltage', 'rlnDefocusU', 'rlnDefocusV',
                         'rlnDefocusAngle', 'rlnSphericalAberration',
                         'rlnAmplitudeContrast', 'rlnImageName']:
-                if key not in self.particles:
+                if key not in particles:
                     raise ValueError(f'Key {key} missed in star file {star_path}')
-            if pixel_size is None:
+            if self.pixel_size is None:
                 raise ValueError('Need pixelsize (--angpix) for star file before RELION version 3.1')
 
         # >=Relion 3.1
-        elif len(star) == 2 and ('optics' in star and 'particles' in star):
+        else:
             self.version = 3
-            self.optics = star['optics']
-            self.particles = star['particles']
 
             # Check keys.
             for key in ['rlnVoltage', 'rlnImagePixelSize', 'rlnSphericalAberration',
@@ -70,31 +142,109 @@ class ParticleDataset(object):
             for key in ['rlnOriginXAngst', 'rlnOriginYAngst', 'rlnAngleRot', 'rlnAngleTilt',
                         'rlnAnglePsi', 'rlnDefocusU', 'rlnDefocusV', 'rlnDefocusAngle',
                         'rlnOpticsGroup', 'rlnImageName']:
-                if key not in self.particles:
+                if key not in particles:
                     raise ValueError(f'Key {key} missed in block data_particles in star file {star_path}')
 
-        else:
-            raise ValueError('Invalid particle star file')
+        self._parse_paras(particles)
+        self.random_subsets = particles['rlnRandomSubset'].to_numpy(dtype = np.int32) if 'rlnRandomSubset' in particles else None
+        self.image_name_bytes = None
+        if self.star_cache is not None:
+            image_names = particles['rlnImageName'].str.encode('utf-8').to_numpy(dtype = np.bytes_)
+            self._save_cache(star_path, np.arange(len(self.paras)), self.row_spans, image_names, digest)
 
-        self._parse_paras()
-        self.indices = np.arange(len(self.paras), dtype = np.int64)
-        self.cached_mrc_handles = dict() if enable_cache else None
+    def _load_star_cache(self, star_path : PathLike) -> Optional[dict]:
+        '''
+        Star cache of `star_path`, None if disabled, missing or unreadable.
+        '''
+        if self.star_cache is None:
+            return None
+        try:
+            return load_star_cache(star_path, self.star_cache, self.pixel_size)
+        except (OSError, ValueError, KeyError) as error:
+            logger.debug(f'Cannot load star cache of {str(star_path)}: {error}')
+            return None
+
+    def _load_cache(self, cache : dict):
+        '''
+        Load parsed parameters of particles from the star cache.
+        '''
+        self.version = int(cache['version'])
+        self.optics = pd.DataFrame(cache['optics']) if self.version == 3 else None
+        self.random_subsets = cache.get('random_subsets')
+        self.row_spans = cache['row_spans']
+        self.paras = cache['paras']
+        self.ctf_table = cache['ctf_table']
+        self.i_slcs = cache['i_slcs']
+        self.stack_names = cache['stack_names']
+        self.stack_codes = cache['stack_codes']
+        self.image_name_bytes = cache['image_names']
+        self.stacks = None
+
+    def _save_cache(
+        self,
+        star_path : PathLike,
+        js : NDArray[np.int64],
+        row_spans : NDArray[np.int64],
+        image_names : Optional[NDArray[np.bytes_]] = None,
+        digest = None
+    ):
+        '''
+        Save parsed parameters of particles `js` into the star cache of
+        `star_path`, whose rows of particles have byte spans `row_spans`.
+        `image_names` are UTF-8 rlnImageName of particles `js` if given.
+        `digest` from file_digest already hashed `star_path` if given.
+        '''
+        # Tables of CTFs and stacks are restricted to those of the particles.
+        paras = self.paras[js]
+        used_ctfs, paras[:, 15] = np.unique(paras[:, 15].astype(np.int64), return_inverse = True)
+        used, stack_codes = np.unique(self.stack_codes[js], return_inverse = True)
+        if image_names is None:
+            image_names = self.image_name_bytes[js] if self.image_name_bytes is not None else \
+                np.char.encode(self.image_names[js], 'utf-8')
+        try:
+            save_star_cache(star_path, self.star_cache, {
+                'version'        : self.version,
+                'pixel_size'     : self.pixel_size,
+                'optics'         : None if self.optics is None else self.optics.to_records(index = False),
+                'ctf_table'      : self.ctf_table[used_ctfs],
+                'stack_names'    : self.stack_names[used],
+                'paras'          : paras,
+                'i_slcs'         : self.i_slcs[js],
+                'stack_codes'    : stack_codes.ravel().astype(np.int32),
+                'image_names'    : image_names,
+                'row_spans'      : row_spans,
+                'random_subsets' : None if self.random_subsets is None else self.random_subsets[js]
+            }, file_key(star_path, digest))
+        except OSError as error:
+            # The star cache is an optimization, e.g. its directory may be read-only.
+            logger.debug(f'Cannot save star cache of {str(star_path)}: {error}')
+
+    @staticmethod
+    def _blocks(star : dict):
+        '''
+        Blocks (optics, particles) of a star file, optics is None before RELION 3.1.
+        '''
+        # For supporting starfile>=0.5 in the future.
+        if len(star) == 1 and (0 in star or '' in star or 'images' in star):
+            return None, star[0] if 0 in star else star[''] if '' in star else star['images']
+        elif len(star) == 2 and ('optics' in star and 'particles' in star):
+            return star['optics'], star['particles']
+        raise ValueError('Invalid particle star file')
 
-    def _parse_paras(self):
+    def _parse_paras(self, particles : pd.DataFrame):
         '''
-        Parsing parameters from self.optics, self.particles.
+        Parsing parameters from self.optics and `particles`.
         '''
-        self.paras = np.empty((len(self.particles), 15), dtype = np.float64)
+        self.paras = np.empty((len(particles), 16), dtype = np.float64)
 
         # Handling RELION 3.1 format by merging tables.
-        if self.version == 2:
-            particles = self.particles
-        else:
+        if self.version != 2:
+            # A left merge keeps particles in order, an inner merge groups them by optics group.
             try:
-                particles = pd.merge(self.optics, self.particles, left_on = 'rlnOpticsGroup', right_on = 'rlnOpticsGroup', validate = 'one_to_many')
+                particles = pd.merge(particles, self.optics, how = 'left', on = 'rlnOpticsGroup', validate = 'many_to_one', indicator = True)
             except pd.errors.MergeError:
                 raise ValueError('There are multiple optic groups with same index. Check the star file')
-            if len(particles) != len(self.particles):
+            if np.any(particles['_merge'] != 'both'):
                 raise ValueError('There are particles with no corresponding optic group. Check the star file')
 
         self.paras[:,  0] = particles['rlnOriginX'] if self.version == 2 else particles['rlnOriginXAngst'] / particles['rlnImagePixelSize']
@@ -116,9 +266,45 @@ class ParticleDataset(object):
         self.paras[:, 13] = self.pixel_size if self.version == 2 else particles['rlnImagePixelSize']
         self.paras[:, 14] = psi
 
+        # Group identical CTF parameters, e.g. particles of a micrograph,
+        # so that each distinct CTF is evaluated only once.
+        self.ctf_table, ctf_ids = np.unique(self.paras[:, 6:14], axis = 0, return_inverse = True)
+        self.paras[:, 15] = ctf_ids.ravel()
+
+        # Stacks are categorical, codes into the sorted table of distinct stack names.
         split_data = particles['rlnImageName'].str.split('@', n = 2, expand = True)
         self.i_slcs = split_data[0].to_numpy(dtype = np.int32)
-        self.names = split_data[1].to_numpy(dtype = np.str_)
+        self.stack_codes, self.stack_names = pd.factorize(split_data[1], sort = True)
+        self.stack_names = np.asarray(self.stack_names, dtype = np.str_)
+        self.stack_codes = self.stack_codes.astype(np.int32)
+        self.stacks = None
+
+    def _index_stacks(self):
+        '''
+        Parse the header of each stack once, and check that all stacks exist
+        and hold the slices of their particles.
+        '''
+        names = self.stack_names
+        n_slcs = np.zeros(len(names), dtype = np.int64)
+        np.maximum.at(n_slcs, self.stack_codes, self.i_slcs)
+
+        stacks, errors = [], []
+        for name, n_slc in zip(names, n_slcs):
+            mrc_path : Path = self.data_dir / name
+            try:
+                header = mrc_header(mrc_path)
+                if header[0][0] < n_slc:
+                    errors.append(f'"{str(mrc_path)}" has {header[0][0]} images, but slice {n_slc} is used')
+            except FileNotFoundError:
+                header = None
+                errors.append(f'No such particle stack file: "{str(mrc_path)}"')
+            except ValueError as error:
+                header = None
+                errors.append(str(error))
+            stacks.append((mrc_path, header))
+        if errors:
+            raise FileNotFoundError(f'{len(errors)} of {len(names)} particle stack(s) are missing or invalid:\n' + '\n'.join(errors))
+        self.stacks = stacks
 
     def __len__(self) -> int:
         return len(self.indices)
@@ -127,12 +313,112 @@ class ParticleDataset(object):
         assert 0 <= i < len(self.indices)
         j = self.indices[i]
         assert 0 <= j < len(self.paras)
-        i_slc = self.i_slcs[j]
-        name = self.names[j]
-        mrc_path : Path = self.data_dir / name
-        if not mrc_path.is_file():
-            raise FileNotFoundError(f'No such particle stack file: "{str(mrc_path)}"')
-        return mrcread(mrc_path, i_slc - 1, self.cached_mrc_handles), self.paras[j]
+        return self._read(j), self.paras[j]
+
+    def _read(self, j : int, count : Optional[int] = None, out : Optional[np.ndarray] = None):
+        '''
+        Image of j-th particle, or `count` images of consecutive slices from it
+        in one read, read into `out` if given.
+        '''
+        if self.store is not None:
+            row = self.store_rows[j]
+            img = self.store[row] if count is None else self.store[row : row + count]
+            if out is not None:
+                out[...] = img
+                return out
+            return np.asarray(img, dtype = self.store.dtype if self.dtype is None else self.dtype)
+        if self.stacks is None:
+            self._index_stacks()
+        mrc_path, header = self.stacks[self.stack_codes[j]]
+        if out is None:
+            dtype = header[1].newbyteorder('=') if self.dtype is None else self.dtype
+            out = np.empty((1 if count is None else count, ) + header[0][1:], dtype = dtype)
+            if count is None:
+                out = out[0]
+        stackread(mrc_path, header, self.i_slcs[j] - 1, out.reshape((-1, ) + header[0][1:]), self.handle_cache)
+        return out
+
+    @property
+    def image_format(self) -> Tuple[Tuple[int, ...], np.dtype]:
+        '''
+        Shape and dtype of images as returned by _read, taken from the
+        particle store or the header of the stack of the first particle,
+        without reading any image.
+        '''
+        if self.store is not None:
+            return self.store.shape[1:], self.store.dtype if self.dtype is None else self.dtype
+        if self.stacks is None:
+            self._index_stacks()
+        _, header = self.stacks[self.stack_codes[self.indices[0] if len(self.indices) > 0 else 0]]
+        return header[0][1:], header[1].newbyteorder('=') if self.dtype is None else self.dtype
+
+    def stack_order(self) -> NDArray[np.int64]:
+        '''
+        Permutation of particles sorting them by stack file and slice (or
+        by row of the particle store), so that consecutive slices of a
+        stack can be read at once.
+        '''
+        if self.store is not None:
+            return np.argsort(self.store_rows[self.indices], kind = 'stable')
+        return np.lexsort((self.i_slcs[self.indices], self.stack_codes[self.indices]))
+
+    def iter_batches(self, batch_size : int, prefetch : int = 2, workers : int = 4, stats : Optional[dict] = None):
+        '''
+        Iterate over batches (imgs, paras) of particles in order.
+
+        Batches are read ahead of compute by a pool of `workers` threads
+        into `prefetch + 1` preallocated buffers. Buffers are reused, so
+        images of a batch are only valid until the next one is requested.
+        Runs of consecutive slices of a stack are read at once, see
+        stack_order. If `stats` is given, it accumulates the number of
+        `reads`, `bytes` read and `seconds` spent by workers reading.
+        '''
+        m = len(self)
+        if m == 0:
+            return
+        shape, dtype = self.image_format
+        buffers = [np.empty((batch_size, ) + shape, dtype = dtype) for _ in range(prefetch + 1)]
+        starts = range(0, m, batch_size)
+
+        def read(buffer, runs, offset):
+            time0 = time()
+            for a, b in runs:
+                self._read(self.indices[a], b - a, buffer[a - offset : b - offset])
+            return len(runs), sum(b - a for a, b in runs) * buffer[0].nbytes, time() - time0
+
+        with ThreadPoolExecutor(workers) as pool:
+            def submit(i_batch):
+                # Split the batch into runs of consecutive slices of a stack
+                # (or rows of the particle store), and share runs among workers by number of particles.
+                start = starts[i_batch]
+                stop = min(start + batch_size, m)
+                js = self.indices[start : stop]
+                if self.store is not None:
+                    rows = self.store_rows[js]
+                    breaks = rows[1:] != rows[:-1] + 1
+                else:
+                    codes = self.stack_codes[js]
+                    i_slcs = self.i_slcs[js]
+                    breaks = (codes[1:] != codes[:-1]) | (i_slcs[1:] != i_slcs[:-1] + 1)
+                bounds = np.flatnonzero(breaks) + 1 + start
+                bounds = np.concatenate([[start], bounds, [stop]])
+                runs = list(zip(bounds[:-1], bounds[1:]))
+                groups = np.searchsorted(bounds[1:], np.arange(1, workers) * ceil_div(stop - start, workers) + start, side = 'right')
+                buffer = buffers[i_batch % len(buffers)]
+                return [pool.submit(read, buffer, group, start) for group in np.split(np.array(runs), groups) if len(group) > 0]
+
+            pending = deque(submit(i_batch) for i_batch in range(min(prefetch, len(starts))))
+            for i_batch, start in enumerate(starts):
+                # The buffer of the previous batch is free now.
+                if i_batch + prefetch < len(starts):
+                    pending.append(submit(i_batch + prefetch))
+                for future in pending.popleft():
+                    result = future.result()
+                    if stats is not None:
+                        for key, value in zip(('reads', 'bytes', 'seconds'), result):
+                            stats[key] = stats.get(key, 0) + value
+                stop = min(start + batch_size, m)
+                yield buffers[i_batch % len(buffers)][: stop - start], self.paras[self.indices[start : stop]]
 
     @property
     def trans(self) -> NDArray[np.float64]:
@@ -151,28 +437,62 @@ class ParticleDataset(object):
         return self.paras[self.indices, 14]
 
     @property
-    def data_dict(self) -> dict[str, pd.DataFrame]:
-        particles = self.particles.iloc[self.indices]
-        return {'images' : particles} if self.version == 2 else \
-            {'optics' : self.optics, 'particles' : particles}
+    def ctf_ids(self) -> NDArray[np.int64]:
+        '''Row of self.ctf_table of each particle.'''
+        return self.paras[self.indices, 15].astype(np.int64)
 
     def save(self, output_path : str):
-        starfile.write(self.data_dict, output_path, overwrite = True)
+        '''
+        Save particles of self by copying their rows from the star file,
+        and their parsed parameters into the star cache of the output.
+        '''
+        if os.stat(self.star_path).st_mtime_ns != self.star_mtime:
+            raise RuntimeError(f'{self.star_path} was modified since it was read')
+        digest = None if self.star_cache is None else file_digest()
+        row_spans = write_star_rows(self.star_path, output_path, self.row_spans, self.indices, digest)
+        if self.star_cache is not None:
+            self._save_cache(output_path, self.indices, row_spans, digest = digest)
+
+    @property
+    def image_names(self) -> NDArray[np.str_]:
+        '''
+        rlnImageName of all particles (rows of self.paras), decoded from the
+        star cache, or read from the star file if there is no cache.
+        '''
+        if self.image_name_bytes is None:
+            _, particles = self._blocks(read_star(self.star_path, ['rlnImageName']))
+            return particles['rlnImageName'].to_numpy(dtype = np.str_)
+        try:
+            return self.image_name_bytes.astype(np.str_)
+        except UnicodeDecodeError:
+            return np.char.decode(self.image_name_bytes, 'utf-8')
 
     def n_random_subset(self) -> int:
-        return 1 if 'rlnRandomSubset' not in self.particles else \
-            len(self.particles['rlnRandomSubset'].value_counts())
+        if self.random_subsets is None:
+            return 1
+        lo = self.random_subsets.min()
+        return np.count_nonzero(np.bincount(self.random_subsets - lo))
 
     def get_random_subset(self, i : int):
-        if 'rlnRandomSubset' not in self.particles:
+        if self.random_subsets is None:
             raise ValueError('Key rlnRandomSubset missed in star file')
-        return self.subset(self.particles['rlnRandomSubset'].iloc[self.indices] == i)
+        return self.subset(self.random_subsets[self.indices] == i)
+
+    def _view(self, indices : NDArray[np.int64]):
+        '''
+        Dataset of particles `indices` (rows of self.paras), sharing all
+        arrays and the handle cache with self.
+        '''
+        view = copy(self)
+        view.indices = indices
+        return view
 
     def subset(self, mask):
-        sub = copy(self)
-        sub.indices = self.indices[mask]
-        sub.cached_mrc_handles = self.cached_mrc_handles.copy()
-        return sub
+        '''
+        Subset of particles selected by `mask`, a boolean mask or positions
+        of particles of self.
+        '''
+        return self._view(self.indices[mask])
 
     def union(self, *others):
         if len(others) == 1 and isinstance(others[0], (list, tuple)):
@@ -183,26 +503,34 @@ class ParticleDataset(object):
         for other in others:
             if not isinstance(other, ParticleDataset):
                 raise TypeError('Can only union with ParticleDataset')
-            if other.particles is not self.particles or other.paras is not self.paras or other.i_slcs is not self.i_slcs or other.names is not self.names:
+            if other.paras is not self.paras:
                 raise ValueError('Cannot union subsets from different datasets')
             selected[other.indices] = True
-
-        result = copy(self)
-        result.indices = np.arange(len(self.paras), dtype = np.int64)[selected]
-        return result
+        return self._view(np.flatnonzero(selected))
 
     def complement(self):
-        selected = np.ones(len(self.parent), dtype = np.bool_)
+        selected = np.ones(len(self.paras), dtype = np.bool_)
         selected[self.indices] = False
+        return self._view(np.flatnonzero(selected))
 
-        result = copy(self)
-        result.indices = np.arange(len(self.paras), dtype = np.int64)[selected]
-        return result
-
-    def balance(self):
-        if 'rlnRandomSubset' not in self.particles: return
-        n = self.particles['rlnRandomSubset'].value_counts().min()
-        self.particles = self.particles.groupby('rlnRandomSubset').sample(n = n)
-        self.particles.sort_index(inplace = True)
-        self._parse_paras()
-        self.indices = np.arange(len(self.paras), dtype = np.int64)
+    def balance(self, seed : Optional[int] = 0):
+        '''
+        Randomly drop particles so that all random subsets have the same size.
+        Dropped particles are reproducible for a given `seed`, 0 by default,
+        None draws fresh entropy.
+        '''
+        if self.random_subsets is None: return
+        subsets = self.random_subsets[self.indices]
+        lo = subsets.min()
+        counts = np.bincount(subsets - lo)
+        values = np.flatnonzero(counts)
+        counts = counts[values]
+        n = counts.min()
+
+        # Drawing the dropped particles is cheaper than drawing the kept ones.
+        rng = np.random.default_rng(seed)
+        kept = np.ones(len(self.indices), dtype = np.bool_)
+        for value, count in zip(values, counts):
+            positions = np.flatnonzero(subsets == value + lo)
+            kept[positions[rng.choice(count, count - n, replace = False)]] = False
+        self.indices = self.indices[kept]
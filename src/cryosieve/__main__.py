@@ -18,7 +18,19 @@ def parse_argument():
     parser.add_argument('--retention_ratio',      type = float, default  = 0.8,   help = 'fraction of retained particles in each iteration, 0.8 by default')
     parser.add_argument('--mask',                 type = str,   required = True,  help = 'mask file path')
     parser.add_argument('--balance',              action = 'store_true',          help = 'randomly drop particles to make all subset into the same size')
+    parser.add_argument('--seed',                 type = int,   default  = 0,     help = 'random seed of --balance, 0 by default')
     parser.add_argument('--num_gpus',             type = int,   default  = 1,     help = 'number of gpus to execute CryoSieve core program, 1 by default')
+    parser.add_argument('--backend',              type = str,   default  = 'cuda', choices = ['cuda', 'cpu'], help = 'computing backend of CryoSieve core program, cuda by default')
+    parser.add_argument('--num_threads',          type = int,                     help = 'number of CPU threads for the cpu backend, all available cores by default')
+    parser.add_argument('--projection',           type = str,   default  = 'real', choices = ['real', 'fourier'], help = 'projection engine of CryoSieve core program, real by default')
+    parser.add_argument('--precision',            type = str,   default  = 'float64', choices = ['float64', 'float32', 'mixed'], help = 'floating point precision of CryoSieve core program, float64 by default')
+    parser.add_argument('--max_resolution',       type = float,                   help = 'highest resolution (in Angstrom) used by CryoSieve core program, see cryosieve-core for the change of scores, all frequencies by default')
+    parser.add_argument('--library_step',         type = float,                   help = 'angular step (in degrees) of the projection library of CryoSieve core program, exact projections by default')
+    parser.add_argument('--memory_budget',        type = float,                   help = 'memory budget (in GB) of each device of CryoSieve core program, no budget by default')
+    parser.add_argument('--pack',                 action = 'store_true',          help = 'pack particles into a memory-mapped particle store once, read by CryoSieve core program in all iterations')
+    parser.add_argument('--spectrum_cache',       action = 'store_true',          help = 'cache translated image spectra on disk in the first iteration of CryoSieve core program, and reuse them afterwards')
+    parser.add_argument('--star_cache',           action = 'store_true',          help = 'cache parsed particle parameters of star files of all iterations on disk, so that CryoSieve core program does not parse them again')
+    parser.add_argument('--save_shells',          action = 'store_true',          help = 'save radial shell scores of each iteration for cryosieve-reselect')
     if len(sys.argv) == 1:
         parser.print_help()
         exit()
@@ -29,8 +41,9 @@ def main():
     if args.postprocess_software is not None:
         logger.warning('Argument `--postprocess_software` will be deprecated')
 
-    from .utility import check_cupy
-    check_cupy()
+    if args.backend == 'cuda':
+        from .utility import check_cupy
+        check_cupy()
 
     import numpy as np
     from pathlib import Path
@@ -48,11 +61,15 @@ def main():
     if not dst.is_dir():
         raise ValueError(f'{args.o} is not a directory or cannot be created')
 
-    dataset = ParticleDataset(src, args.directory, args.angpix)
+    star_cache = dst / 'star_cache' if args.star_cache else None
+    dataset = ParticleDataset(src, args.directory, args.angpix, star_cache = star_cache)
     data_dir = dataset.data_dir.absolute()
     logger.info(f'Initialize ParticleDataset with given directory {str(data_dir)}')
-    if args.balance: dataset.balance()
+    if args.balance: dataset.balance(args.seed)
     dataset.save(dst / 'iter0.star')
+    if args.pack:
+        from .pack import pack
+        pack(dataset, dst / 'particles_pack')
 
     # go.
     frequences = 1 / np.linspace(1.0 / args.frequency_start, 1.0 / args.frequency_end, args.num_iters)
@@ -109,6 +126,9 @@ def main():
             f'--i "{str(dst / f"iter{i}.star")}"',
             f'--o "{str(dst / f"iter{i + 1}.star")}"',
             f'--directory "{str(data_dir)}"' if args.directory is not None else '',
+            f'--store "{str(dst / "particles_pack")}"' if args.pack else '',
+            f'--spectrum_cache "{str(dst / "spectrum_cache")}"' if args.spectrum_cache else '',
+            f'--star_cache "{str(star_cache)}"' if star_cache is not None else '',
             f'--angpix {args.angpix}',
             f'--volume "{str(dst / f"iter{i}_half1.mrc")}"',
             f'--volume "{str(dst / f"iter{i}_half2.mrc")}"',
@@ -116,6 +136,14 @@ def main():
             f'--retention_ratio {args.retention_ratio}',
             f'--frequency {frequences[i]:.3f}',
             f'--num_gpus {args.num_gpus}',
+            f'--backend {args.backend}',
+            f'--num_threads {args.num_threads}' if args.num_threads is not None else '',
+            f'--projection {args.projection}',
+            f'--precision {args.precision}',
+            f'--shells "{str(dst / f"iter{i}_shells.npz")}"' if args.save_shells else '',
+            f'--library_step {args.library_step} --sym {args.sym}' if args.library_step is not None else '',
+            f'--max_resolution {args.max_resolution}' if args.max_resolution is not None else '',
+            f'--memory_budget {args.memory_budget}' if args.memory_budget is not None else '',
         ])
         run_commands(command, f'sieve (iteration {i})')
         overall_retention_ratio *= args.retention_ratio
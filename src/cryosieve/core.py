@@ -7,12 +7,33 @@ def parse_arguments():
     parser.add_argument('--i',               type = str,   required = True, help = 'input star file path')
     parser.add_argument('--o',               type = str,   required = True, help = 'output star file path')
     parser.add_argument('--directory',       type = str,                    help = 'directory of particles')
+    parser.add_argument('--store',           type = str,                    help = 'particle store of cryosieve-pack, particles are read from it instead of stacks')
+    parser.add_argument('--max_open_stacks', type = int,   default  = 512,  help = 'maximal number of particle stacks kept open, least recently used ones are closed, 512 by default')
     parser.add_argument('--angpix',          type = float,                  help = 'pixelsize in Angstrom')
-    parser.add_argument('--volume',          type = str,   required = True, action = 'append', help = 'list of volume file paths')
-    parser.add_argument('--mask',            type = str,                    help = 'mask file path')
+    parser.add_argument('--volume',          type = str,   required = True, action = 'append', nargs = '+', help = 'list of volume file paths, one --volume for each particle subset, candidate volumes of a subset are given together')
+    parser.add_argument('--mask',            type = str,                    action = 'append', help = 'mask file path, repeat to score several masks')
+    parser.add_argument('--mask_threshold',  type = float,                  help = 'mask values not above it are set to zero, so that projection skips more empty voxels, no threshold by default')
     parser.add_argument('--retention_ratio', type = float, required = True, help = 'fraction of retained particles')
     parser.add_argument('--frequency',       type = float, required = True, help = 'cut-off highpass frequency')
     parser.add_argument('--num_gpus',        type = int,   default  = 1,    help = 'number of GPUs to execute the cryosieve program, 1 by default')
+    parser.add_argument('--backend',         type = str,   default  = 'cuda', choices = ['cuda', 'cpu'], help = 'computing backend, cuda by default')
+    parser.add_argument('--num_threads',     type = int,                    help = 'number of CPU threads for the cpu backend, all available cores by default')
+    parser.add_argument('--projection',      type = str,   default  = 'real', choices = ['real', 'fourier'], help = 'projection engine, real-space projection or Fourier central-slice extraction, real by default')
+    parser.add_argument('--fourier_pad',     type = int,   default  = 2,    help = 'oversampling factor of Fourier volumes for the fourier projection engine, 2 by default')
+    parser.add_argument('--precision',       type = str,   default  = 'float64', choices = ['float64', 'float32', 'mixed'], help = 'floating point precision of scoring, mixed runs in float32 and accumulates norms in float64, float64 by default')
+    parser.add_argument('--ctf_cache',       type = int,   default  = 256,  help = 'number of distinct CTFs cached on each device, 0 to disable, 256 by default')
+    parser.add_argument('--shells',          type = str,                    help = 'output .npz file of residual and image powers of particles in radial Fourier shells, for re-selecting by cryosieve-reselect without rescoring')
+    parser.add_argument('--max_resolution',  type = float,                  help = 'highest resolution (in Angstrom) used in scoring, images and volumes are Fourier cropped to the smallest box holding it, which changes scores from full box ones by 0.4%%-4.8%% (3/4 box) and 1.3%%-15%% (1/2 box) with real projection, 0.04%%-1.0%% and 0.14%%-4.3%% with fourier projection, all frequencies by default')
+    parser.add_argument('--cascade_resolution', type = float,               help = 'resolution (in Angstrom) of a coarse scoring pass, only particles near the retention cutoff are then rescored at full fidelity, no cascade by default')
+    parser.add_argument('--cascade_band',    type = float, default  = 3.,   help = 'half width of the rescored band around the cutoff of --cascade_resolution, in standard deviations of coarse to full score calibration, 3 by default')
+    parser.add_argument('--mask_crop',       action = 'store_true',         help = 'crop volumes and particle images to the support of masks, plus a padding margin')
+    parser.add_argument('--crop_padding',    type = int,   default  = 16,   help = 'least padding margin (in pixels) of --mask_crop, enlarged to the CTF delocalization of the largest defocus at --max_resolution, 16 by default')
+    parser.add_argument('--crop_tolerance',  type = float, default  = 0.02, help = 'largest relative L2 change of scores of 200 sampled particles of each subset by --mask_crop, particles are scored in the full box if it is exceeded, 0.02 by default')
+    parser.add_argument('--library_step',    type = float,                  help = 'angular step (in degrees) of the projection library, projections of particles are in-plane rotated library entries, exact projections by default')
+    parser.add_argument('--sym',             type = str,   default  = 'C1', help = 'molecular symmetry folding the projection library, only C and D groups are supported, C1 by default')
+    parser.add_argument('--memory_budget',   type = float,                  help = 'memory budget (in GB) of each device, or of each scoring thread of the cpu backend including its read-ahead image buffers, batch sizes are planned to fit it and real-space volumes are streamed in slabs if needed, no budget by default')
+    parser.add_argument('--spectrum_cache',  type = str,                    help = 'directory of an on-disk cache of translated image spectra (complex128 for float64 precision, complex64 otherwise), reused while particles, origins, box sizes and precision are unchanged, no cache by default')
+    parser.add_argument('--star_cache',      type = str,                    help = 'directory of caches of parsed particle parameters of the input and output star files, reused while a star file is unchanged (same size, mtime and hash of its content), no cache by default')
     if len(sys.argv) == 1:
         parser.print_help()
         exit()
@@ -22,50 +43,211 @@ def process(args):
     import numpy as np
     from pathlib import Path
     from .ParticleDataset import ParticleDataset
-    from .utility import mrcread
-    from .sieve import sieve
+    from .utility import ctf_delocalization, mask_radius, mrcread
+    from .sieve import cascade, score
+    from .spectrum_cache import SpectrumCache
 
     # Initialize.
-    from cupy.cuda.runtime import getDeviceCount
-    if args.num_gpus < 1:
-        raise ValueError('`--num_gpus` should be positive')
-    if args.num_gpus > getDeviceCount():
-        raise ValueError(f'`--num_gpus` is {args.num_gpus}, but only {getDeviceCount()} CUDA device(s) are available')
+    from .kernels import PRECISIONS, complex_dtype, get_backend, num_shells
+    backend = get_backend(args.backend)
+    dtype, acc_dtype = PRECISIONS[args.precision]
+    logger.info(f'Use {args.precision} precision, computing in {np.dtype(dtype).name} and accumulating norms in {np.dtype(acc_dtype).name}')
+    if args.backend == 'cuda':
+        if args.num_gpus < 1:
+            raise ValueError('`--num_gpus` should be positive')
+        if args.num_gpus > backend.device_count():
+            raise ValueError(f'`--num_gpus` is {args.num_gpus}, but only {backend.device_count()} CUDA device(s) are available')
+        num_devices = args.num_gpus
+    else:
+        num_threads = backend.device_count() if args.num_threads is None else args.num_threads
+        if num_threads < 1:
+            raise ValueError('`--num_threads` should be positive')
+        # Each scoring thread takes a part of the dataset, remaining cores go to FFTs.
+        backend.set_workers(max(1, backend.device_count() // num_threads))
+        num_devices = num_threads
+        logger.info(f'Use cpu backend with {num_threads} scoring thread(s)')
 
     # Input.
-    dataset     = ParticleDataset(args.i, args.directory, args.angpix)
-    volumes     = [np.asarray(mrcread(path), dtype = np.float64) for path in args.volume]
-    mask_volume = np.asarray(mrcread(args.mask), dtype = np.float64)
-    volumes     = [volume * mask_volume for volume in volumes]
-    ratio       = args.retention_ratio
-    threshold   = args.angpix / args.frequency
-    output_path = Path(args.o)
-    logger.info(f'Initialize ParticleDataset with given directory {str(dataset.data_dir.absolute())}')
+    if args.max_open_stacks < 1:
+        raise ValueError('`--max_open_stacks` should be positive')
+    dataset     = ParticleDataset(args.i, args.directory, args.angpix, dtype = dtype, store = args.store, max_open_stacks = args.max_open_stacks, star_cache = args.star_cache)
+    volumes     = [[np.asarray(mrcread(path), dtype = dtype) for path in paths] for paths in args.volume]
+    masks       = [np.asarray(mrcread(path), dtype = dtype) for path in args.mask] if args.mask is not None else [dtype(1)]
+    if args.mask_threshold is not None:
+        if args.mask is None:
+            raise ValueError('`--mask_threshold` needs `--mask`')
+        masks = [np.where(mask > args.mask_threshold, mask, dtype(0)) for mask in masks]
+        logger.info(f'Zero mask values not above {args.mask_threshold}, keeping {", ".join(f"{np.count_nonzero(mask) / mask.size * 100:.2f}%" for mask in masks)} of voxels')
+
+    # The k-th score of a subset is against its k-th volume under the k-th mask,
+    # a single volume or mask is shared by all scores.
+    n_volume = set(len(paths) for paths in volumes)
+    if len(n_volume) != 1:
+        raise ValueError('All particle subsets should have the same number of volumes')
+    n_volume = n_volume.pop()
+    n_score = max(n_volume, len(masks))
+    if n_volume not in (1, n_score) or len(masks) not in (1, n_score):
+        raise ValueError(f'Cannot pair {n_volume} volume(s) of each subset with {len(masks)} mask(s)')
+    volumes     = [[paths[min(k, n_volume - 1)] * masks[min(k, len(masks) - 1)] for k in range(n_score)] for paths in volumes]
+    if n_score > 1:
+        logger.info(f'Score each particle against {n_score} masked volumes')
+    n = volumes[0][0].shape[0]
+    threshold      = args.angpix / args.frequency
+    threshold_high = 1.
+    if args.max_resolution is not None:
+        threshold_high = args.angpix / args.max_resolution
+        if threshold_high <= threshold:
+            raise ValueError('`--max_resolution` should be higher than `--frequency`')
+    if args.cascade_resolution is not None:
+        coarse_threshold_high = args.angpix / args.cascade_resolution
+        if not threshold < coarse_threshold_high < threshold_high:
+            raise ValueError('`--cascade_resolution` should be between `--frequency` and `--max_resolution`')
+        if args.shells is not None:
+            raise ValueError('`--cascade_resolution` cannot be used with `--shells`')
+        if args.spectrum_cache is not None:
+            raise ValueError('`--cascade_resolution` cannot be used with `--spectrum_cache`')
+    if args.projection == 'fourier' and args.fourier_pad < 1:
+        raise ValueError('`--fourier_pad` should be positive')
+    memory_budget = None
+    if args.memory_budget is not None:
+        if args.memory_budget <= 0:
+            raise ValueError('`--memory_budget` should be positive')
+        memory_budget = int(args.memory_budget * 2 ** 30)
+
+    def prepare(volumes, size, threshold_high):
+        # Fourier crop to the smallest box holding frequencies up to
+        # threshold_high, and transform for the fourier projection engine.
+        # Real-space projection needs the gridding correction of trilinear
+        # interpolation in the cropped box.
+        box = min(size, 2 * int(np.ceil(threshold_high * size)))
+        if box < size:
+            volumes = [[backend.fourier_crop3(volume, box, trilinear = args.projection == 'real') for volume in subset_volumes] for subset_volumes in volumes]
+        if args.projection == 'fourier':
+            volumes = [[backend.prepare_fourier_volume(volume, args.fourier_pad) for volume in subset_volumes] for subset_volumes in volumes]
+        return volumes, box
 
     # Process.
     n_subset = dataset.n_random_subset()
     if n_subset != len(volumes):
         raise ValueError('Number of particle subsets should be the same as number of input volumes')
 
-    mask = np.zeros(len(dataset), dtype = np.bool_)
+    # Masked volumes vanish outside the support of masks, so do their projections,
+    # up to the delocalization of their signal by CTFs.
+    window = n
+    if args.mask_crop:
+        if args.mask is None:
+            raise ValueError('`--mask_crop` needs `--mask`')
+        radius = max(mask_radius(mask) for mask in masks)
+        delocalization = ctf_delocalization(dataset.ctf_table, threshold_high)
+        padding = max(args.crop_padding, delocalization)
+        window = min(n, 2 * int(np.ceil(radius + padding)))
+        logger.info(f'Mask support radius {radius:.1f} pixels, CTF delocalization {delocalization:.1f} pixels, crop to a {window} pixels window with padding {padding:.1f} pixels')
+    if window < n:
+        o = n // 2 - window // 2
+        cropped_volumes = [[volume[o : o + window, o : o + window, o : o + window] for volume in subset_volumes] for subset_volumes in volumes]
+
+        # Crop only if scores of sampled particles stay within tolerance of full box ones.
+        for i in range(n_subset):
+            subset = dataset.get_random_subset(i + 1)
+            sample = np.zeros(len(subset), dtype = np.bool_)
+            sample[np.random.default_rng(i).permutation(len(subset))[:200]] = True
+            subset = subset.subset(sample)
+            full_volumes, full_box = prepare(volumes[i : i + 1], n, threshold_high)
+            crop_volumes, crop_box = prepare(cropped_volumes[i : i + 1], window, threshold_high)
+            g_full = score(subset, full_volumes[0], threshold, num_devices, args.backend, args.projection, args.precision, args.ctf_cache, None, args.library_step, args.sym, threshold_high, full_box, None, memory_budget)
+            g_crop = score(subset, crop_volumes[0], threshold, num_devices, args.backend, args.projection, args.precision, args.ctf_cache, None, args.library_step, args.sym, threshold_high, crop_box, window, memory_budget)
+            error = np.linalg.norm(g_crop - g_full) / np.linalg.norm(g_full)
+            rank = np.corrcoef(np.argsort(np.argsort(g_crop[:, 0])), np.argsort(np.argsort(g_full[:, 0])))[0, 1]
+            logger.info(f'Mask crop changes scores of {len(subset)} sampled particles of subset {i} by {error * 100:.2f}% (relative L2), rank correlation {rank:.4f}')
+            if not error <= args.crop_tolerance:
+                logger.warning(f'Mask crop changes scores by more than `--crop_tolerance` {args.crop_tolerance * 100:.2f}%, score in the full box')
+                window = n
+                break
+        if window < n:
+            volumes = cropped_volumes
+        del cropped_volumes
+    if args.cascade_resolution is not None:
+        coarse_volumes, coarse_box = prepare(volumes, window, coarse_threshold_high)
+        logger.info(f'Cascade scores up to {args.cascade_resolution} Angstrom in a {coarse_box} pixels box first')
+    volumes, box = prepare(volumes, window, threshold_high)
+    if args.max_resolution is not None:
+        logger.info(f'Score up to {args.max_resolution} Angstrom in a {box} pixels box, Fourier cropped from {window} pixels')
+        if args.projection == 'real' and box < window:
+            logger.warning('Real projection in a Fourier cropped box changes scores from full box ones by up to 15% at half box size, `--projection fourier` changes them by up to 4.3%')
+    if args.projection == 'fourier':
+        logger.info(f'Prepare Fourier volumes with oversampling factor {args.fourier_pad}')
+    if args.library_step is not None:
+        if args.library_step <= 0:
+            raise ValueError('`--library_step` should be positive')
+        logger.info(f'Use projection library with angular step {args.library_step} degrees and symmetry {args.sym}')
+    spectra = None
+    if args.spectrum_cache is not None:
+        spectra = SpectrumCache(args.spectrum_cache, dataset, window, box, complex_dtype(dtype))
+    ratio       = args.retention_ratio
+    output_path = Path(args.o)
+    logger.info(f'Initialize ParticleDataset with given directory {str(dataset.data_dir.absolute())}')
+
+    scores = np.zeros((len(dataset), n_score), dtype = np.float64)
+    mask = np.zeros((len(dataset), n_score), dtype = np.bool_)
+    if args.shells is not None:
+        shells = np.zeros((len(dataset), n_score, 2, num_shells(box)), dtype = np.float32)
     for i in range(n_subset):
         subset = dataset.get_random_subset(i + 1)
         logger.info(f'Start sieving subset {i}, {len(subset)} particles')
         n_rem = round(ratio * len(subset))
-        subset_rem = sieve(subset, volumes[i], threshold, n_rem, args.num_gpus)
-        mask[subset_rem.indices] = True
+        subset_shells = None if args.shells is None else np.empty((len(subset), ) + shells.shape[1:], dtype = np.float64)
+        if args.cascade_resolution is None:
+            g = score(subset, volumes[i], threshold, num_devices, args.backend, args.projection, args.precision, args.ctf_cache, subset_shells, args.library_step, args.sym, threshold_high, box, window if window < n else None, memory_budget, spectra)
+        else:
+            g = cascade(subset, volumes[i], coarse_volumes[i], threshold, n_rem, num_devices, args.backend, args.projection, args.precision, args.ctf_cache, args.library_step, args.sym, threshold_high, box, window if window < n else None, coarse_threshold_high, coarse_box, args.cascade_band, memory_budget = memory_budget)
+        for k in range(n_score):
+            mask[subset.indices[np.argsort(g[:, k])[:n_rem]], k] = True
+        scores[subset.indices] = g
+
+        if args.shells is not None:
+            shells[subset.indices] = subset_shells
         logger.info(f'Finish sieving subset {i}, {n_rem} particles remained')
 
-    dataset_rem = dataset.subset(mask)
-    dataset_sie = dataset.subset(~mask)
-    dataset_rem.save(output_path)
-    dataset_sie.save(output_path.with_stem(output_path.stem + '_sieved'))
+    if spectra is not None:
+        spectra.finish()
+    if args.store is None:
+        logger.info(f'Stack handle cache: {dataset.handle_cache.stats()}')
+
+    # With several scores, outputs of the k-th one are suffixed by _k{k}.
+    names = dataset.image_names
+    for k in range(n_score):
+        suffix = f'_k{k}' if n_score > 1 else ''
+        score_path = output_path.with_stem(output_path.stem + suffix)
+        dataset.subset(mask[:, k]).save(score_path)
+        dataset.subset(~mask[:, k]).save(score_path.with_stem(score_path.stem + '_sieved'))
+        if args.shells is not None:
+            shells_path = Path(args.shells)
+            np.savez(
+                shells_path.with_stem(shells_path.stem + suffix),
+                residual       = shells[:, k, 0],
+                power          = shells[:, k, 1],
+                names          = names,
+                n              = window,
+                angpix         = args.angpix,
+                threshold_high = threshold_high
+            )
+    if args.shells is not None:
+        logger.info(f'Save scores of {shells.shape[3]} radial shells to {args.shells}')
+    if n_score > 1:
+        import pandas as pd
+        table = pd.DataFrame(scores, columns = [f'score_k{k}' for k in range(n_score)])
+        table.insert(0, 'rlnImageName', names)
+        table.to_csv(output_path.with_name(output_path.stem + '_scores.csv'), index = False)
+        for k in range(1, n_score):
+            overlap = np.count_nonzero(mask[:, 0] & mask[:, k]) / max(1, np.count_nonzero(mask[:, 0]))
+            logger.info(f'Selection of score k{k} overlaps {overlap * 100:.2f}% with score k0')
 
 def main():
     args = parse_arguments()
 
-    from .utility import check_cupy
-    check_cupy()
+    if args.backend == 'cuda':
+        from .utility import check_cupy
+        check_cupy()
 
     from time import time
     time0 = time()
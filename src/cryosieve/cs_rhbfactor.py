@@ -68,24 +68,25 @@ def main():
         f'halving levels={args.halves + 1}'
     )
 
-    # For each star file, take random halves and save it to a temporary file.
+    # For each star file, take random halves and save it to a temporary file,
+    # whose rows are copied verbatim from the star file.
+    import numpy as np
     import pandas as pd
-    import starfile
+    from .star import read_star, write_star_rows
     tmpdir = csvpath.parent.joinpath('tmp')
     tmpdir.mkdir(exist_ok = True)
     list_path = tmpdir.joinpath('list.txt')
     i_particle_sets = 0
     with open(list_path, 'w') as lst_file:
         for i, meta_path in enumerate(particle_meta_paths):
-            star = starfile.read(meta_path, always_dict = True)
+            star, spans = read_star(meta_path, ['rlnRandomSubset'], row_spans = True)
             if len(star) == 1 and (0 in star or '' in star or 'images' in star):
-                optics = None
-                particles = star[0] if 0 in star else star[''] if '' in star else star['images']
+                key = 0 if 0 in star else '' if '' in star else 'images'
             elif len(star) == 2 and ('optics' in star and 'particles' in star):
-                optics = star['optics']
-                particles = star['particles']
+                key = 'particles'
             else:
                 raise ValueError('Invalid particle star file')
+            particles, particle_spans = star[key], spans[key]
 
             for j in range(args.repeat):
                 for k in range(args.halves + 1):
@@ -93,10 +94,7 @@ def main():
                                   pd.concat([particles[particles['rlnRandomSubset'] == 1].sample(frac = 0.5 ** k),
                                              particles[particles['rlnRandomSubset'] == 2].sample(frac = 0.5 ** k)])
                     tmpfile = f'{str(tmpdir)}/{i}_{j}_{k}.star'
-                    if optics is None:
-                        starfile.write({'images' : particles_j}, tmpfile, overwrite = True)
-                    else:
-                        starfile.write({'optics' : optics, 'particles' : particles_j}, tmpfile, overwrite = True)
+                    write_star_rows(meta_path, tmpfile, particle_spans, np.sort(particles_j.index.to_numpy()))
                     i_particle_sets += 1
                     logger.info(f'[{i_particle_sets}/{num_particle_sets}] Generated RH-factor particle set {tmpfile} (source={meta_path}, repeat={j + 1}/{args.repeat}, halving={k}/{args.halves})')
                     print(tmpfile, file = lst_file)
@@ -0,0 +1,88 @@
+import numpy as np
+from collections import OrderedDict
+from numpy.typing import ArrayLike, DTypeLike
+from .kernels import real_dtype
+
+class CTFCache(object):
+    '''
+    Bounded LRU cache of CTFs evaluated in Fourier domain.
+
+    Entries are rows of `ctf_table` (see ParticleDataset.ctf_table),
+    stored in a preallocated table of `capacity` slots on the device
+    of `backend`, and evaluated on a shared frequency grid.
+    '''
+
+    def __init__(self, backend, ctf_table : ArrayLike, capacity : int = 256, dtype : DTypeLike = np.float64):
+        assert capacity > 0
+        self.backend = backend
+        self.ctf_table = np.asarray(ctf_table, dtype = np.float64)
+        self.capacity = capacity
+        self.dtype = real_dtype(dtype)
+        self.n = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _reset(self, n : int):
+        self.n = n
+        self.grid = self.backend.ctf_grid(n, self.dtype)
+        self.table = None
+        self.slots = OrderedDict()
+
+    def get(self, ctf_ids : ArrayLike, n : int):
+        '''CTFs of a batch of particles.
+
+        Returns
+        -------
+        f_ctf : ArrayLike
+            shape (k, n, n // 2 + 1), dtype as given
+        index : ArrayLike
+            shape (m, ), dtype int32, CTF of i-th particle is f_ctf[index[i]]
+        '''
+        xp = self.backend.xp
+        ids, inverse = np.unique(np.asarray(ctf_ids, dtype = np.int64), return_inverse = True)
+        inverse = inverse.ravel()
+
+        # Too many distinct CTFs for the cache, evaluate them directly.
+        if len(ids) > self.capacity:
+            self.misses += len(ids)
+            f_ctf = self.backend.get_ctf_from_grid(self.ctf_table[ids], self.ctf_grid(n))
+            return f_ctf, xp.asarray(inverse, dtype = np.int32)
+
+        self.ctf_grid(n)
+        missing = []
+        for i in ids:
+            if i in self.slots:
+                self.slots.move_to_end(i)
+                self.hits += 1
+            else:
+                missing.append(i)
+        self.misses += len(missing)
+
+        # Entries used by this batch are most recent, thus never evicted here.
+        if missing:
+            if self.table is None:
+                self.table = xp.empty((self.capacity, n, n // 2 + 1), dtype = self.dtype)
+            free = []
+            for i in missing:
+                if len(self.slots) < self.capacity:
+                    slot = len(self.slots)
+                else:
+                    _, slot = self.slots.popitem(last = False)
+                    self.evictions += 1
+                self.slots[i] = slot
+                free.append(slot)
+            self.table[xp.asarray(free)] = self.backend.get_ctf_from_grid(self.ctf_table[missing], self.grid)
+
+        slots = np.array([self.slots[i] for i in ids], dtype = np.int32)
+        return self.table, xp.asarray(slots[inverse])
+
+    def ctf_grid(self, n : int):
+        if self.n != n:
+            self._reset(n)
+        return self.grid
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total > 0 else 0.
+        return f'{self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), {self.evictions} evictions'
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+
+class HandleCache(object):
+    '''
+    Thread-safe bounded LRU cache of open file handles.
+
+    Handles are opened by the given opener on a miss, and are closed when
+    evicted (by their close method if any, otherwise by dropping the last
+    reference, as for numpy memmaps). Handles in use are never evicted,
+    so the cache may hold more than `capacity` handles for a while.
+    '''
+
+    def __init__(self, capacity : int = 512):
+        assert capacity > 0
+        self.capacity = capacity
+        self.handles = OrderedDict()
+        self.users = dict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextmanager
+    def open(self, key, opener):
+        '''Context of the handle of `key`, opened by opener(key) on a miss.'''
+        with self.lock:
+            if key in self.handles:
+                self.handles.move_to_end(key)
+                self.hits += 1
+                handle = self.handles[key]
+            else:
+                self.misses += 1
+                handle = None
+            self.users[key] = self.users.get(key, 0) + 1
+
+        # Open outside the lock, a concurrent miss of the same key keeps the first handle.
+        if handle is None:
+            try:
+                handle = opener(key)
+            except BaseException:
+                self._release(key)
+                raise
+            with self.lock:
+                if key in self.handles:
+                    self._close(handle)
+                    handle = self.handles[key]
+                else:
+                    self.handles[key] = handle
+                    self._evict()
+        try:
+            yield handle
+        finally:
+            self._release(key)
+
+    def _release(self, key):
+        with self.lock:
+            self.users[key] -= 1
+            if self.users[key] == 0:
+                del self.users[key]
+            self._evict()
+
+    def _evict(self):
+        if len(self.handles) <= self.capacity:
+            return
+        for key in list(self.handles):
+            if len(self.handles) <= self.capacity:
+                break
+            if key not in self.users:
+                self._close(self.handles.pop(key))
+                self.evictions += 1
+
+    @staticmethod
+    def _close(handle):
+        close = getattr(handle, 'close', None)
+        if close is not None:
+            close()
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.handles):
+                if key not in self.users:
+                    self._close(self.handles.pop(key))
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total > 0 else 0.
+        return f'{self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), {self.evictions} evictions'
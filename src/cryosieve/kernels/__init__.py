@@ -1,8 +1,57 @@
+import numpy as np
+
 def ceil_div(x, y):
     return (x - 1) // y + 1
 
-from .bandpass import bandpass2d, lowpass2d, highpass2d
-from .ctf import get_ctf, convolute_ctf
-from .project import project
-from .translate import translate
-from .rotate import rotate2d
+PRECISIONS = {
+    # precision : (dtype of computation, dtype of norm accumulation)
+    'float64' : (np.float64, np.float64),
+    'float32' : (np.float32, np.float32),
+    'mixed'   : (np.float32, np.float64),
+}
+
+def real_dtype(dtype) -> np.dtype:
+    '''float32 for single precision (real or complex) dtypes, float64 otherwise.'''
+    return np.dtype(np.float32) if np.dtype(dtype) in (np.float32, np.complex64) else np.dtype(np.float64)
+
+def complex_dtype(dtype) -> np.dtype:
+    return np.dtype(np.complex64) if real_dtype(dtype) == np.float32 else np.dtype(np.complex128)
+
+def ctype(dtype) -> str:
+    '''C type name of the real dtype, used to instantiate CUDA templates.'''
+    return 'float' if real_dtype(dtype) == np.float32 else 'double'
+
+def num_shells(n : int) -> int:
+    '''Number of radial Fourier shells of a half-plane spectrum of box size n.'''
+    return int(np.hypot(n // 2, n // 2)) + 1
+
+BACKENDS = ('cuda', 'cpu')
+
+def get_backend(name : str = 'cuda'):
+    '''Get kernel backend by name
+
+    Parameters
+    ----------
+    name : str
+        'cuda' (CuPy RawKernels) or 'cpu' (NumPy/SciPy)
+
+    Returns
+    -------
+    backend : module
+        module exposing the kernels together with `xp`, `asnumpy`,
+        `set_device`, `device_count` and `memory_usage`
+    '''
+    if name == 'cuda':
+        from . import cuda as backend
+    elif name == 'cpu':
+        from . import cpu as backend
+    else:
+        raise ValueError(f'Unknown backend {name}, should be one of {BACKENDS}')
+    return backend
+
+def __getattr__(name):
+    # Kernels are resolved lazily, so that importing this package (and the
+    # CPU backend) does not require CuPy.
+    if name in ('bandpass2d', 'lowpass2d', 'highpass2d', 'get_ctf', 'convolute_ctf', 'project', 'translate', 'rotate2d'):
+        return getattr(get_backend('cuda'), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,28 @@
+import numpy as xp
+from .fft import set_workers, rfft2, irfft2, fourier_crop2, fourier_crop3
+from .bandpass import bandpass2d, lowpass2d, highpass2d
+from .ctf import get_ctf, convolute_ctf, ctf_grid, get_ctf_from_grid
+from .project import project, volume_support
+from .fourier_project import prepare_fourier_volume, project_fourier
+from .translate import translate
+from .rotate import rotate2d
+from .score import score_fourier, score_shells
+
+name = 'cpu'
+device_name = 'CPU'
+
+def asnumpy(array):
+    return xp.asarray(array)
+
+def device_count() -> int:
+    import os
+    return os.cpu_count() or 1
+
+def set_device(device_id : int):
+    pass
+
+def memory_usage() -> int:
+    '''Peak memory (in bytes) of allocations traced by tracemalloc since
+    tracing started, summed over all threads, 0 if not tracing.'''
+    import tracemalloc
+    return tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
@@ -0,0 +1,69 @@
+import numpy as np
+from numpy.typing import ArrayLike
+from .fft import rfft2, irfft2, rfreq2
+from .. import real_dtype
+
+def _bandpass2d(stack : ArrayLike, threshold_low : float, threshold_high : float) -> np.ndarray:
+    stack = np.asarray(stack, dtype = real_dtype(getattr(stack, 'dtype', np.float64)))
+    m = stack.shape[0]
+    n = stack.shape[1]
+    assert stack.shape == (m, n, n)
+
+    x, y = rfreq2(n, stack.dtype)
+    f = np.hypot(x / n, y / n)
+    f_stack = rfft2(stack)
+    f_stack[:, (f < threshold_low) | (f > threshold_high)] = 0
+    return irfft2(f_stack, n)
+
+def bandpass2d(stack : ArrayLike, threshold_low : float, threshold_high : float) -> np.ndarray:
+    '''Bandpass filter
+
+    Parameters
+    ----------
+    stack : ArrayLike
+        shape (m, n, n), dtype float32 or float64
+    threshold_low : float
+        dimensionless, in range [0, 1]
+    threshold_high : float
+        dimensionless, in range [0, 1]
+
+    Returns
+    -------
+    new_stack : numpy.ndarray
+        shape (m, n, n), same precision as stack
+    '''
+    return _bandpass2d(stack, threshold_low, threshold_high)
+
+def lowpass2d(stack : ArrayLike, threshold : float) -> np.ndarray:
+    '''Lowpass filter
+
+    Parameters
+    ----------
+    stack : ArrayLike
+        shape (m, n, n), dtype float32 or float64
+    threshold : float
+        dimensionless, in range [0, 1]
+
+    Returns
+    -------
+    new_stack : numpy.ndarray
+        shape (m, n, n), same precision as stack
+    '''
+    return _bandpass2d(stack, 0., threshold)
+
+def highpass2d(stack : ArrayLike, threshold : float) -> np.ndarray:
+    '''Highpass filter
+
+    Parameters
+    ----------
+    stack : ArrayLike
+        shape (m, n, n), dtype float32 or float64
+    threshold : float
+        dimensionless, in range [0, 1]
+
+    Returns
+    -------
+    new_stack : numpy.ndarray
+        shape (m, n, n), same precision as stack
+    '''
+    return _bandpass2d(stack, threshold, 1.)
@@ -0,0 +1,116 @@
+import numpy as np
+from numpy.typing import ArrayLike, DTypeLike
+from .fft import rfft2, irfft2, rfreq2
+from .. import real_dtype
+
+def get_ctf(ctfs : ArrayLike, n : int, order : int = 1, dtype : DTypeLike = np.float64) -> np.ndarray:
+    '''Get CTF in Fourier domain
+
+    Parameters
+    ----------
+    ctfs : ArrayLike
+        shape (m, 8), dtype float64,
+        (voltage, defocus 1, defocus 2, astimatism angle, Cs, amplitude contrast, phase shift, pixelsize)
+    order : int
+    dtype : DTypeLike
+        float32 or float64 (by default), precision of evaluation
+
+    Returns
+    -------
+    f_ctf : numpy.ndarray
+        shape (m, n, n // 2 + 1), dtype as given,
+        CTF ** order
+    '''
+    dtype = real_dtype(dtype)
+    ctfs = np.asarray(ctfs, dtype = dtype)
+    m = ctfs.shape[0]
+    assert ctfs.shape == (m, 8)
+
+    voltage, defocusU, defocusV, astigmatism, Cs, amplitudeContrast, phaseShift, pixelSize = \
+        (ctfs[:, i, None, None] for i in range(8))
+    x, y = rfreq2(n, dtype)
+    waveLength = 12.2643247 / np.sqrt(voltage * (1 + voltage * 0.978466e-6))
+    f2 = (x ** 2 + y ** 2) / (pixelSize * n) ** 2
+    alpha = np.arctan2(y, x) - astigmatism
+    defocus = -(defocusU + defocusV + (defocusU - defocusV) * np.cos(2 * alpha)) / 2
+    chi = np.pi * waveLength * defocus * f2 + np.pi / 2 * Cs * waveLength ** 3 * f2 ** 2 - phaseShift
+    f_ctf = -np.sqrt(1 - amplitudeContrast ** 2) * np.sin(chi) + amplitudeContrast * np.cos(chi)
+    return f_ctf ** order
+
+def ctf_coefficients(ctfs : ArrayLike) -> np.ndarray:
+    '''Per-CTF constants used by get_ctf_from_grid
+
+    Returns
+    -------
+    coefs : numpy.ndarray
+        shape (m, 10), dtype float64,
+        (wave length, defocus 1, defocus 2, cos(2 * astigmatism angle), sin(2 * astigmatism angle),
+         Cs, sqrt(1 - amplitude contrast ** 2), amplitude contrast, phase shift, 1 / pixelsize ** 2)
+    '''
+    ctfs = np.asarray(ctfs, dtype = np.float64)
+    voltage, defocusU, defocusV, astigmatism, Cs, amplitudeContrast, phaseShift, pixelSize = ctfs.T
+    return np.stack([
+        12.2643247 / np.sqrt(voltage * (1 + voltage * 0.978466e-6)),
+        defocusU, defocusV, np.cos(2 * astigmatism), np.sin(2 * astigmatism),
+        Cs, np.sqrt(1 - amplitudeContrast ** 2), amplitudeContrast, phaseShift, 1 / pixelSize ** 2
+    ], axis = 1)
+
+def ctf_grid(n : int, dtype : DTypeLike = np.float64) -> np.ndarray:
+    '''Frequency grid shared by all CTFs of box size n
+
+    Returns
+    -------
+    grid : numpy.ndarray
+        shape (3, n, n // 2 + 1), dtype as given,
+        squared frequency (in 1 / pixel ** 2), cos(2 * angle) and sin(2 * angle)
+    '''
+    x, y = np.broadcast_arrays(*rfreq2(n, np.float64))
+    alpha = np.arctan2(y, x)
+    return np.stack([(x ** 2 + y ** 2) / n ** 2, np.cos(2 * alpha), np.sin(2 * alpha)]).astype(real_dtype(dtype))
+
+def get_ctf_from_grid(ctfs : ArrayLike, grid : ArrayLike, order : int = 1) -> np.ndarray:
+    '''Get CTF in Fourier domain on a precomputed grid, see get_ctf and ctf_grid
+
+    Returns
+    -------
+    f_ctf : numpy.ndarray
+        shape (m, n, n // 2 + 1), same precision as grid,
+        CTF ** order
+    '''
+    grid = np.asarray(grid)
+    coefs = ctf_coefficients(ctfs).astype(grid.dtype)[:, :, None, None]
+    waveLength, defocusU, defocusV, c2, s2, Cs, w1, amplitudeContrast, phaseShift, rPixelSize2 = coefs.transpose(1, 0, 2, 3)
+    f2 = grid[0] * rPixelSize2
+    defocus = -(defocusU + defocusV + (defocusU - defocusV) * (grid[1] * c2 + grid[2] * s2)) / 2
+    chi = np.pi * waveLength * defocus * f2 + np.pi / 2 * Cs * waveLength ** 3 * f2 ** 2 - phaseShift
+    return (-w1 * np.sin(chi) + amplitudeContrast * np.cos(chi)) ** order
+
+def convolute_ctf(stack : ArrayLike, ctfs : ArrayLike, order : int = 1) -> np.ndarray:
+    '''Convolute CTF
+
+    Parameters
+    ----------
+    stack : ArrayLike
+        shape (m, n, n), dtype float32 or float64
+    ctfs : ArrayLike
+        shape (m, 8), dtype float64,
+        (voltage, defocus 1, defocus 2, astimatism angle, Cs, amplitude contrast, phase shift, pixelsize)
+    order : int
+        1 by default,
+        how many times the CTF function is convoluted
+
+    Returns
+    -------
+    new_stack : numpy.ndarray
+        shape (m, n, n), same precision as stack,
+        convolute(stack, CTF ** order)
+    '''
+    stack = np.asarray(stack, dtype = real_dtype(getattr(stack, 'dtype', np.float64)))
+    ctfs = np.asarray(ctfs, dtype = np.float64)
+    m = stack.shape[0]
+    n = stack.shape[1]
+    assert stack.shape == (m, n, n) and ctfs.shape == (m, 8)
+
+    f_stack = rfft2(stack)
+    f_stack *= get_ctf(ctfs, n, order, stack.dtype)
+    return irfft2(f_stack, n)
@@ -0,0 +1,66 @@
+import numpy as np
+import scipy.fft
+
+workers = 1
+
+def set_workers(n : int):
+    '''Set number of threads used by each FFT call.'''
+    global workers
+    workers = max(1, int(n))
+
+def rfft2(stack : np.ndarray) -> np.ndarray:
+    return scipy.fft.rfftn(stack, axes = (1, 2), workers = workers)
+
+def irfft2(f_stack : np.ndarray, n : int) -> np.ndarray:
+    return scipy.fft.irfftn(f_stack, s = (n, n), axes = (1, 2), workers = workers)
+
+def fourier_crop2(f_stack : np.ndarray, n : int) -> np.ndarray:
+    '''Crop rfftn half-plane spectra of size N to size n <= N.
+
+    Spectra are scaled by (n / N) ** 2, so that the cropped images keep
+    the pixel values of the band-limited originals.
+    '''
+    N = f_stack.shape[1]
+    h = n // 2
+    f_crop = np.concatenate([f_stack[:, : n - h, : h + 1], f_stack[:, N - h :, : h + 1]], axis = 1)
+    return f_crop * (n / N) ** 2
+
+def fourier_crop3(volume : np.ndarray, n : int, trilinear : bool = False) -> np.ndarray:
+    '''Fourier crop a volume of size N to size n <= N.
+
+    The volume is scaled by (n / N) ** 2 instead of (n / N) ** 3, so that its
+    projections with unit steps match Fourier cropped images, see fourier_crop2.
+
+    If `trilinear`, the spectrum is also multiplied by the ratio of the
+    sinc^2 apodizations of trilinear interpolation in boxes of size N and n,
+    so that real-space projections of the cropped volume match cropped
+    real-space projections of the original one. Without it, they are
+    attenuated towards the cropped Nyquist frequency.
+    '''
+    N = volume.shape[0]
+    if n == N:
+        return volume
+    h = n // 2
+    f_volume = scipy.fft.rfftn(np.fft.ifftshift(volume), workers = workers)
+    rows = np.r_[0 : n - h, N - h : N]
+    f_crop = f_volume[rows[:, None], rows[None, :], : h + 1]
+    if trilinear:
+        f = np.r_[0 : n - h, -h : 0]
+        c = np.sinc(f / N) ** 2 / np.sinc(f / n) ** 2
+        f_crop *= c[:, None, None] * c[None, :, None] * c[None, None, : h + 1]
+    return np.fft.fftshift(scipy.fft.irfftn(f_crop, s = (n, n, n), workers = workers)).astype(volume.dtype) * (n / N) ** 2
+
+def rfreq2(n : int, dtype = np.float64):
+    '''Integer frequency grid of a (n, n // 2 + 1) half-plane spectrum,
+    following the layout of rfftn, i.e. x in [0, n / 2] and y wrapped.'''
+    n_ = n // 2 + 1
+    x = np.arange(n_, dtype = dtype)
+    y = np.arange(n, dtype = dtype)
+    y = np.where(y < n_, y, y - n)[:, None]
+    return x, y
+
+def rshell2(n : int) -> np.ndarray:
+    '''Radial shell index of a (n, n // 2 + 1) half-plane spectrum,
+    shell k contains integer frequencies of radius in [k, k + 1).'''
+    x, y = rfreq2(n)
+    return np.floor(np.hypot(x, y)).astype(np.int32)
@@ -0,0 +1,97 @@
+import numpy as np
+import scipy.fft
+from numpy.typing import ArrayLike
+from . import fft
+from .fft import rfreq2
+from .project import quats_to_rots
+from .. import complex_dtype, real_dtype
+
+def prepare_fourier_volume(volume : ArrayLike, pad : int = 2) -> np.ndarray:
+    '''Fourier transform a volume for central-slice projection
+
+    The volume is divided by the sinc^2 apodization of trilinear
+    interpolation (gridding correction), zero-padded `pad` times and
+    transformed once.
+
+    Parameters
+    ----------
+    volume : ArrayLike
+        shape (n, n, n), dtype float32 or float64
+    pad : int
+        oversampling factor, 2 by default
+
+    Returns
+    -------
+    f_volume : numpy.ndarray
+        shape (N, N, N // 2 + 1) with N = pad * n, complex of the same precision as volume,
+        half spectrum with zero frequency at (N / 2, N / 2, 0)
+    '''
+    volume = np.asarray(volume, dtype = real_dtype(getattr(volume, 'dtype', np.float64)))
+    n = volume.shape[0]
+    assert volume.shape == (n, n, n) and pad >= 1
+    N = pad * n
+
+    c = np.sinc((np.arange(n) - n // 2) / N) ** 2
+    padded = np.zeros((N, N, N), dtype = volume.dtype)
+    o = N // 2 - n // 2
+    padded[o : o + n, o : o + n, o : o + n] = volume / (c[:, None, None] * c[None, :, None] * c[None, None, :])
+    f_volume = scipy.fft.rfftn(np.fft.ifftshift(padded), workers = fft.workers)
+    return np.fft.fftshift(f_volume, axes = (0, 1))
+
+def project_fourier(f_volume : ArrayLike, quats : ArrayLike, n : int) -> np.ndarray:
+    '''Project along given spatial rotations by central-slice extraction
+
+    Parameters
+    ----------
+    f_volume : ArrayLike
+        shape (N, N, N // 2 + 1), dtype complex64 or complex128, see prepare_fourier_volume
+    quats : ArrayLike
+        shape (m, 4), dtype float64
+    n : int
+        box size of the projections
+
+    Returns
+    -------
+    f_stack : numpy.ndarray
+        shape (m, n, n // 2 + 1), same precision as f_volume,
+        rfftn of the projections, as if they were computed by project
+    '''
+    f_volume = np.asarray(f_volume, dtype = complex_dtype(getattr(f_volume, 'dtype', np.complex128)))
+    dtype = real_dtype(f_volume.dtype)
+    quats = np.asarray(quats, dtype = np.float64)
+    N = f_volume.shape[0]
+    m = quats.shape[0]
+    assert f_volume.shape == (N, N, N // 2 + 1) and quats.shape == (m, 4)
+
+    r = (quats_to_rots(quats)[:, :, None, None] * (N / n)).astype(dtype)
+    x, y = rfreq2(n, dtype)
+    px = r[:, 0] * x + r[:, 3] * y
+    py = r[:, 1] * x + r[:, 4] * y
+    pz = r[:, 2] * x + r[:, 5] * y
+
+    # Only half spectrum is stored, use Friedel symmetry for px < 0.
+    conj = px < 0
+    sign = np.where(conj, dtype.type(-1), dtype.type(1))
+    px = px * sign
+    py = py * sign + N // 2
+    pz = pz * sign + N // 2
+    x0 = np.floor(px).astype(np.int64)
+    y0 = np.floor(py).astype(np.int64)
+    z0 = np.floor(pz).astype(np.int64)
+    dx = px - x0
+    dy = py - y0
+    dz = pz - z0
+
+    f_stack = np.zeros((m, n, n // 2 + 1), dtype = f_volume.dtype)
+    for k in range(8):
+        xi = x0 + (k & 1)
+        yi = y0 + (k >> 1 & 1)
+        zi = z0 + (k >> 2 & 1)
+        w = (dx if k & 1 else 1 - dx) * (dy if k >> 1 & 1 else 1 - dy) * (dz if k >> 2 & 1 else 1 - dz)
+        inside = (xi < N // 2 + 1) & (0 <= yi) & (yi < N) & (0 <= zi) & (zi < N)
+        f_stack += np.where(inside, f_volume[np.clip(zi, 0, N - 1), np.clip(yi, 0, N - 1), np.clip(xi, 0, N // 2)] * w, dtype.type(0))
+    f_stack = np.where(conj, f_stack.conj(), f_stack)
+
+    # Move the origin to the image centre n / 2.
+    f_stack *= np.exp(-2j * np.pi * (n // 2) * (x + y) / n).astype(f_stack.dtype)
+    return f_stack
@@ -0,0 +1,114 @@
+import numpy as np
+from numpy.typing import ArrayLike
+from scipy.ndimage import map_coordinates
+from .. import real_dtype
+
+# Ray samples interpolated at once by project, and peak temporary bytes per sample.
+CHUNK = 1 << 21
+SAMPLE_BYTES = 80
+
+def quats_to_rots(quats : np.ndarray) -> np.ndarray:
+    '''Rotation matrices (row-major, shape (m, 9)) of unit quaternions.'''
+    w = quats[:, 0]
+    x = quats[:, 1]
+    y = quats[:, 2]
+    z = quats[:, 3]
+    return np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)
+    ], axis = 1)
+
+def volume_support(volume : ArrayLike) -> np.ndarray:
+    '''Support of non-zero voxels of a volume, for empty-space skipping in project.
+
+    Returns
+    -------
+    support : numpy.ndarray
+        shape (7, ), bounding box (x_lo, y_lo, z_lo, x_hi, y_hi, z_hi) of
+        non-zero voxels, and the largest distance of them from the center
+    '''
+    volume = np.asarray(volume)
+    n = volume.shape[0]
+    c = np.arange(n) - n // 2
+    r2 = c[:, None] ** 2 + c[None, :] ** 2
+    nonzero = volume != 0
+    axes = [np.flatnonzero(nonzero.any(axis = axis)) for axis in ((0, 1), (0, 2), (1, 2))]
+    if len(axes[0]) == 0:
+        return np.array([n, n, n, -1, -1, -1, 0.])
+    radius2 = max(r2[plane].max() + c[z] ** 2 for z, plane in enumerate(nonzero) if plane.any())
+    return np.array([axes[0][0], axes[1][0], axes[2][0], axes[0][-1], axes[1][-1], axes[2][-1], np.sqrt(radius2)], dtype = np.float64)
+
+def support_bounds(support : ArrayLike, n : int, z_begin : int, nz : int):
+    '''Open bounds (x, y, z order) of ray samples with non-zero trilinear
+    interpolation in a slab, and their largest distance from the center.'''
+    if support is None:
+        support = [0, 0, 0, n - 1, n - 1, n - 1, np.inf]
+    lo = np.array(support[:3], dtype = np.int64) - 1
+    hi = np.array(support[3:6], dtype = np.int64) + 1
+    lo[2] = max(lo[2], z_begin - 1)
+    hi[2] = min(hi[2], z_begin + nz)
+    # Non-zero samples are less than one voxel away from a non-zero voxel in each axis.
+    return lo, hi, support[6] + np.sqrt(3)
+
+def project(volume : ArrayLike, quats : ArrayLike, z_begin : int = 0, support : ArrayLike = None, chunk : int = CHUNK) -> np.ndarray:
+    '''Project along given spatial rotations (in unit quaternion description)
+
+    Each pixel integrates the trilinearly interpolated volume along its
+    own ray with unit steps, for all projections at once. Only samples
+    within the support of the volume are interpolated. Projections match
+    those of the cuda backend, not those of the former scatter kernel.
+
+    Parameters
+    ----------
+    volume : ArrayLike
+        shape (nz, n, n), dtype float32 or float64, planes z_begin, ..., z_begin + nz - 1
+        of a volume of size n whose other planes are zero, nz = n by default
+    quats : ArrayLike
+        shape (m, 4), dtype float64
+    z_begin : int
+        first plane of the slab, 0 by default
+    support : ArrayLike
+        support of the whole volume from volume_support, whole box by default
+    chunk : int
+        number of ray samples interpolated at once, at least one step of all rays,
+        temporaries take about SAMPLE_BYTES bytes per sample
+
+    Returns
+    -------
+    stack : numpy.ndarray
+        shape (m, n, n), same precision as volume
+    '''
+    volume = np.asarray(volume, dtype = real_dtype(getattr(volume, 'dtype', np.float64)))
+    quats = np.asarray(quats, dtype = np.float64)
+    nz = volume.shape[0]
+    n = volume.shape[1]
+    m = quats.shape[0]
+    assert volume.shape == (nz, n, n) and 0 <= z_begin and z_begin + nz <= n and quats.shape == (m, 4)
+
+    rots = quats_to_rots(quats).reshape(m, 3, 3)
+    c = np.arange(n, dtype = np.float64) - n // 2
+    uv = np.stack(np.meshgrid(c, c, indexing = 'xy'), axis = -1).reshape(-1, 2)
+
+    # Ray origins (in z, y, x index order of the slab) and directions.
+    o = (uv @ rots[:, :2, ::-1] + n // 2 - np.array([z_begin, 0, 0])).reshape(m, n * n, 3, 1)
+    d = rots[:, 2, ::-1].reshape(m, 1, 3, 1)
+    lo, hi, radius = support_bounds(support, n, z_begin, nz)
+    lo = (lo[::-1] - np.array([z_begin, 0, 0])).reshape(3, 1, 1, 1)
+    hi = (hi[::-1] - np.array([z_begin, 0, 0])).reshape(3, 1, 1, 1)
+
+    # Origins are the points of rays nearest to the center, rays farther
+    # than half diagonal or than the support radius never hit the support.
+    rho2 = (uv ** 2).sum(axis = 1).reshape(n * n, 1)
+    t_max = int(np.ceil(min(np.sqrt(3) * (n / 2 + 1), radius)))
+    ts = np.arange(-t_max, t_max + 1, dtype = np.float64)
+    step = max(1, chunk // (m * n * n))
+    stack = np.zeros((m, n * n), dtype = volume.dtype)
+    for i in range(0, len(ts), step):
+        t = ts[i : i + step]
+        coords = np.moveaxis(o + t * d, 2, 0)
+        inside = np.broadcast_to(rho2 + t ** 2 <= radius ** 2, coords.shape[1:]) & np.all((coords > lo) & (coords < hi), axis = 0)
+        samples = np.zeros(coords.shape[1:], dtype = volume.dtype)
+        samples[inside] = map_coordinates(volume, coords[:, inside], order = 1, mode = 'grid-constant', cval = 0., output = volume.dtype)
+        stack += samples.sum(axis = 2)
+    return stack.reshape(m, n, n)
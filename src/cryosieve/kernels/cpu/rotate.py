@@ -0,0 +1,45 @@
+import numpy as np
+from numpy.typing import ArrayLike
+from .. import real_dtype
+
+def rotate2d(stack : ArrayLike, angles : ArrayLike) -> np.ndarray:
+    '''Rotate 2D images (counter clock-wise) in real space
+
+    Parameters
+    ----------
+    stack : ArrayLike
+        shape (m, n, n), dtype float32 or float64
+    angles : ArrayLike
+        shape (m, ), dtype float64, angles in radians
+
+    Returns
+    -------
+    new_stack : numpy.ndarray
+        shape (m, n, n), same precision as stack
+    '''
+    stack = np.asarray(stack, dtype = real_dtype(getattr(stack, 'dtype', np.float64)))
+    angles = np.asarray(angles, dtype = stack.dtype)
+    m = stack.shape[0]
+    n = stack.shape[1]
+    assert stack.shape == (m, n, n) and angles.shape == (m, )
+
+    c = np.arange(n, dtype = stack.dtype) - n // 2
+    x = c[None, None, :]
+    y = c[None, :, None]
+    cos = np.cos(angles)[:, None, None]
+    sin = np.sin(angles)[:, None, None]
+    vx = x * cos + y * sin + n // 2
+    vy = x * -sin + y * cos + n // 2
+    x0 = np.floor(vx).astype(np.int64)
+    y0 = np.floor(vy).astype(np.int64)
+    dx = vx - x0
+    dy = vy - y0
+
+    z = np.arange(m)[:, None, None]
+    new_stack = np.zeros((m, n, n), dtype = stack.dtype)
+    for ox, oy, w in ((0, 0, (1 - dx) * (1 - dy)), (1, 0, dx * (1 - dy)), (0, 1, (1 - dx) * dy), (1, 1, dx * dy)):
+        xi = x0 + ox
+        yi = y0 + oy
+        inside = (0 <= xi) & (xi < n) & (0 <= yi) & (yi < n)
+        new_stack += np.where(inside, stack[z, np.clip(yi, 0, n - 1), np.clip(xi, 0, n - 1)] * w, 0.)
+    return new_stack
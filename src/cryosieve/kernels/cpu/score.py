@@ -0,0 +1,111 @@
+import numpy as np
+from numpy.typing import ArrayLike, DTypeLike
+from typing import Optional
+from .fft import rfreq2, rshell2
+from .. import complex_dtype, num_shells, real_dtype
+
+def hermitian_edges(f_stack : np.ndarray) -> np.ndarray:
+    '''Keep only the Hermitian part of columns x = 0 and x = n / 2, which
+    pair with themselves in the half plane, like a real-space round trip.'''
+    n = f_stack.shape[1]
+    neg = -np.arange(n) % n
+    edges = np.array([0, n // 2] if n % 2 == 0 else [0])
+    f_stack[:, :, edges] = (f_stack[:, :, edges] + f_stack[:, neg[:, None], edges].conj()) / 2
+    return f_stack
+
+def score_fourier(f_imgs : ArrayLike, f_projs : ArrayLike, f_ctf : ArrayLike, trans : ArrayLike, threshold_low : float, threshold_high : float = 1., acc_dtype : DTypeLike = None, ctf_index : Optional[ArrayLike] = None) -> np.ndarray:
+    '''Scores of particles computed in Fourier space
+
+    Equivalent to ||B(CTF * P - T(I))||^2 - ||B(T(I))||^2 in real space,
+    where B is the bandpass filter and T the in-plane translation, via
+    Parseval's identity on the rfftn half plane.
+
+    Parameters
+    ----------
+    f_imgs : ArrayLike
+        shape (m, n, n // 2 + 1), dtype complex64 or complex128, rfftn of images
+    f_projs : ArrayLike
+        shape (m, n, n // 2 + 1), same precision as f_imgs, rfftn of projections
+    f_ctf : ArrayLike
+        shape (k, n, n // 2 + 1), same precision as f_imgs, see get_ctf
+    trans : ArrayLike
+        shape (m, 2), dtype float64
+    threshold_low : float
+        dimensionless, in range [0, 1]
+    threshold_high : float
+        dimensionless, in range [0, 1], 1 by default
+    acc_dtype : DTypeLike
+        float32 or float64, dtype in which norms are accumulated,
+        same precision as f_imgs by default
+    ctf_index : Optional[ArrayLike]
+        shape (m, ), dtype int32, the CTF of i-th particle is f_ctf[ctf_index[i]],
+        range(m) by default
+
+    Returns
+    -------
+    scores : numpy.ndarray
+        shape (m, ), dtype acc_dtype
+    '''
+    n = np.shape(f_imgs)[1]
+    acc_dtype = real_dtype(real_dtype(getattr(f_imgs, 'dtype', np.complex128)) if acc_dtype is None else acc_dtype)
+    r2, a2 = weighted_powers(f_imgs, f_projs, f_ctf, trans, acc_dtype, ctf_index)
+    x, y = rfreq2(n)
+    f = np.hypot(x / n, y / n)
+    band = (threshold_low <= f) & (f <= threshold_high)
+    return ((r2 - a2) * band).sum(axis = (1, 2)) / (n * n)
+
+def weighted_powers(f_imgs : ArrayLike, f_projs : ArrayLike, f_ctf : ArrayLike, trans : ArrayLike, acc_dtype : DTypeLike = None, ctf_index : Optional[ArrayLike] = None):
+    '''Residual and image powers at each frequency of the half plane,
+    weighted by the number of Fourier coefficients represented, see score_fourier.'''
+    dtype = complex_dtype(getattr(f_imgs, 'dtype', np.complex128))
+    acc_dtype = real_dtype(dtype if acc_dtype is None else acc_dtype)
+    f_imgs = np.asarray(f_imgs, dtype = dtype)
+    f_projs = np.asarray(f_projs, dtype = dtype)
+    f_ctf = np.asarray(f_ctf, dtype = real_dtype(dtype))
+    trans = np.asarray(trans, dtype = real_dtype(dtype))
+    m = f_imgs.shape[0]
+    n = f_imgs.shape[1]
+    assert f_imgs.shape == f_projs.shape == (m, n, n // 2 + 1) and f_ctf.shape[1:] == (n, n // 2 + 1) and trans.shape == (m, 2)
+    if ctf_index is not None:
+        f_ctf = f_ctf[np.asarray(ctf_index)]
+    assert f_ctf.shape[0] == m
+
+    x, y = rfreq2(n, real_dtype(dtype))
+    w = np.where((x == 0) | (2 * x == n), 1., 2.).astype(acc_dtype)
+
+    phi = -2 * np.pi * (trans[:, 0, None, None] * x / n + trans[:, 1, None, None] * y / n)
+    a = hermitian_edges(f_imgs * np.exp(1j * phi).astype(dtype))
+    r = hermitian_edges(f_ctf * f_projs) - a
+    r2 = np.square(r.real, dtype = acc_dtype) + np.square(r.imag, dtype = acc_dtype)
+    a2 = np.square(a.real, dtype = acc_dtype) + np.square(a.imag, dtype = acc_dtype)
+    return r2 * w, a2 * w
+
+def score_shells(f_imgs : ArrayLike, f_projs : ArrayLike, f_ctf : ArrayLike, trans : ArrayLike, threshold_high : float = 1., acc_dtype : DTypeLike = None, ctf_index : Optional[ArrayLike] = None) -> np.ndarray:
+    '''Residual and image powers of particles in radial Fourier shells
+
+    Shell k contains frequencies f with k <= n * f < k + 1 and
+    f <= threshold_high, see rshell2. For integer k,
+    score_fourier(..., threshold_low = k / n, threshold_high) equals
+    (shells[:, 0, k:] - shells[:, 1, k:]).sum(axis = 1).
+
+    Parameters
+    ----------
+    f_imgs, f_projs, f_ctf, trans, threshold_high, acc_dtype, ctf_index :
+        see score_fourier
+
+    Returns
+    -------
+    shells : numpy.ndarray
+        shape (m, 2, num_shells(n)), dtype acc_dtype,
+        residual powers ||CTF * P - T(I)||^2 and image powers ||T(I)||^2
+    '''
+    m = np.shape(f_imgs)[0]
+    n = np.shape(f_imgs)[1]
+    r2, a2 = weighted_powers(f_imgs, f_projs, f_ctf, trans, acc_dtype, ctf_index)
+    x, y = rfreq2(n)
+    band = np.hypot(x / n, y / n) <= threshold_high
+    r2, a2 = r2 * band, a2 * band
+    k = num_shells(n)
+    index = (rshell2(n) + np.arange(2 * m)[:, None, None] * k).ravel()
+    shells = np.bincount(index, weights = np.concatenate([r2, a2]).ravel(), minlength = 2 * m * k)
+    return (shells.reshape(2, m, k).transpose(1, 0, 2) / (n * n)).astype(r2.dtype)
@@ -0,0 +1,31 @@
+import numpy as np
+from numpy.typing import ArrayLike
+from .fft import rfft2, irfft2, rfreq2
+from .. import real_dtype
+
+def translate(stack : ArrayLike, trans : ArrayLike) -> np.ndarray:
+    '''In-plane translation (in Fourier space)
+
+    Parameters
+    ----------
+    stack : ArrayLike
+        shape (m, n, n), dtype float32 or float64
+    trans : ArrayLike
+        shape (m, 2), dtype float64
+
+    Returns
+    -------
+    new_stack : numpy.ndarray
+        shape (m, n, n), same precision as stack
+    '''
+    stack = np.asarray(stack, dtype = real_dtype(getattr(stack, 'dtype', np.float64)))
+    trans = np.asarray(trans, dtype = stack.dtype)
+    m = stack.shape[0]
+    n = stack.shape[1]
+    assert stack.shape == (m, n, n) and trans.shape == (m, 2)
+
+    x, y = rfreq2(n, stack.dtype)
+    phi = -2 * np.pi * (trans[:, 0, None, None] * x / n + trans[:, 1, None, None] * y / n)
+    f_stack = rfft2(stack)
+    f_stack *= np.exp(1j * phi)
+    return irfft2(f_stack, n)
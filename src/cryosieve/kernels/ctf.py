@@ -1,11 +1,15 @@
 import cupy as cp
+import numpy as np
 from cupy.fft import rfftn, irfftn
-from numpy.typing import ArrayLike
-from . import ceil_div
+from numpy.typing import ArrayLike, DTypeLike
+from . import ceil_div, ctype, real_dtype
+from .cpu.ctf import ctf_coefficients
+from .cpu.ctf import ctf_grid as ctf_grid_cpu
 
-ker_get_ctf = cp.RawKernel(r'''
-extern "C" __global__ void get_ctf(
-    double* f_ctf,
+module_get_ctf = cp.RawModule(code = r'''
+template<typename T>
+__global__ void get_ctf(
+    T* f_ctf,
     int m,
     int n,
     const double* ctfs,
@@ -18,26 +22,26 @@ extern "C" __global__ void get_ctf(
         int y = tid / n_ % n; y = y < n_ ? y : y - n;
         int z = tid / n_ / n;
 
-        double voltage           = ctfs[z * 8    ];
-        double defocusU          = ctfs[z * 8 + 1];
-        double defocusV          = ctfs[z * 8 + 2];
-        double astigmatism       = ctfs[z * 8 + 3];
-        double Cs                = ctfs[z * 8 + 4];
-        double amplitudeContrast = ctfs[z * 8 + 5];
-        double phaseShift        = ctfs[z * 8 + 6];
-        double pixelSize         = ctfs[z * 8 + 7];
-
-        double pi = 3.1415926535897932384626;
-        double waveLength = 12.2643247 / sqrt(voltage * (1 + voltage * 0.978466e-6));
-        double f = hypot(x / (pixelSize * n), y / (pixelSize * n));
-        double alpha = atan2((double)y, (double)x) - astigmatism;
-        double defocus = -(defocusU + defocusV + (defocusU - defocusV) * cos(2 * alpha)) / 2;
-        double chi = pi * waveLength * defocus * pow(f, 2.) + pi / 2 * Cs * pow(waveLength, 3.) * pow(f, 4.) - phaseShift;
-        f_ctf[tid] = pow(-sqrt(1 - pow(amplitudeContrast, 2.)) * sin(chi) + amplitudeContrast * cos(chi), (double)order);
+        T voltage           = ctfs[z * 8    ];
+        T defocusU          = ctfs[z * 8 + 1];
+        T defocusV          = ctfs[z * 8 + 2];
+        T astigmatism       = ctfs[z * 8 + 3];
+        T Cs                = ctfs[z * 8 + 4];
+        T amplitudeContrast = ctfs[z * 8 + 5];
+        T phaseShift        = ctfs[z * 8 + 6];
+        T pixelSize         = ctfs[z * 8 + 7];
+
+        T pi = 3.1415926535897932384626;
+        T waveLength = 12.2643247 / sqrt(voltage * (1 + voltage * (T)0.978466e-6));
+        T f = hypot(x / (pixelSize * n), y / (pixelSize * n));
+        T alpha = atan2((T)y, (T)x) - astigmatism;
+        T defocus = -(defocusU + defocusV + (defocusU - defocusV) * cos(2 * alpha)) / 2;
+        T chi = pi * waveLength * defocus * pow(f, (T)2.) + pi / 2 * Cs * pow(waveLength, (T)3.) * pow(f, (T)4.) - phaseShift;
+        f_ctf[tid] = pow(-sqrt(1 - pow(amplitudeContrast, (T)2.)) * sin(chi) + amplitudeContrast * cos(chi), (T)order);
     }
-}''', 'get_ctf')
+}''', options = ('-std=c++11', ), name_expressions = ['get_ctf<float>', 'get_ctf<double>'])
 
-def get_ctf(ctfs : ArrayLike, n : int, order : int = 1) -> cp.ndarray:
+def get_ctf(ctfs : ArrayLike, n : int, order : int = 1, dtype : DTypeLike = np.float64) -> cp.ndarray:
     '''Get CTF in Fourier domain
 
     Parameters
@@ -46,28 +50,100 @@ def get_ctf(ctfs : ArrayLike, n : int, order : int = 1) -> cp.ndarray:
         shape (m, 8), dtype float64,
         (voltage, defocus 1, defocus 2, astimatism angle, Cs, amplitude contrast, phase shift, pixelsize)
     order : int
+    dtype : DTypeLike
+        float32 or float64 (by default), precision of evaluation
 
     Returns
     -------
     f_ctf : cupy.ndarray
-        shape (m, n, n), dtype float64,
+        shape (m, n, n // 2 + 1), dtype as given,
         CTF ** order
     '''
+    dtype = real_dtype(dtype)
     ctfs = cp.asarray(ctfs, dtype = cp.float64)
     m = ctfs.shape[0]
     assert ctfs.shape == (m, 8)
 
-    f_ctf = cp.empty((m, n, n // 2 + 1), dtype = cp.float64)
+    f_ctf = cp.empty((m, n, n // 2 + 1), dtype = dtype)
+    ker_get_ctf = module_get_ctf.get_function(f'get_ctf<{ctype(dtype)}>')
     ker_get_ctf((ceil_div(f_ctf.size, 256), ), (256, ), (f_ctf, m, n, ctfs, order))
     return f_ctf
 
-def convolute_ctf(stack : cp.ndarray, ctfs : ArrayLike, order : int = 1) -> cp.ndarray:
+module_get_ctf_from_grid = cp.RawModule(code = r'''
+template<typename T>
+__global__ void get_ctf_from_grid(
+    T* f_ctf,
+    int m,
+    int n,
+    const T* grid,
+    const double* coefs,
+    int order)
+{
+    int tid = blockDim.x * blockIdx.x + threadIdx.x;
+    int size = n * (n / 2 + 1);
+    if (tid < m * size) {
+        int p = tid % size;
+        int z = tid / size;
+
+        const double* coef = coefs + z * 10;
+        T waveLength        = coef[0];
+        T defocusU          = coef[1];
+        T defocusV          = coef[2];
+        T c2                = coef[3];
+        T s2                = coef[4];
+        T Cs                = coef[5];
+        T w1                = coef[6];
+        T amplitudeContrast = coef[7];
+        T phaseShift        = coef[8];
+        T rPixelSize2       = coef[9];
+
+        T pi = 3.1415926535897932384626;
+        T f2 = grid[p] * rPixelSize2;
+        T defocus = -(defocusU + defocusV + (defocusU - defocusV) * (grid[size + p] * c2 + grid[2 * size + p] * s2)) / 2;
+        T chi = pi * waveLength * defocus * f2 + pi / 2 * Cs * waveLength * waveLength * waveLength * f2 * f2 - phaseShift;
+        f_ctf[tid] = pow(-w1 * sin(chi) + amplitudeContrast * cos(chi), (T)order);
+    }
+}''', options = ('-std=c++11', ), name_expressions = ['get_ctf_from_grid<float>', 'get_ctf_from_grid<double>'])
+
+def ctf_grid(n : int, dtype : DTypeLike = np.float64) -> cp.ndarray:
+    '''Frequency grid shared by all CTFs of box size n
+
+    Returns
+    -------
+    grid : cupy.ndarray
+        shape (3, n, n // 2 + 1), dtype as given,
+        squared frequency (in 1 / pixel ** 2), cos(2 * angle) and sin(2 * angle)
+    '''
+    return cp.asarray(ctf_grid_cpu(n, dtype))
+
+def get_ctf_from_grid(ctfs : ArrayLike, grid : ArrayLike, order : int = 1) -> cp.ndarray:
+    '''Get CTF in Fourier domain on a precomputed grid, see get_ctf and ctf_grid
+
+    Returns
+    -------
+    f_ctf : cupy.ndarray
+        shape (m, n, n // 2 + 1), same precision as grid,
+        CTF ** order
+    '''
+    dtype = real_dtype(getattr(grid, 'dtype', cp.float64))
+    grid = cp.asarray(grid, dtype = dtype)
+    coefs = cp.asarray(ctf_coefficients(cp.asnumpy(ctfs)))
+    m = coefs.shape[0]
+    n = grid.shape[1]
+    assert grid.shape == (3, n, n // 2 + 1)
+
+    f_ctf = cp.empty((m, n, n // 2 + 1), dtype = dtype)
+    ker_get_ctf_from_grid = module_get_ctf_from_grid.get_function(f'get_ctf_from_grid<{ctype(dtype)}>')
+    ker_get_ctf_from_grid((ceil_div(f_ctf.size, 256), ), (256, ), (f_ctf, m, n, grid, coefs, order))
+    return f_ctf
+
+def convolute_ctf(stack : ArrayLike, ctfs : ArrayLike, order : int = 1) -> cp.ndarray:
     '''Convolute CTF
 
     Parameters
     ----------
-    stack : cupy.ndarray
-        shape (m, n, n), dtype float64
+    stack : ArrayLike
+        shape (m, n, n), dtype float32 or float64
     ctfs : ArrayLike
         shape (m, 8), dtype float64,
         (voltage, defocus 1, defocus 2, astimatism angle, Cs, amplitude contrast, phase shift, pixelsize)
@@ -78,16 +154,17 @@ def convolute_ctf(stack : cp.ndarray, ctfs : ArrayLike, order : int = 1) -> cp.n
     Returns
     -------
     new_stack : cupy.ndarray
-        shape (m, n, n), dtype float64,
+        shape (m, n, n), same precision as stack,
         convolute(stack, CTF ** order)
     '''
-    stack = cp.asarray(stack, dtype = cp.float64)
+    dtype = real_dtype(getattr(stack, 'dtype', cp.float64))
+    stack = cp.asarray(stack, dtype = dtype)
     ctfs = cp.asarray(ctfs, dtype = cp.float64)
     m = stack.shape[0]
     n = stack.shape[1]
     assert stack.shape == (m, n, n) and ctfs.shape == (m, 8)
 
     f_stack = rfftn(stack, axes = (1, 2))
-    f_ctf = get_ctf(ctfs, n, order)
+    f_ctf = get_ctf(ctfs, n, order, dtype)
     f_stack *= f_ctf
-    return irfftn(f_stack, axes = (1, 2))
+    return irfftn(f_stack, s = (n, n), axes = (1, 2))
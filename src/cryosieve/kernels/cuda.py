@@ -0,0 +1,39 @@
+import cupy as xp
+from .bandpass import bandpass2d, lowpass2d, highpass2d
+from .ctf import get_ctf, convolute_ctf, ctf_grid, get_ctf_from_grid
+from .project import project
+from .cpu.project import volume_support
+from .fourier_project import project_fourier
+from .cpu.fourier_project import prepare_fourier_volume
+from .cpu.fft import fourier_crop3
+from .translate import translate
+from .rotate import rotate2d
+from .score import score_fourier, score_shells
+
+name = 'cuda'
+device_name = 'GPU'
+
+def asnumpy(array):
+    return xp.asnumpy(array)
+
+def rfft2(stack : xp.ndarray) -> xp.ndarray:
+    return xp.fft.rfftn(stack, axes = (1, 2))
+
+def irfft2(f_stack : xp.ndarray, n : int) -> xp.ndarray:
+    return xp.fft.irfftn(f_stack, s = (n, n), axes = (1, 2))
+
+def fourier_crop2(f_stack : xp.ndarray, n : int) -> xp.ndarray:
+    N = f_stack.shape[1]
+    h = n // 2
+    f_crop = xp.concatenate([f_stack[:, : n - h, : h + 1], f_stack[:, N - h :, : h + 1]], axis = 1)
+    return f_crop * (n / N) ** 2
+
+def device_count() -> int:
+    return xp.cuda.runtime.getDeviceCount()
+
+def set_device(device_id : int):
+    xp.cuda.runtime.setDevice(device_id)
+
+def memory_usage() -> int:
+    '''Bytes held by the memory pool of the current device.'''
+    return xp.get_default_memory_pool().total_bytes()
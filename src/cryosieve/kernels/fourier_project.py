@@ -0,0 +1,93 @@
+import cupy as cp
+from numpy.typing import ArrayLike
+from . import ceil_div, complex_dtype, ctype
+from .project import quats_to_rots
+
+module_project_fourier = cp.RawModule(code = r'''
+template<typename T>
+__global__ void project_fourier(
+    const T* f_volume,
+    int N,
+    const double* rots,
+    T* f_stack,
+    int m,
+    int n)
+{
+    int tid = blockDim.x * blockIdx.x + threadIdx.x;
+    int n_ = n / 2 + 1;
+    int N_ = N / 2 + 1;
+    if (tid < m * n * n_) {
+        int x = tid % n_;
+        int y = tid / n_ % n; y = y < n_ ? y : y - n;
+        int z = tid / n_ / n;
+
+        const double* rot = rots + z * 9;
+        T s = (T)N / n;
+        T px = s * (rot[0] * x + rot[3] * y);
+        T py = s * (rot[1] * x + rot[4] * y);
+        T pz = s * (rot[2] * x + rot[5] * y);
+
+        // Only half spectrum is stored, use Friedel symmetry for px < 0.
+        T sign = px < 0 ? -1 : 1;
+        px = px * sign;
+        py = py * sign + N / 2;
+        pz = pz * sign + N / 2;
+        int x0 = floor(px);
+        int y0 = floor(py);
+        int z0 = floor(pz);
+        T dx = px - x0;
+        T dy = py - y0;
+        T dz = pz - z0;
+
+        T re = 0, im = 0;
+        for (int k = 0; k < 8; ++k) {
+            int xi = x0 + (k & 1);
+            int yi = y0 + (k >> 1 & 1);
+            int zi = z0 + (k >> 2 & 1);
+            if (xi < N_ && 0 <= yi && yi < N && 0 <= zi && zi < N) {
+                T w = (k & 1 ? dx : 1 - dx) * (k >> 1 & 1 ? dy : 1 - dy) * (k >> 2 & 1 ? dz : 1 - dz);
+                long long i = ((long long)zi * N + yi) * N_ + xi;
+                re += w * f_volume[i * 2    ];
+                im += w * f_volume[i * 2 + 1];
+            }
+        }
+        im *= sign;
+
+        // Move the origin to the image centre n / 2.
+        T pi = 3.1415926535897932384626;
+        T phi = -2 * pi * (n / 2) * (T)(x + y) / n;
+        f_stack[tid * 2    ] = re * cos(phi) - im * sin(phi);
+        f_stack[tid * 2 + 1] = re * sin(phi) + im * cos(phi);
+    }
+}''', options = ('-std=c++11', ), name_expressions = ['project_fourier<float>', 'project_fourier<double>'])
+
+def project_fourier(f_volume : ArrayLike, quats : ArrayLike, n : int) -> cp.ndarray:
+    '''Project along given spatial rotations by central-slice extraction
+
+    Parameters
+    ----------
+    f_volume : ArrayLike
+        shape (N, N, N // 2 + 1), dtype complex64 or complex128, see prepare_fourier_volume
+    quats : ArrayLike
+        shape (m, 4), dtype float64
+    n : int
+        box size of the projections
+
+    Returns
+    -------
+    f_stack : cupy.ndarray
+        shape (m, n, n // 2 + 1), same precision as f_volume,
+        rfftn of the projections, as if they were computed by project
+    '''
+    dtype = complex_dtype(getattr(f_volume, 'dtype', cp.complex128))
+    f_volume = cp.asarray(f_volume, dtype = dtype)
+    quats = cp.asarray(quats, dtype = cp.float64)
+    N = f_volume.shape[0]
+    m = quats.shape[0]
+    assert f_volume.shape == (N, N, N // 2 + 1) and quats.shape == (m, 4)
+
+    rots = quats_to_rots(quats)
+    f_stack = cp.empty((m, n, n // 2 + 1), dtype = dtype)
+    ker_project_fourier = module_project_fourier.get_function(f'project_fourier<{ctype(dtype)}>')
+    ker_project_fourier((ceil_div(f_stack.size, 256), ), (256, ), (f_volume, N, rots, f_stack, m, n))
+    return f_stack
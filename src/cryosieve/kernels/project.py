@@ -1,66 +1,137 @@
 import cupy as cp
+import numpy as np
 from numpy.typing import ArrayLike
-from . import ceil_div
+from . import ceil_div, ctype, real_dtype
+from .cpu.project import support_bounds
 
-ker_project = cp.RawKernel(r'''
-extern "C" __global__ void project(
-    const double* volume,
+module_project = cp.RawModule(code = r'''
+template<typename T>
+__global__ void project(
+    const T* volume,
     const double* rots,
-    double* image,
-    int n)
+    T* stack,
+    int m,
+    int n,
+    int z_begin,
+    int nz,
+    const long long* bounds,
+    double radius)
 {
     int tid = blockDim.x * blockIdx.x + threadIdx.x;
-    if (tid < n * n * n) {
+    if (tid < m * n * n) {
         int x = tid % n     - n / 2;
         int y = tid / n % n - n / 2;
-        int z = tid / n / n - n / 2;
+        int z = tid / n / n;
 
-        double vx = rots[0] * x + rots[1] * y + rots[2] * z + n / 2;
-        double vy = rots[3] * x + rots[4] * y + rots[5] * z + n / 2;
-        x = floor(vx);
-        y = floor(vy);
-        double dx = vx - x;
-        double dy = vy - y;
+        // The ray of pixel (x, y) is o + t * d in volume index coordinates.
+        const double* rot = rots + z * 9;
+        T o[3], d[3];
+        for (int k = 0; k < 3; ++k) {
+            o[k] = rot[k] * x + rot[3 + k] * y + n / 2;
+            d[k] = rot[6 + k];
+        }
 
-        double voxel = volume[tid];
-        if (0 <= x     && x     < n && 0 <= y     && y     < n) atomicAdd(image + (y    ) * n + (x    ), voxel * (1 - dx) * (1 - dy));
-        if (0 <= x + 1 && x + 1 < n && 0 <= y     && y     < n) atomicAdd(image + (y    ) * n + (x + 1), voxel * (    dx) * (1 - dy));
-        if (0 <= x     && x     < n && 0 <= y + 1 && y + 1 < n) atomicAdd(image + (y + 1) * n + (x    ), voxel * (1 - dx) * (    dy));
-        if (0 <= x + 1 && x + 1 < n && 0 <= y + 1 && y + 1 < n) atomicAdd(image + (y + 1) * n + (x + 1), voxel * (    dx) * (    dy));
+        // Clip the ray to the open box (bounds[0 : 3], bounds[3 : 6]) around
+        // the support in the slab of planes held by volume, and to the sphere
+        // of given radius around the center (o is the point of the ray nearest
+        // to it), out of which trilinear interpolation vanishes.
+        T t_min = -1e30, t_max = 1e30;
+        double rho2 = (double)x * x + (double)y * y;
+        if (rho2 < radius * radius) {
+            T h = sqrt(radius * radius - rho2);
+            t_min = -h;
+            t_max = h;
+        }
+        else t_max = -1e30;
+        for (int k = 0; k < 3; ++k) {
+            long long lo = bounds[k];
+            long long hi = bounds[3 + k];
+            if (fabs(d[k]) > 1e-12) {
+                T t1 = (lo - o[k]) / d[k];
+                T t2 = (hi - o[k]) / d[k];
+                t_min = fmax(t_min, fmin(t1, t2));
+                t_max = fmin(t_max, fmax(t1, t2));
+            }
+            else if (o[k] <= lo || o[k] >= hi) t_max = -1e30;
+        }
+
+        T sum = 0;
+        for (int t = ceil(t_min); t <= t_max; ++t) {
+            T vx = o[0] + t * d[0];
+            T vy = o[1] + t * d[1];
+            T vz = o[2] + t * d[2];
+            int x0 = floor(vx);
+            int y0 = floor(vy);
+            int z0 = floor(vz);
+            T dx = vx - x0;
+            T dy = vy - y0;
+            T dz = vz - z0;
+            for (int k = 0; k < 8; ++k) {
+                int xi = x0 + (k & 1);
+                int yi = y0 + (k >> 1 & 1);
+                int zi = z0 + (k >> 2 & 1) - z_begin;
+                if (0 <= xi && xi < n && 0 <= yi && yi < n && 0 <= zi && zi < nz)
+                    sum += volume[((long long)zi * n + yi) * n + xi] * (k & 1 ? dx : 1 - dx) * (k >> 1 & 1 ? dy : 1 - dy) * (k >> 2 & 1 ? dz : 1 - dz);
+            }
+        }
+        stack[tid] = sum;
     }
-}''', 'project')
+}''', options = ('-std=c++11', ), name_expressions = ['project<float>', 'project<double>'])
 
-def project(volume : ArrayLike, quats : ArrayLike) -> cp.ndarray:
+def quats_to_rots(quats : cp.ndarray) -> cp.ndarray:
+    '''Rotation matrices (row-major, shape (m, 9)) of unit quaternions.'''
+    w = quats[:, 0]
+    x = quats[:, 1]
+    y = quats[:, 2]
+    z = quats[:, 3]
+    return cp.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)
+    ], axis = 1)
+
+def project(volume : ArrayLike, quats : ArrayLike, z_begin : int = 0, support : ArrayLike = None) -> cp.ndarray:
     '''Project along given spatial rotations (in unit quaternion description)
 
+    All projections are computed in a single launch. Each pixel integrates
+    the trilinearly interpolated volume along its own ray with unit steps,
+    so there are no atomics and the result is deterministic. Rays are
+    clipped to the support of the volume, skipping empty space.
+
+    Projections differ from those of the former scatter kernel (voxels
+    bilinearly splatted onto the image) by interpolation error, about 1%
+    to 2% in relative L2 norm on smooth volumes, so scores change by a few
+    percent. Parity is tested in tests/test_project.py.
+
     Parameters
     ----------
     volume : ArrayLike
-        shape (n, n, n), dtype float64
+        shape (nz, n, n), dtype float32 or float64, planes z_begin, ..., z_begin + nz - 1
+        of a volume of size n whose other planes are zero, nz = n by default
     quats : ArrayLike
         shape (m, 4), dtype float64
+    z_begin : int
+        first plane of the slab, 0 by default
+    support : ArrayLike
+        support of the whole volume from volume_support, whole box by default
 
     Returns
     -------
     stack : cupy.ndarray
-        shape (m, n, n), dtype float64
+        shape (m, n, n), same precision as volume
     '''
-    volume = cp.asarray(volume, dtype = cp.float64)
+    dtype = real_dtype(getattr(volume, 'dtype', cp.float64))
+    volume = cp.asarray(volume, dtype = dtype)
     quats = cp.asarray(quats, dtype = cp.float64)
-    n = volume.shape[0]
+    nz = volume.shape[0]
+    n = volume.shape[1]
     m = quats.shape[0]
-    assert volume.shape == (n, n, n) and quats.shape == (m, 4)
-
-    w = quats[:, 0]
-    x = quats[:, 1]
-    y = quats[:, 2]
-    z = quats[:, 3]
-    rots = cp.stack([
-        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
-        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)
-    ], axis = 1)
+    assert volume.shape == (nz, n, n) and 0 <= z_begin and z_begin + nz <= n and quats.shape == (m, 4)
 
-    stack = cp.zeros((m, n, n), dtype = cp.float64)
-    for i in range(m):
-        ker_project((ceil_div(volume.size, 128), ), (128, ), (volume, rots[i], stack[i], n))
+    rots = quats_to_rots(quats)
+    lo, hi, radius = support_bounds(support, n, z_begin, nz)
+    bounds = cp.asarray(np.concatenate([lo, hi]), dtype = cp.int64)
+    stack = cp.empty((m, n, n), dtype = dtype)
+    ker_project = module_project.get_function(f'project<{ctype(dtype)}>')
+    ker_project((ceil_div(stack.size, 128), ), (128, ), (volume, rots, stack, m, n, z_begin, nz, bounds, cp.float64(min(radius, 1e30))))
     return stack
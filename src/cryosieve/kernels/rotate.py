@@ -1,14 +1,15 @@
 import cupy as cp
 from numpy.typing import ArrayLike
-from . import ceil_div
+from . import ceil_div, ctype, real_dtype
 
-ker_rotate2d = cp.RawKernel(r'''
-extern "C" __global__ void rotate2d(
-    const double* stack,
+module_rotate2d = cp.RawModule(code = r'''
+template<typename T>
+__global__ void rotate2d(
+    const T* stack,
     int m,
     int n,
     const double* psi,
-    double* new_stack)
+    T* new_stack)
 {
     int tid = blockDim.x * blockIdx.x + threadIdx.x;
     if (tid < m * n * n) {
@@ -16,19 +17,21 @@ extern "C" __global__ void rotate2d(
         int y = tid / n % n - n / 2;
         int z = tid / n / n;
 
-        double vx = x *  cos(psi[z]) + y * sin(psi[z]) + n / 2;
-        double vy = x * -sin(psi[z]) + y * cos(psi[z]) + n / 2;
+        T c = cos(psi[z]);
+        T s = sin(psi[z]);
+        T vx = x *  c + y * s + n / 2;
+        T vy = x * -s + y * c + n / 2;
         x = floor(vx);
         y = floor(vy);
-        double dx = vx - x;
-        double dy = vy - y;
+        T dx = vx - x;
+        T dy = vy - y;
 
         if (0 <= x     && x     < n && 0 <= y     && y     < n) new_stack[tid] += stack[(z * n + y    ) * n + x    ] * (1 - dx) * (1 - dy);
         if (0 <= x + 1 && x + 1 < n && 0 <= y     && y     < n) new_stack[tid] += stack[(z * n + y    ) * n + x + 1] * (    dx) * (1 - dy);
         if (0 <= x     && x     < n && 0 <= y + 1 && y + 1 < n) new_stack[tid] += stack[(z * n + y + 1) * n + x    ] * (1 - dx) * (    dy);
         if (0 <= x + 1 && x + 1 < n && 0 <= y + 1 && y + 1 < n) new_stack[tid] += stack[(z * n + y + 1) * n + x + 1] * (    dx) * (    dy);
     }
-}''', 'rotate2d')
+}''', options = ('-std=c++11', ), name_expressions = ['rotate2d<float>', 'rotate2d<double>'])
 
 def rotate2d(stack : ArrayLike, angles : ArrayLike) -> cp.ndarray:
     '''Rotate 2D images (counter clock-wise) in real space
@@ -36,21 +39,23 @@ def rotate2d(stack : ArrayLike, angles : ArrayLike) -> cp.ndarray:
     Parameters
     ----------
     stack : ArrayLike
-        shape (m, n, n), dtype float64
+        shape (m, n, n), dtype float32 or float64
     angles : ArrayLike
         shape (m, ), dtype float64, angles in radians
 
     Returns
     -------
     new_stack : cupy.ndarray
-        shape (m, n, n), dtype float64
+        shape (m, n, n), same precision as stack
     '''
-    stack = cp.asarray(stack, dtype = cp.float64)
+    dtype = real_dtype(getattr(stack, 'dtype', cp.float64))
+    stack = cp.asarray(stack, dtype = dtype)
     angles = cp.asarray(angles, dtype = cp.float64)
     m = stack.shape[0]
     n = stack.shape[1]
     assert stack.shape == (m, n, n) and angles.shape == (m, )
 
-    new_stack = cp.zeros((m, n, n), dtype = cp.float64)
+    new_stack = cp.zeros((m, n, n), dtype = dtype)
+    ker_rotate2d = module_rotate2d.get_function(f'rotate2d<{ctype(dtype)}>')
     ker_rotate2d((ceil_div(stack.size, 256), ), (256, ), (stack, m, n, angles, new_stack))
     return new_stack
@@ -0,0 +1,228 @@
+import cupy as cp
+from numpy.typing import ArrayLike, DTypeLike
+from typing import Optional
+from . import ceil_div, complex_dtype, ctype, num_shells, real_dtype
+from .cpu.fft import rshell2
+
+module_score_fourier = cp.RawModule(code = r'''
+template<typename T>
+__device__ void residual(
+    const T* f_imgs,
+    const T* f_projs,
+    T ctf,
+    const double* trans,
+    int n,
+    int z,
+    int x,
+    int y,
+    long long i,
+    T* a,
+    T* r)
+{
+    T pi = 3.1415926535897932384626;
+    T phi = -2 * pi * ((T)trans[2 * z] * x / n + (T)trans[2 * z + 1] * y / n);
+    T ax = f_imgs[2 * i    ];
+    T ay = f_imgs[2 * i + 1];
+    a[0] = ax * cos(phi) - ay * sin(phi);
+    a[1] = ax * sin(phi) + ay * cos(phi);
+    r[0] = ctf * f_projs[2 * i    ] - a[0];
+    r[1] = ctf * f_projs[2 * i + 1] - a[1];
+}
+
+// Weighted residual and image powers at pixel tid = (z, iy, x).
+template<typename T, typename S>
+__device__ void pixel_powers(
+    const T* f_imgs,
+    const T* f_projs,
+    const T* f_ctf,
+    const int* ctf_index,
+    const double* trans,
+    int n,
+    int z,
+    int iy,
+    int x,
+    long long tid,
+    S* r2,
+    S* a2)
+{
+    int n_ = n / 2 + 1;
+    int y = iy < n_ ? iy : iy - n;
+
+    // CTF of the particle is f_ctf[ctf_index[z]].
+    const T* ctf = f_ctf + (long long)ctf_index[z] * n * n_;
+    T a[2], r[2];
+    residual(f_imgs, f_projs, ctf[iy * n_ + x], trans, n, z, x, y, tid, a, r);
+
+    // Columns x = 0 and x = n / 2 pair with themselves in the half plane.
+    // A real-space round trip keeps only their Hermitian part, the
+    // other columns represent two Fourier coefficients.
+    S w = 2;
+    if (x == 0 || 2 * x == n) {
+        int jy = (n - iy) % n;
+        T a_[2], r_[2];
+        residual(f_imgs, f_projs, ctf[jy * n_ + x], trans, n, z, x, jy < n_ ? jy : jy - n, ((long long)z * n + jy) * n_ + x, a_, r_);
+        a[0] = (a[0] + a_[0]) / 2;
+        a[1] = (a[1] - a_[1]) / 2;
+        r[0] = (r[0] + r_[0]) / 2;
+        r[1] = (r[1] - r_[1]) / 2;
+        w = 1;
+    }
+    *r2 = w * ((S)r[0] * r[0] + (S)r[1] * r[1]);
+    *a2 = w * ((S)a[0] * a[0] + (S)a[1] * a[1]);
+}
+
+template<typename T, typename S>
+__global__ void score_fourier(
+    const T* f_imgs,
+    const T* f_projs,
+    const T* f_ctf,
+    const int* ctf_index,
+    const double* trans,
+    int m,
+    int n,
+    double threshold_low,
+    double threshold_high,
+    S* f_score)
+{
+    int tid = blockDim.x * blockIdx.x + threadIdx.x;
+    int n_ = n / 2 + 1;
+    if (tid < m * n * n_) {
+        int x = tid % n_;
+        int iy = tid / n_ % n;
+        int y = iy < n_ ? iy : iy - n;
+        int z = tid / n_ / n;
+
+        T f = hypot((T)x / n, (T)y / n);
+        if (f < threshold_low || f > threshold_high) {
+            f_score[tid] = 0;
+            return;
+        }
+
+        S r2, a2;
+        pixel_powers(f_imgs, f_projs, f_ctf, ctf_index, trans, n, z, iy, x, tid, &r2, &a2);
+        f_score[tid] = r2 - a2;
+    }
+}
+
+template<typename T, typename S>
+__global__ void weighted_powers(
+    const T* f_imgs,
+    const T* f_projs,
+    const T* f_ctf,
+    const int* ctf_index,
+    const double* trans,
+    int m,
+    int n,
+    double threshold_high,
+    S* f_r2,
+    S* f_a2)
+{
+    int tid = blockDim.x * blockIdx.x + threadIdx.x;
+    int n_ = n / 2 + 1;
+    if (tid < m * n * n_) {
+        int x = tid % n_;
+        int iy = tid / n_ % n;
+        int y = iy < n_ ? iy : iy - n;
+        int z = tid / n_ / n;
+
+        T f = hypot((T)x / n, (T)y / n);
+        if (f > threshold_high) {
+            f_r2[tid] = 0;
+            f_a2[tid] = 0;
+            return;
+        }
+        pixel_powers(f_imgs, f_projs, f_ctf, ctf_index, trans, n, z, iy, x, tid, f_r2 + tid, f_a2 + tid);
+    }
+}''', options = ('-std=c++11', ), name_expressions = [f'{kernel}<{T}, {S}>' for kernel in ('score_fourier', 'weighted_powers') for T, S in (('float', 'float'), ('float', 'double'), ('double', 'double'))])
+
+def score_fourier(f_imgs : ArrayLike, f_projs : ArrayLike, f_ctf : ArrayLike, trans : ArrayLike, threshold_low : float, threshold_high : float = 1., acc_dtype : DTypeLike = None, ctf_index : Optional[ArrayLike] = None) -> cp.ndarray:
+    '''Scores of particles computed in Fourier space
+
+    Equivalent to ||B(CTF * P - T(I))||^2 - ||B(T(I))||^2 in real space,
+    where B is the bandpass filter and T the in-plane translation, via
+    Parseval's identity on the rfftn half plane.
+
+    Parameters
+    ----------
+    f_imgs : ArrayLike
+        shape (m, n, n // 2 + 1), dtype complex64 or complex128, rfftn of images
+    f_projs : ArrayLike
+        shape (m, n, n // 2 + 1), same precision as f_imgs, rfftn of projections
+    f_ctf : ArrayLike
+        shape (k, n, n // 2 + 1), same precision as f_imgs, see get_ctf
+    trans : ArrayLike
+        shape (m, 2), dtype float64
+    threshold_low : float
+        dimensionless, in range [0, 1]
+    threshold_high : float
+        dimensionless, in range [0, 1], 1 by default
+    acc_dtype : DTypeLike
+        float32 or float64, dtype in which norms are accumulated,
+        same precision as f_imgs by default
+    ctf_index : Optional[ArrayLike]
+        shape (m, ), dtype int32, the CTF of i-th particle is f_ctf[ctf_index[i]],
+        range(m) by default
+
+    Returns
+    -------
+    scores : cupy.ndarray
+        shape (m, ), dtype acc_dtype
+    '''
+    dtype = complex_dtype(getattr(f_imgs, 'dtype', cp.complex128))
+    acc_dtype = real_dtype(dtype if acc_dtype is None else acc_dtype)
+    f_imgs = cp.asarray(f_imgs, dtype = dtype)
+    f_projs = cp.asarray(f_projs, dtype = dtype)
+    f_ctf = cp.asarray(f_ctf, dtype = real_dtype(dtype))
+    trans = cp.asarray(trans, dtype = cp.float64)
+    m = f_imgs.shape[0]
+    n = f_imgs.shape[1]
+    ctf_index = cp.arange(m, dtype = cp.int32) if ctf_index is None else cp.asarray(ctf_index, dtype = cp.int32)
+    assert f_imgs.shape == f_projs.shape == (m, n, n // 2 + 1) and f_ctf.shape[1:] == (n, n // 2 + 1)
+    assert trans.shape == (m, 2) and ctf_index.shape == (m, )
+    assert acc_dtype.itemsize >= real_dtype(dtype).itemsize
+
+    f_score = cp.empty(f_imgs.shape, dtype = acc_dtype)
+    ker_score_fourier = module_score_fourier.get_function(f'score_fourier<{ctype(dtype)}, {ctype(acc_dtype)}>')
+    ker_score_fourier((ceil_div(f_score.size, 256), ), (256, ), (f_imgs, f_projs, f_ctf, ctf_index, trans, m, n, float(threshold_low), float(threshold_high), f_score))
+    return f_score.sum(axis = (1, 2)) / (n * n)
+
+def score_shells(f_imgs : ArrayLike, f_projs : ArrayLike, f_ctf : ArrayLike, trans : ArrayLike, threshold_high : float = 1., acc_dtype : DTypeLike = None, ctf_index : Optional[ArrayLike] = None) -> cp.ndarray:
+    '''Residual and image powers of particles in radial Fourier shells
+
+    Shell k contains frequencies f with k <= n * f < k + 1 and
+    f <= threshold_high, see rshell2. For integer k,
+    score_fourier(..., threshold_low = k / n, threshold_high) equals
+    (shells[:, 0, k:] - shells[:, 1, k:]).sum(axis = 1).
+
+    Parameters
+    ----------
+    f_imgs, f_projs, f_ctf, trans, threshold_high, acc_dtype, ctf_index :
+        see score_fourier
+
+    Returns
+    -------
+    shells : cupy.ndarray
+        shape (m, 2, num_shells(n)), dtype acc_dtype,
+        residual powers ||CTF * P - T(I)||^2 and image powers ||T(I)||^2
+    '''
+    dtype = complex_dtype(getattr(f_imgs, 'dtype', cp.complex128))
+    acc_dtype = real_dtype(dtype if acc_dtype is None else acc_dtype)
+    f_imgs = cp.asarray(f_imgs, dtype = dtype)
+    f_projs = cp.asarray(f_projs, dtype = dtype)
+    f_ctf = cp.asarray(f_ctf, dtype = real_dtype(dtype))
+    trans = cp.asarray(trans, dtype = cp.float64)
+    m = f_imgs.shape[0]
+    n = f_imgs.shape[1]
+    ctf_index = cp.arange(m, dtype = cp.int32) if ctf_index is None else cp.asarray(ctf_index, dtype = cp.int32)
+    assert f_imgs.shape == f_projs.shape == (m, n, n // 2 + 1) and f_ctf.shape[1:] == (n, n // 2 + 1)
+    assert trans.shape == (m, 2) and ctf_index.shape == (m, )
+    assert acc_dtype.itemsize >= real_dtype(dtype).itemsize
+
+    f_powers = cp.empty((2, ) + f_imgs.shape, dtype = acc_dtype)
+    ker_weighted_powers = module_score_fourier.get_function(f'weighted_powers<{ctype(dtype)}, {ctype(acc_dtype)}>')
+    ker_weighted_powers((ceil_div(f_imgs.size, 256), ), (256, ), (f_imgs, f_projs, f_ctf, ctf_index, trans, m, n, float(threshold_high), f_powers[0], f_powers[1]))
+
+    k = num_shells(n)
+    index = (cp.asarray(rshell2(n)) + cp.arange(2 * m)[:, None, None] * k).ravel()
+    shells = cp.bincount(index, weights = f_powers.ravel(), minlength = 2 * m * k)
+    return (shells.reshape(2, m, k).transpose(1, 0, 2) / (n * n)).astype(acc_dtype)
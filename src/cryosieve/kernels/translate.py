@@ -1,11 +1,12 @@
 import cupy as cp
 from cupy.fft import rfftn, irfftn
 from numpy.typing import ArrayLike
-from . import ceil_div
+from . import ceil_div, ctype, real_dtype
 
-ker_translate = cp.RawKernel(r'''
-extern "C" __global__ void translate(
-    double* f_stack,
+module_translate = cp.RawModule(code = r'''
+template<typename T>
+__global__ void translate(
+    T* f_stack,
     int m,
     int n,
     const double* trans)
@@ -17,16 +18,16 @@ extern "C" __global__ void translate(
         int y = tid / n_ % n; y = y < n_ ? y : y - n;
         int z = tid / n_ / n;
 
-        double pi = 3.1415926535897932384626;
-        double ax = f_stack[2 * tid    ];
-        double ay = f_stack[2 * tid + 1];
-        double tx = trans[2 * z    ];
-        double ty = trans[2 * z + 1];
-        double phi = -2 * pi * (tx * x / n + ty * y / n);
+        T pi = 3.1415926535897932384626;
+        T ax = f_stack[2 * tid    ];
+        T ay = f_stack[2 * tid + 1];
+        T tx = trans[2 * z    ];
+        T ty = trans[2 * z + 1];
+        T phi = -2 * pi * (tx * x / n + ty * y / n);
         f_stack[2 * tid    ] = ax * cos(phi) - ay * sin(phi);
         f_stack[2 * tid + 1] = ax * sin(phi) + ay * cos(phi);
     }
-}''', 'translate')
+}''', options = ('-std=c++11', ), name_expressions = ['translate<float>', 'translate<double>'])
 
 def translate(stack : ArrayLike, trans : ArrayLike) -> cp.ndarray:
     '''In-plane translation (in Fourier space)
@@ -34,21 +35,23 @@ def translate(stack : ArrayLike, trans : ArrayLike) -> cp.ndarray:
     Parameters
     ----------
     stack : ArrayLike
-        shape (m, n, n), dtype float64
+        shape (m, n, n), dtype float32 or float64
     trans : ArrayLike
         shape (m, 2), dtype float64
 
     Returns
     -------
     new_stack : cupy.ndarray
-        shape (m, n, n), dtype float64
+        shape (m, n, n), same precision as stack
     '''
-    stack = cp.asarray(stack, dtype = cp.float64)
+    dtype = real_dtype(getattr(stack, 'dtype', cp.float64))
+    stack = cp.asarray(stack, dtype = dtype)
     trans = cp.asarray(trans, dtype = cp.float64)
     m = stack.shape[0]
     n = stack.shape[1]
     assert stack.shape == (m, n, n) and trans.shape == (m, 2)
 
     f_stack = rfftn(stack, axes = (1, 2))
+    ker_translate = module_translate.get_function(f'translate<{ctype(dtype)}>')
     ker_translate((ceil_div(f_stack.size, 256), ), (256, ), (f_stack, m, n, trans))
-    return irfftn(f_stack, axes = (1, 2))
+    return irfftn(f_stack, s = (n, n), axes = (1, 2))
@@ -0,0 +1,121 @@
+import numpy as np
+from .kernels.cpu.project import quats_to_rots
+from .logger import logger
+
+def euler_to_quats(rot, tilt, psi):
+    '''Unit quaternions of RELION Euler angles (in radians), see ParticleDataset.'''
+    return np.stack([
+         np.cos((psi + rot) / 2) * np.cos(tilt / 2),
+        -np.sin((psi - rot) / 2) * np.sin(tilt / 2),
+        -np.cos((psi - rot) / 2) * np.sin(tilt / 2),
+        -np.sin((psi + rot) / 2) * np.cos(tilt / 2)
+    ], axis = -1)
+
+def parse_symmetry(sym : str):
+    '''Order of the rotation axis and whether the group is dihedral.
+    Only cyclic and dihedral groups are supported, others fall back to C1.'''
+    sym = sym.upper()
+    if len(sym) >= 2 and sym[0] in 'CD' and sym[1:].isdigit() and int(sym[1:]) > 0:
+        return int(sym[1:]), sym[0] == 'D'
+    logger.warning(f'Symmetry {sym} is not supported by the projection library, use C1 instead')
+    return 1, False
+
+def symmetry_matrices(order : int, dihedral : bool) -> np.ndarray:
+    '''Rotation matrices of group C{order} or D{order}, rotation axis along z
+    and two-fold axis along x as in RELION, shape (|G|, 3, 3).'''
+    mats = []
+    for k in range(order):
+        c, s = np.cos(2 * np.pi * k / order), np.sin(2 * np.pi * k / order)
+        rz = np.array([[c, -s, 0.], [s, c, 0.], [0., 0., 1.]])
+        mats.append(rz)
+        if dihedral:
+            mats.append(np.diag([1., -1., -1.]) @ rz)
+    return np.stack(mats)
+
+def library_quats(step : float, order : int = 1, dihedral : bool = False) -> np.ndarray:
+    '''Quaternions (psi = 0) of an approximately uniform grid of viewing
+    directions with angular step `step` (in radians), covering the
+    asymmetric unit of C{order} or D{order}.'''
+    tilt_max = np.pi / 2 if dihedral else np.pi
+    n_tilt = max(1, int(round(tilt_max / step)))
+    rots, tilts = [], []
+    for tilt in np.linspace(0, tilt_max, n_tilt + 1):
+        n_rot = max(1, int(np.ceil(2 * np.pi * np.sin(tilt) / step / order)))
+        rots.append(np.arange(n_rot) * (2 * np.pi / order / n_rot))
+        tilts.append(np.full(n_rot, tilt))
+    rots = np.concatenate(rots)
+    tilts = np.concatenate(tilts)
+    return euler_to_quats(rots, tilts, np.zeros_like(rots))
+
+def project_volume(backend, volume, quats, slab : int = None, support = None, chunk : int = None):
+    '''Real-space projections of `volume` with `support` from volume_support,
+    see kernels.project. If `slab` is given, `volume` stays on host and is
+    sent to the device in slabs of `slab` planes, whose projections add up
+    to the one of the volume. If `chunk` is given, the cpu backend
+    interpolates at most that many ray samples at once, see
+    kernels.cpu.project.'''
+    options = dict() if chunk is None else dict(chunk = chunk)
+    if slab is None:
+        return backend.project(volume, quats, support = support, **options)
+    stack = backend.project(backend.xp.asarray(volume[: slab]), quats, support = support, **options)
+    for z in range(slab, volume.shape[0], slab):
+        stack += backend.project(backend.xp.asarray(volume[z : z + slab]), quats, z, support, **options)
+    return stack
+
+class ProjectionLibrary(object):
+    '''
+    Projections of a volume on a grid of viewing directions.
+
+    The projection of a particle is the library entry nearest to its
+    viewing direction, folded by the symmetry group, rotated in plane
+    by rotate2d. Thus the cost of projection scales with the number of
+    library entries instead of the number of particles. A real-space
+    volume may be streamed in slabs of `slab` planes, and projected in
+    chunks of `project_chunk` ray samples, see project_volume.
+    '''
+
+    def __init__(self, backend, volume, n : int, step : float, sym : str = 'C1', projection : str = 'real', chunk : int = 50, slab : int = None, support = None, project_chunk : int = None):
+        self.backend = backend
+        self.volume = volume
+        self.n = n
+        self.projection = projection
+        self.slab = slab
+        self.support = support
+        self.project_chunk = project_chunk
+        order, dihedral = parse_symmetry(sym)
+        self.symmetry = symmetry_matrices(order, dihedral)
+        self.quats = library_quats(np.radians(step), order, dihedral)
+        self.rots = quats_to_rots(self.quats).reshape(-1, 3, 3)
+        self.directions = self.rots[:, 2]
+        self.stack = backend.xp.concatenate([self.exact(self.quats[i : i + chunk]) for i in range(0, len(self.quats), chunk)])
+
+    def __len__(self) -> int:
+        return len(self.quats)
+
+    def exact(self, quats):
+        if self.projection == 'fourier':
+            return self.backend.irfft2(self.backend.project_fourier(self.volume, quats, self.n), self.n)
+        return project_volume(self.backend, self.volume, quats, self.slab, self.support, self.project_chunk)
+
+    def project(self, quats):
+        '''Approximated projections of shape (m, n, n), see kernels.project.'''
+        rots = quats_to_rots(np.asarray(quats, dtype = np.float64)).reshape(-1, 1, 3, 3)
+
+        # Projections of R and R @ g are the same for g in the symmetry group.
+        candidates = rots @ self.symmetry
+        similarity = candidates[:, :, 2] @ self.directions.T
+        best = similarity.reshape(len(rots), -1).argmax(axis = 1)
+        i_sym, i_lib = np.divmod(best, len(self))
+        m = np.arange(len(rots))
+
+        # R @ g = Rz(angle) @ R_lib approximately, the projection of R is the one of R_lib rotated by angle.
+        inplane = candidates[m, i_sym] @ self.rots[i_lib].transpose(0, 2, 1)
+        angles = np.arctan2(inplane[:, 1, 0], inplane[:, 0, 0])
+        return self.backend.rotate2d(self.stack[self.backend.xp.asarray(i_lib)], angles)
+
+    def error(self, quats) -> float:
+        '''Mean relative L2 error of approximated projections.'''
+        xp = self.backend.xp
+        exact = self.exact(quats)
+        approx = self.project(quats)
+        return float((xp.linalg.norm(approx - exact, axis = (1, 2)) / xp.linalg.norm(exact, axis = (1, 2))).mean())
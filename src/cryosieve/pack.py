@@ -0,0 +1,59 @@
+import argparse
+import sys
+from .logger import logger
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description = 'cryosieve-pack: pack particles of a star file into a memory-mapped particle store')
+    parser.add_argument('--i',         type = str, required = True, help = 'input star file path')
+    parser.add_argument('--o',         type = str, required = True, help = 'output directory of the particle store')
+    parser.add_argument('--directory', type = str,                  help = 'directory of particles')
+    parser.add_argument('--dtype',     type = str, default = 'float32', choices = ['float32', 'float16'], help = 'data type of stored images, float32 by default')
+    if len(sys.argv) == 1:
+        parser.print_help()
+        exit()
+    return parser.parse_args()
+
+def pack(dataset, store_path, dtype = 'float32', batch_size = 256):
+    '''Pack particles of `dataset` into a particle store at `store_path`.
+
+    The store is a directory holding all images in one contiguous array
+    `images.npy` and their rlnImageName in `index.npz`. Images are stored
+    in stack order, so that a run of consecutive slices is one slice of
+    `images.npy`. Repeated images are stored once.
+    '''
+    import numpy as np
+    from pathlib import Path
+
+    store_path = Path(store_path)
+    store_path.mkdir(parents = True, exist_ok = True)
+    order = dataset.stack_order()
+    names = dataset.image_names[dataset.indices[order]]
+    _, first = np.unique(names, return_index = True)
+    first = np.sort(first)
+    packed = dataset.subset(order[first])
+
+    # The index is written last, an interrupted store is not valid.
+    if (store_path / 'index.npz').exists():
+        (store_path / 'index.npz').unlink()
+    n = packed.image_format[0][0]
+    images = np.lib.format.open_memmap(store_path / 'images.npy', mode = 'w+', dtype = dtype, shape = (len(packed), n, n))
+    for start, (imgs, _) in zip(range(0, len(packed), batch_size), packed.iter_batches(batch_size)):
+        images[start : start + len(imgs)] = imgs
+    images.flush()
+    del images
+    np.savez(store_path / 'index.npz', names = names[first])
+    logger.info(f'Pack {len(packed)} particles of size {n} into {str(store_path)}, {len(packed) * n * n * np.dtype(dtype).itemsize / 2 ** 30:.2f} GB')
+
+def main():
+    args = parse_arguments()
+
+    from time import time
+    from .ParticleDataset import ParticleDataset
+    time0 = time()
+    # Pixel size is not used by packing, but needed to parse star files before RELION 3.1.
+    pack(ParticleDataset(args.i, args.directory, 1.), args.o, args.dtype)
+    time1 = time()
+    logger.info(f'Execute cryosieve-pack successfully in {time1 - time0:.2f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import sys
+from .logger import logger
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description = 'cryosieve-reselect: re-select particles from radial shell scores of cryosieve-core without rescoring')
+    parser.add_argument('--i',               type = str,   required = True, help = 'input star file path, the same as the input of cryosieve-core')
+    parser.add_argument('--shells',          type = str,   required = True, help = 'radial shell scores written by cryosieve-core --shells')
+    parser.add_argument('--o',               type = str,   required = True, help = 'output star file path')
+    parser.add_argument('--angpix',          type = float,                  help = 'pixelsize in Angstrom, the one used by cryosieve-core by default')
+    parser.add_argument('--retention_ratio', type = float, required = True, help = 'fraction of retained particles')
+    parser.add_argument('--frequency',       type = float, required = True, help = 'cut-off highpass frequency')
+    if len(sys.argv) == 1:
+        parser.print_help()
+        exit()
+    return parser.parse_args()
+
+def scores_from_shells(residual, power, threshold, n):
+    '''Scores of particles with highpass threshold `threshold` (dimensionless),
+    the threshold is rounded up to the nearest shell boundary.'''
+    import numpy as np
+    k = int(np.ceil(threshold * n))
+    return (residual[:, k:].astype(np.float64) - power[:, k:]).sum(axis = 1)
+
+def process(args):
+    import numpy as np
+    import pandas as pd
+    from pathlib import Path
+    from .ParticleDataset import ParticleDataset
+
+    shells = np.load(args.shells)
+    n = int(shells['n'])
+    angpix = float(shells['angpix']) if args.angpix is None else args.angpix
+    dataset = ParticleDataset(args.i, None, angpix, index_stacks = False)
+    positions = pd.Index(shells['names']).get_indexer(dataset.image_names)
+    if np.any(positions < 0):
+        raise ValueError(f'{np.count_nonzero(positions < 0)} particle(s) of {args.i} missed in {args.shells}')
+
+    # Shells hold no frequencies above --max_resolution of cryosieve-core.
+    threshold = angpix / args.frequency
+    threshold_high = float(shells['threshold_high']) if 'threshold_high' in shells else 1.
+    if threshold_high <= threshold:
+        raise ValueError(f'`--frequency` should be lower than the highest resolution {angpix / threshold_high:.2f} Angstrom of {args.shells}')
+    k = int(np.ceil(threshold * n))
+    logger.info(f'Use shells from {k} on, effective threshold frequency {n * angpix / k if k > 0 else np.inf:.2f} Angstrom')
+    scores = scores_from_shells(shells['residual'][positions], shells['power'][positions], threshold, n)
+
+    mask = np.zeros(len(dataset), dtype = np.bool_)
+    for i in range(dataset.n_random_subset()):
+        subset = dataset.get_random_subset(i + 1)
+        n_rem = round(args.retention_ratio * len(subset))
+        indices = subset.indices[np.argsort(scores[subset.indices])]
+        mask[indices[:n_rem]] = True
+        logger.info(f'Re-select subset {i}, {n_rem} of {len(subset)} particles remained')
+
+    output_path = Path(args.o)
+    dataset.subset(mask).save(output_path)
+    dataset.subset(~mask).save(output_path.with_stem(output_path.stem + '_sieved'))
+
+def main():
+    args = parse_arguments()
+
+    from time import time
+    time0 = time()
+    process(args)
+    time1 = time()
+    logger.info(f'Execute cryosieve-reselect successfully in {time1 - time0:.2f}s')
+
+if __name__ == '__main__':
+    main()
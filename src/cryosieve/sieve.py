@@ -1,83 +1,309 @@
-import cupy as cp
 import numpy as np
+import tracemalloc
 from threading import Thread
-from torch.utils.data import DataLoader
-from .kernels import convolute_ctf, highpass2d, project, translate
+from .ctf_cache import CTFCache
+from .kernels import PRECISIONS, ceil_div, complex_dtype, get_backend
+from .library import ProjectionLibrary, library_quats, parse_symmetry, project_volume
+from .spectrum_cache import translate_spectra
 from .logger import logger
 
-def collate_fn(batch):
-    imgs, paras = zip(*batch)
-    imgs = np.stack(imgs)
-    paras = np.stack(paras)
-    return imgs, paras
+def crop_windows(imgs, trans, size):
+    '''Crop images to windows of given size around particle centers.
 
-def score_particles(dataset, volume, threshold, device_id, num_gpus, g):
+    Windows are shifted by integer pixels, the remaining translations are returned.
+    '''
+    m, n = imgs.shape[0], imgs.shape[1]
+    o = n // 2 - size // 2
+    origins = np.clip(o - np.rint(trans).astype(np.int64), 0, n - size)
+    r = np.arange(size)
+    rows = (origins[:, 1, None] + r)[:, :, None]
+    cols = (origins[:, 0, None] + r)[:, None, :]
+    return imgs[np.arange(m)[:, None, None], rows, cols], trans + origins - o
+
+def plan_memory(budget, n, box, volumes, dtype, acc_dtype, projection = 'real', ctf_cache = 256, library_size = 0, shells = False, image_bytes = 0, prefetch = 2, host = False):
+    '''Sub-batch size, slab thickness (None if volumes fit) and projection
+    chunk (None if not bounded) of scoring under a memory budget of
+    `budget` bytes per device.
+
+    Device memory is estimated as volumes, cached CTFs and projection
+    libraries, plus per particle images, spectra and projections, and
+    temporaries of score_fourier. Real-space volumes that do not fit
+    stay on host and are streamed in slabs, see project_volume. If the
+    device is the `host` (cpu backend), the budget also holds `prefetch + 1`
+    read-ahead buffers of images of `image_bytes` bytes, see iter_batches,
+    and temporaries of real-space projection, whose chunk of ray samples
+    takes at most a quarter of the budget, see kernels.cpu.project.
+    '''
+    r = np.dtype(dtype).itemsize
+    a = np.dtype(acc_dtype).itemsize
+    half = box * (box // 2 + 1)
+    fixed = (ctf_cache + 3) * half * r + library_size * box * box * r * len(volumes)
+    per_particle = r * (3 * n * n + box * box + 12 * half) + (2 * a * half if shells else 0) + (half * r if ctf_cache == 0 else 0)
+    chunk = None
+    max_chunk_bytes = 0
+    if host:
+        from .kernels.cpu.project import CHUNK, SAMPLE_BYTES
+        per_particle += (prefetch + 1) * image_bytes
+        if projection == 'real':
+            # One step of all rays is counted per particle, the chunk only speeds up projection.
+            max_chunk_bytes = CHUNK * SAMPLE_BYTES
+            chunk = int(min(CHUNK, budget // 4 // SAMPLE_BYTES))
+            fixed += chunk * SAMPLE_BYTES
+            per_particle += box * box * SAMPLE_BYTES
+    volume_bytes = sum(volume.size for volume in volumes) * (2 * r if projection == 'fourier' else r)
+
+    slab = None
+    plane = box * box * r
+    if fixed + volume_bytes + per_particle > budget:
+        if projection == 'fourier':
+            raise ValueError(f'Memory budget of {budget / 2 ** 30:.2f} GB cannot hold Fourier volumes of {volume_bytes / 2 ** 30:.2f} GB, use real projection to stream volumes in slabs')
+        slab = int(np.clip((budget - fixed) // 4 // plane, 1, box))
+        volume_bytes = slab * plane
+    sub_batch = int((budget - fixed - volume_bytes) // per_particle)
+    if sub_batch < 1:
+        # A sufficient budget holds slabs (at most a quarter of the rest)
+        # and the chunk of ray samples (at most a quarter of the budget).
+        rest = max(plane + per_particle, per_particle * 4 / 3) if projection == 'real' else volume_bytes + per_particle
+        least = fixed - (0 if chunk is None else chunk * SAMPLE_BYTES) + rest
+        least += min(least / 3, max_chunk_bytes)
+        raise ValueError(f'Memory budget of {budget / 2 ** 30:.3g} GB is too small to score images of size {n} in a {box} pixels box, use a budget of at least {least / 2 ** 30:.3g} GB')
+    return min(sub_batch, 1000), slab, chunk
+
+def score_particles(dataset, volumes, threshold, device_id, num_devices, g, backend, projection = 'real', precision = 'float64', ctf_cache = 256, shells = None, library_step = None, sym = 'C1', threshold_high = 1., box = None, window = None, memory_budget = None, spectra = None):
     m = len(dataset)
-    batch_size = 50
+    k = len(volumes)
+    xp = backend.xp
+    dtype, acc_dtype = PRECISIONS[precision]
 
     # Take device_id-th part of dataset
-    l, r = round(device_id / num_gpus * m), round((device_id + 1) / num_gpus * m)
+    l, r = round(device_id / num_devices * m), round((device_id + 1) / num_devices * m)
     mask = np.zeros(m, dtype = np.bool_)
     mask[l : r] = True
     subset = dataset.subset(mask)
-    loader = DataLoader(subset, batch_size, collate_fn = collate_fn)
-    n_batch = len(loader)
+
+    # Particles are scored in stack order to coalesce reads, and their scores
+    # are scattered back to the original order.
+    order = subset.stack_order()
+    subset = subset.subset(order)
+
+    # Under a memory budget, batches are scored in sub-batches of planned size,
+    # and volumes are streamed in slabs if they do not fit on the device.
+    # On the cpu backend, read-ahead buffers of batches count in the budget,
+    # so batches are not larger than sub-batches.
+    sub_batch, slab, chunk = 50, None, None
+    batch_size = 50
+    host = backend.name == 'cpu'
+    if memory_budget is not None and r > l:
+        # Sizes are taken from stack headers, or from the spectrum cache if
+        # images are not read at all.
+        if spectra is not None and spectra.complete:
+            n, image_bytes = spectra.size, 0
+        else:
+            shape, image_dtype = subset.image_format
+            n, image_bytes = window if window is not None else shape[0], int(np.prod(shape)) * np.dtype(image_dtype).itemsize
+        library_size = 0 if library_step is None else len(library_quats(np.radians(library_step), *parse_symmetry(sym)))
+        sub_batch, slab, chunk = plan_memory(memory_budget, n, n if box is None else box, volumes, dtype, acc_dtype, projection, ctf_cache, library_size, shells is not None, image_bytes, host = host)
+        batch_size = sub_batch if host else max(50, sub_batch)
+        logger.info(f'[{backend.device_name} {device_id}] Memory budget {memory_budget / 2 ** 30:.2f} GB: sub-batches of {sub_batch} particles' + ('' if slab is None else f', volumes streamed in slabs of {slab} planes'))
+    io_stats = dict()
+    if spectra is not None and spectra.complete:
+        # Images are not read, their spectra are in the spectrum cache.
+        loader = ((None, subset.paras[subset.indices[start : start + batch_size]]) for start in range(0, len(subset), batch_size))
+    else:
+        loader = subset.iter_batches(batch_size, stats = io_stats)
+    n_batch = ceil_div(len(subset), batch_size)
     log_interval = min(max(1, (n_batch + 4) // 5), 200)
-    scores = cp.empty(r - l, dtype = cp.float64)
 
-    cp.cuda.runtime.setDevice(device_id)
-    volume = cp.asarray(volume, dtype = cp.float64)
+    backend.set_device(device_id)
+    scores = xp.empty((r - l, k), dtype = acc_dtype)
+    if shells is not None:
+        scores_shells = xp.empty((r - l, ) + shells.shape[1:], dtype = acc_dtype)
+    # Masked volumes are mostly zero, rays are clipped to their support.
+    supports = [backend.volume_support(volume) if projection == 'real' else None for volume in volumes]
+    if slab is None:
+        volumes = [xp.asarray(volume, dtype = complex_dtype(dtype) if projection == 'fourier' else dtype) for volume in volumes]
+    else:
+        volumes = [np.asarray(volume, dtype = dtype) for volume in volumes]
+    scale = None
+    cache = None
+    libraries = None
+    peak = 0
 
     for i_batch, batch in enumerate(loader):
+        for i_sub in range(0, len(batch[1]), sub_batch):
+
+            # Prepare batch data
+            paras = batch[1][i_sub : i_sub + sub_batch]
+            trans = paras[:, 0:2]
+            if batch[0] is None:
+                imgs = None
+                n = spectra.size
+            else:
+                if window is not None:
+                    imgs, trans = crop_windows(batch[0][i_sub : i_sub + sub_batch], trans, window)
+                else:
+                    imgs = batch[0][i_sub : i_sub + sub_batch]
+                imgs = xp.asarray(imgs, dtype = dtype)
+                n = imgs.shape[1]
+            quats = paras[:, 2:6]
+            ctfs  = paras[:, 6:14]
+            ctf_ids = paras[:, 15].astype(np.int64)
+            start = i_batch * batch_size + i_sub
+            stop = start + len(paras)
+
+            # Scoring runs in a Fourier cropped box of size `box`, whose pixels
+            # are n / box times larger, see fourier_crop2. Norms are rescaled
+            # by scale ** 2 to match the ones in the full box.
+            if scale is None:
+                box = n if box is None else box
+                scale = n / box
+                ctf_table = dataset.ctf_table.copy()
+                ctf_table[:, 7] *= scale
+                cache = CTFCache(backend, ctf_table, ctf_cache, dtype) if ctf_cache > 0 else None
+            if box < n:
+                # Also moves the image center n // 2 onto the cropped center box // 2.
+                trans = trans / scale + (box // 2 - n // 2 / scale)
+                ctfs = ctfs.copy()
+                ctfs[:, 7] *= scale
+
+            # Projection libraries are built once the box size is known
+            if library_step is not None and libraries is None:
+                libraries = [ProjectionLibrary(backend, volume, box, library_step, sym, projection, slab = slab, support = support, project_chunk = chunk) for volume, support in zip(volumes, supports)]
+                for j, library in enumerate(libraries):
+                    logger.info(f'[{backend.device_name} {device_id}] Projection library of volume {j}: {len(library)} entries, relative interpolation error {library.error(quats) * 100:.2f}%')
 
-        # Prepare batch data
-        imgs = cp.asarray(batch[0], dtype = cp.float64)
-        paras = batch[1]
-        trans = paras[:, 0:2]
-        quats = paras[:, 2:6]
-        ctfs  = paras[:, 6:14]
-
-        # Compute score
-        imgs = translate(imgs, trans)
-        projs = convolute_ctf(project(volume, quats), ctfs) - imgs
-        imgs = highpass2d(imgs, threshold)
-        projs = highpass2d(projs, threshold)
-        start = i_batch * batch_size
-        stop = start + len(imgs)
-        scores[start : stop] = cp.linalg.norm(projs, axis = (1, 2)) ** 2 - cp.linalg.norm(imgs, axis = (1, 2)) ** 2
+            # Images and CTFs are shared by all volumes
+            if imgs is None:
+                f_imgs = xp.asarray(spectra.get(subset.indices[start : stop]), dtype = complex_dtype(dtype))
+                trans = np.zeros_like(trans)
+            else:
+                f_imgs = backend.rfft2(imgs)
+                if box < n:
+                    f_imgs = backend.fourier_crop2(f_imgs, box)
+                if spectra is not None:
+                    # Spectra are cached translated in the scoring precision, and are scored as cached.
+                    f_imgs = translate_spectra(backend, f_imgs, trans).astype(spectra.dtype)
+                    spectra.put(subset.indices[start : stop], backend.asnumpy(f_imgs))
+                    f_imgs = f_imgs.astype(complex_dtype(dtype))
+                    trans = np.zeros_like(trans)
+            n = box
+            if cache is not None:
+                f_ctf, ctf_index = cache.get(ctf_ids, n)
+            else:
+                f_ctf, ctf_index = backend.get_ctf(ctfs, n, dtype = dtype), None
+
+            # Compute score in Fourier space
+            for j, volume in enumerate(volumes):
+                if libraries is not None:
+                    f_projs = backend.rfft2(libraries[j].project(quats))
+                elif projection == 'fourier':
+                    f_projs = backend.project_fourier(volume, quats, n)
+                else:
+                    f_projs = backend.rfft2(project_volume(backend, volume, quats, slab, supports[j], chunk))
+                scores[start : stop, j] = backend.score_fourier(f_imgs, f_projs, f_ctf, trans, threshold * scale, threshold_high * scale, acc_dtype = acc_dtype, ctf_index = ctf_index) * scale ** 2
+                if shells is not None:
+                    scores_shells[start : stop, j] = backend.score_shells(f_imgs, f_projs, f_ctf, trans, threshold_high * scale, acc_dtype = acc_dtype, ctf_index = ctf_index) * scale ** 2
+            peak = max(peak, backend.memory_usage())
         if (i_batch + 1) % log_interval == 0 or i_batch + 1 == n_batch:
-            logger.info(f'[GPU {device_id}][{i_batch + 1}/{n_batch}] Scored particle batches')
+            logger.info(f'[{backend.device_name} {device_id}][{i_batch + 1}/{n_batch}] Scored particle batches')
+
+    if cache is not None:
+        logger.info(f'[{backend.device_name} {device_id}] CTF cache: {cache.stats()}')
+    if io_stats.get('reads', 0) > 0:
+        logger.info(f'[{backend.device_name} {device_id}] Read {r - l} particles in {io_stats["reads"]} reads, {io_stats["bytes"] / io_stats["reads"] / 2 ** 20:.2f} MB/read, {io_stats["reads"] / max(io_stats["seconds"], 1e-9):.1f} reads/s per worker')
+    if memory_budget is not None and not host:
+        logger.info(f'[{backend.device_name} {device_id}] Peak memory {peak / 2 ** 30:.2f} GB of budget {memory_budget / 2 ** 30:.2f} GB')
 
-    g[l : r] = cp.asnumpy(scores)
+    g[l + order] = backend.asnumpy(scores)
+    if shells is not None:
+        shells[l + order] = backend.asnumpy(scores_shells)
 
-def score_particles_safe(dataset, volume, threshold, device_id, num_gpus, g, errors):
+def score_particles_safe(dataset, volumes, threshold, device_id, num_devices, g, backend, projection, precision, ctf_cache, shells, library_step, sym, threshold_high, box, window, memory_budget, spectra, errors):
     try:
-        score_particles(dataset, volume, threshold, device_id, num_gpus, g)
+        score_particles(dataset, volumes, threshold, device_id, num_devices, g, backend, projection, precision, ctf_cache, shells, library_step, sym, threshold_high, box, window, memory_budget, spectra)
     except BaseException as error:
         errors[device_id] = error
 
-def sieve(dataset, volume, threshold, number, num_gpus):
+def score(dataset, volumes, threshold, num_devices, backend = 'cuda', projection = 'real', precision = 'float64', ctf_cache = 256, shells = None, library_step = None, sym = 'C1', threshold_high = 1., box = None, window = None, memory_budget = None, spectra = None):
+    '''Scores of particles against each of `volumes`, reading every particle once.
+
+    Returns an array of shape (m, len(volumes)). If `shells` of shape
+    (m, len(volumes), 2, num_shells(n)) is given, it is filled with residual
+    and image powers of particles in radial shells, see score_shells.
+    If `library_step` (in degrees) is given, projections are taken from a
+    ProjectionLibrary of the volume, folded by symmetry group `sym`.
+    Frequencies above `threshold_high` are ignored. If `box` is given,
+    images are Fourier cropped to that size and `volumes` should have
+    been cropped alike, see fourier_crop3. If `window` is given, images
+    are first cropped to a window of that size around particle centers,
+    and `volumes` should have been cropped to the same size. If
+    `memory_budget` (in bytes per device) is given, batch sizes are
+    planned to fit it, see plan_memory. If a SpectrumCache `spectra` is
+    given, image spectra are read from it, or written to it if incomplete.
+    '''
     m = len(dataset)
-    g = np.empty(m, dtype = np.float64)
-    errors = [None] * num_gpus
+    g = np.empty((m, len(volumes)), dtype = np.float64)
+    errors = [None] * num_devices
+    backend = get_backend(backend)
 
-    if num_gpus == 1:
-        score_particles(dataset, volume, threshold, 0, 1, g)
-    else:
-        threads = [
-            Thread(target = score_particles_safe, args = (dataset, volume, threshold, tid, num_gpus, g, errors))
-            for tid in range(num_gpus)
-        ]
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
-
-        for error in errors:
-            if error is not None:
-                raise error
-
-    indices = np.argsort(g)
-    mask = np.zeros(m, dtype = np.bool_)
-    mask[indices[:number]] = True
-    return dataset.subset(mask)
+    # On the cpu backend, all threads share host memory, their allocations
+    # are traced to report the peak against the budget.
+    trace = memory_budget is not None and backend.name == 'cpu' and not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start()
+
+    try:
+        if num_devices == 1:
+            score_particles(dataset, volumes, threshold, 0, 1, g, backend, projection, precision, ctf_cache, shells, library_step, sym, threshold_high, box, window, memory_budget, spectra)
+        else:
+            threads = [
+                Thread(target = score_particles_safe, args = (dataset, volumes, threshold, tid, num_devices, g, backend, projection, precision, ctf_cache, shells, library_step, sym, threshold_high, box, window, memory_budget, spectra, errors))
+                for tid in range(num_devices)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            for error in errors:
+                if error is not None:
+                    raise error
+    finally:
+        if trace:
+            peak = backend.memory_usage()
+            tracemalloc.stop()
+    if trace:
+        logger.info(f'[{backend.device_name}] Peak traced memory {peak / 2 ** 30:.2f} GB of {num_devices} thread(s), budget {memory_budget / 2 ** 30:.2f} GB per thread')
+    return g
+
+def cascade(dataset, volumes, coarse_volumes, threshold, number, num_devices, backend = 'cuda', projection = 'real', precision = 'float64', ctf_cache = 256, library_step = None, sym = 'C1', threshold_high = 1., box = None, window = None, coarse_threshold_high = 1., coarse_box = None, band = 3., n_sample = 200, memory_budget = None):
+    '''Scores of particles computed coarse-to-fine, see score.
+
+    All particles are scored with `coarse_volumes` in a box of size
+    `coarse_box` up to `coarse_threshold_high`. Full scores are predicted
+    by a linear fit on a random sample of `n_sample` particles, and only
+    particles predicted within `band` standard deviations of the fit from
+    the cutoff of the lowest `number` are rescored at full fidelity.
+    '''
+    m = len(dataset)
+    g = score(dataset, coarse_volumes, threshold, num_devices, backend, projection, precision, ctf_cache, None, library_step, sym, coarse_threshold_high, coarse_box, window, memory_budget)
+    sample = np.zeros(m, dtype = np.bool_)
+    sample[np.random.default_rng(0).permutation(m)[:n_sample]] = True
+    g_sample = score(dataset.subset(sample), volumes, threshold, num_devices, backend, projection, precision, ctf_cache, None, library_step, sym, threshold_high, box, window, memory_budget)
+
+    rescore = np.zeros(m, dtype = np.bool_)
+    for k in range(g.shape[1]):
+        a, b = np.polyfit(g[sample, k], g_sample[:, k], 1)
+        sigma = np.std(g_sample[:, k] - (a * g[sample, k] + b))
+        g[:, k] = a * g[:, k] + b
+        if 0 < number < m:
+            cutoff = np.partition(g[:, k], number - 1)[number - 1]
+            rescore |= np.abs(g[:, k] - cutoff) <= band * sigma
+        logger.info(f'Cascade score {k}: full = {a:.4f} * coarse + {b:.4f}, residual std {sigma:.4f}')
+    g[sample] = g_sample
+    rescore &= ~sample
+
+    if np.any(rescore):
+        g[rescore] = score(dataset.subset(rescore), volumes, threshold, num_devices, backend, projection, precision, ctf_cache, None, library_step, sym, threshold_high, box, window, memory_budget)
+    logger.info(f'Cascade rescores {np.count_nonzero(rescore | sample)} of {m} particles ({np.count_nonzero(rescore | sample) / m * 100:.2f}%) at full fidelity')
+    return g
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+from os import PathLike
+from pathlib import Path
+from numpy.typing import ArrayLike, DTypeLike
+from .kernels.cpu.fft import rfreq2
+from .logger import logger
+
+def translate_spectra(backend, f_imgs, trans : ArrayLike):
+    '''Half-plane spectra translated by `trans` (shape (m, 2)), the same
+    phase shift as applied to images by score_fourier.'''
+    xp = backend.xp
+    n = f_imgs.shape[1]
+    x, y = rfreq2(n)
+    x, y = xp.asarray(x), xp.asarray(y)
+    trans = xp.asarray(trans, dtype = np.float64)
+    phi = -2 * np.pi * (trans[:, 0, None, None] * x / n + trans[:, 1, None, None] * y / n)
+    return f_imgs * xp.exp(1j * phi).astype(f_imgs.dtype)
+
+class SpectrumCache(object):
+    '''
+    On-disk cache of half-plane image spectra, pre-translated by particle
+    origins, shared by runs on the same particles.
+
+    The cache at `path` is a directory holding spectra of box size `box`
+    and complex dtype `dtype` (of the scoring precision), Fourier cropped
+    from images (or windows of them) of size `size`, in `spectra.npy`,
+    and rlnImageName and origins of particles in `index.npz`. It is
+    reused if it holds all particles of `dataset` with the same origins,
+    sizes and dtype, otherwise it is rewritten while scoring, and becomes
+    valid after finish().
+    '''
+
+    def __init__(self, path : PathLike, dataset, size : int, box : int, dtype : DTypeLike = np.complex64):
+        self.path = Path(path)
+        self.size = size
+        self.box = box
+        self.dtype = np.dtype(dtype)
+        names = dataset.image_names
+        origins = dataset.paras[:, 0:2]
+        if len(np.unique(names)) != len(names):
+            raise ValueError('Spectrum cache needs particles of distinct rlnImageName')
+
+        self.complete = False
+        index_path = self.path / 'index.npz'
+        if index_path.is_file():
+            index = np.load(index_path)
+            rows = pd.Index(index['names']).get_indexer(names)
+            # Caches without dtype hold complex64 spectra.
+            if int(index['size']) != size or int(index['box']) != box:
+                reason = 'image or box size changed'
+            elif np.dtype(str(index['dtype']) if 'dtype' in index else np.complex64) != self.dtype:
+                reason = 'precision changed'
+            elif np.any(rows < 0):
+                reason = f'{np.count_nonzero(rows < 0)} particle(s) are not cached'
+            elif not np.array_equal(index['origins'][rows], origins):
+                reason = 'origins changed'
+            else:
+                self.rows = rows
+                self.spectra = np.load(self.path / 'spectra.npy', mmap_mode = 'r')
+                self.complete = True
+                logger.info(f'Reuse spectrum cache {str(self.path)} of {len(self.spectra)} particles')
+                return
+            logger.info(f'Spectrum cache {str(self.path)} is invalid ({reason}), rebuild it')
+
+        # The index is written last, an interrupted cache is not valid.
+        self.path.mkdir(parents = True, exist_ok = True)
+        if index_path.exists():
+            index_path.unlink()
+        self.names = names
+        self.origins = origins.copy()
+        self.rows = np.arange(len(names))
+        self.spectra = np.lib.format.open_memmap(self.path / 'spectra.npy', mode = 'w+', dtype = self.dtype, shape = (len(names), box, box // 2 + 1))
+
+    def get(self, js : ArrayLike) -> np.ndarray:
+        '''Cached spectra of particles `js` (rows of dataset.paras).'''
+        return self.spectra[self.rows[js]]
+
+    def put(self, js : ArrayLike, f_imgs : ArrayLike):
+        self.spectra[self.rows[js]] = f_imgs
+
+    def finish(self):
+        if not self.complete:
+            self.spectra.flush()
+            np.savez(self.path / 'index.npz', names = self.names, origins = self.origins, size = self.size, box = self.box, dtype = self.dtype.name)
+            self.complete = True
+            logger.info(f'Save spectrum cache {str(self.path)} of {len(self.spectra)} particles')
@@ -0,0 +1,239 @@
+import io
+import mmap
+import os
+import numpy as np
+import pandas as pd
+from os import PathLike
+from typing import Collection, Optional
+from numpy.typing import ArrayLike, NDArray
+
+# Whitespace bytes of a STAR file, as a lookup table.
+_WHITESPACE = np.zeros(256, dtype = np.bool_)
+_WHITESPACE[list(b' \t\n\r\v\f')] = True
+
+def _is_skipped(line : bytes) -> bool:
+    '''Blank and comment lines of a STAR file.'''
+    line = line.strip()
+    return len(line) == 0 or line.startswith(b'#')
+
+def _parse_rows(text : bytes, labels : list, usecols : list) -> Optional[pd.DataFrame]:
+    '''Columns `usecols` of rows of a loop in `text`, None if there is no row.'''
+    try:
+        # At least one column is parsed to keep the number of rows.
+        table = pd.read_csv(io.BytesIO(text), sep = r'\s+', header = None, comment = '#', usecols = usecols or [0])
+    except pd.errors.EmptyDataError:
+        return None
+    table.columns = [labels[i] for i in table.columns]
+    return table if usecols else table.iloc[:, :0]
+
+def _row_spans(text : bytes, offset : int) -> NDArray[np.int64]:
+    '''
+    Byte spans [start, end) of rows (lines which are neither blank nor
+    comments) in `text`, which is at `offset` of the file. Ends include
+    the line break.
+    '''
+    data = np.frombuffer(text, dtype = np.uint8)
+    ends = np.flatnonzero(data == ord('\n')) + 1
+    if len(ends) == 0 or ends[-1] != len(data):
+        ends = np.append(ends, len(data))
+    starts = np.concatenate([[0], ends[:-1]])
+
+    # First non-whitespace byte of each line, lines are seldom indented by much.
+    first = starts.copy()
+    live = np.flatnonzero(first < ends)
+    while len(live) > 0:
+        live = live[_WHITESPACE[data[first[live]]]]
+        first[live] += 1
+        live = live[first[live] < ends[live]]
+    rows = first < ends
+    rows[rows] = data[first[rows]] != ord('#')
+    return np.stack([starts[rows], ends[rows]], axis = 1) + offset
+
+class _DigestReader(object):
+    '''
+    Binary file updating `digest` with each byte of the file the first
+    time it is read. Files are read forward and only seek backward, so
+    bytes are hashed in order.
+    '''
+
+    def __init__(self, f, digest):
+        self.f = f
+        self.digest = digest
+        self.end = 0
+
+    def _hash(self, position : int, data : bytes) -> bytes:
+        if position + len(data) > self.end:
+            self.digest.update(data[self.end - position :])
+            self.end = position + len(data)
+        return data
+
+    def read(self, size : int = -1) -> bytes:
+        return self._hash(self.f.tell(), self.f.read(size))
+
+    def readline(self) -> bytes:
+        return self._hash(self.f.tell(), self.f.readline())
+
+    def tell(self) -> int:
+        return self.f.tell()
+
+    def seek(self, offset : int) -> int:
+        return self.f.seek(offset)
+
+def _read_loop(f, labels : list, columns : Optional[Collection[str]], chunk_size : int, spans : Optional[list] = None) -> pd.DataFrame:
+    '''
+    Parse rows of a loop from the current position of `f`, and leave `f` at
+    the next data block (or the end of file). Byte spans of rows are
+    appended to `spans` if given.
+    '''
+    usecols = [i for i, label in enumerate(labels) if columns is None or label in columns]
+    tables = []
+    offset = f.tell()
+    rest = b''
+    while True:
+        data = f.read(chunk_size)
+        text = rest + data
+
+        # The loop ends at the next data block. The text always starts at a line.
+        end = 0 if text.startswith(b'data_') else text.find(b'\ndata_')
+        if end >= 0:
+            end += text[end : end + 1] == b'\n'
+            body, rest = text[: end], None
+        elif len(data) == 0:
+            body, rest = text, None
+        else:
+            cut = text.rfind(b'\n') + 1
+            body, rest = text[: cut], text[cut :]
+
+        table = _parse_rows(body, labels, usecols) if body.strip() else None
+        if table is not None:
+            tables.append(table)
+            if spans is not None:
+                spans.append(_row_spans(body, offset))
+                if len(spans[-1]) != len(table):
+                    raise ValueError(f'Cannot locate rows of loop at byte {offset} of star file')
+        if rest is None:
+            f.seek(offset + len(body))
+            break
+        offset += len(body)
+
+    if len(tables) == 0:
+        return pd.DataFrame(columns = [labels[i] for i in usecols])
+    return tables[0] if len(tables) == 1 else pd.concat(tables, ignore_index = True)
+
+def read_star(
+    path : PathLike,
+    columns : Optional[Collection[str]] = None,
+    chunk_size : int = 1 << 25,
+    row_spans : bool = False,
+    digest = None
+):
+    '''
+    Read data blocks of a STAR file into DataFrames, keyed as by
+    starfile.read(path, always_dict = True).
+
+    Only columns in `columns` (all columns if None) are kept, other columns
+    of a loop are not converted. Rows of a loop are streamed in chunks of
+    about `chunk_size` bytes through the C parser of pandas, so the text of
+    at most one chunk is held in memory besides the columns read.
+
+    If `row_spans` is True, (blocks, spans) is returned, where spans has the
+    keys of blocks, and holds the byte spans [start, end) of rows of each
+    loop as an (n, 2) array (None for blocks of pairs), for write_star_rows.
+    If a hashlib object `digest` is given, it is updated with the whole
+    file as it is read.
+    '''
+    blocks = dict()
+    spans = dict()
+
+    def add(name : str, table : pd.DataFrame, block_spans : Optional[list] = None):
+        key = len(blocks) if name == '' or name in blocks else name
+        blocks[key] = table
+        spans[key] = None if block_spans is None else \
+            np.concatenate(block_spans) if len(block_spans) > 0 else np.empty((0, 2), dtype = np.int64)
+
+    with open(path, 'rb') as f:
+        if digest is not None:
+            f = _DigestReader(f, digest)
+        line = f.readline()
+        while line:
+            if not line.startswith(b'data_'):
+                line = f.readline()
+                continue
+            name = line[5:].strip().decode()
+
+            # Skip to the loop or pairs of the block.
+            line = f.readline()
+            while line and _is_skipped(line):
+                line = f.readline()
+
+            if line.strip().startswith(b'loop_'):
+                labels = []
+                offset = f.tell()
+                line = f.readline()
+                while line and (_is_skipped(line) or line.lstrip().startswith(b'_')):
+                    if not _is_skipped(line):
+                        labels.append(line.split()[0][1:].decode())
+                    offset = f.tell()
+                    line = f.readline()
+                f.seek(offset)
+                block_spans = [] if row_spans else None
+                add(name, _read_loop(f, labels, columns, chunk_size, block_spans), block_spans)
+                line = f.readline()
+            else:
+                # A simple block of label-value pairs, as a table of one row.
+                pairs = dict()
+                while line and not line.startswith(b'data_'):
+                    if not _is_skipped(line):
+                        items = line.split()
+                        label = items[0][1:].decode()
+                        if columns is None or label in columns:
+                            pairs[label] = items[1].decode() if len(items) > 1 else ''
+                    line = f.readline()
+                add(name, pd.DataFrame(pairs, index = [0]).apply(pd.to_numeric, errors = 'ignore'))
+    return (blocks, spans) if row_spans else blocks
+
+def write_star_rows(src_path : PathLike, dst_path : PathLike, spans : NDArray[np.int64], rows : ArrayLike, digest = None) -> NDArray[np.int64]:
+    '''
+    Write a copy of STAR file `src_path` to `dst_path`, keeping only rows
+    `rows` (in that order) of the loop whose rows have byte spans `spans`,
+    as given by read_star. Everything else of the file, and the selected
+    rows, are copied byte by byte without reformatting. Consecutive rows
+    are copied together, so sorted subsets cost about a plain file copy.
+    Return byte spans of the rows in `dst_path`. If a hashlib object
+    `digest` is given, it is updated with the whole output.
+    '''
+    rows = np.asarray(rows, dtype = np.int64)
+    with open(src_path, 'rb') as src:
+        if os.fstat(src.fileno()).st_size < (spans[-1, 1] if len(spans) > 0 else 0):
+            raise ValueError(f'{src_path} was changed since it was read')
+        if len(spans) == 0:
+            head, tail = None, 0
+        else:
+            head, tail = spans[0, 0], spans[-1, 1]
+
+        # Runs of consecutive rows.
+        bounds = np.flatnonzero(rows[1:] != rows[:-1] + 1) + 1
+        bounds = np.concatenate([[0], bounds, [len(rows)]]) if len(rows) > 0 else np.empty(0, dtype = np.int64)
+
+        # The output may replace the source, so it is written to a temporary file first.
+        tmp_path = f'{dst_path}.tmp'
+        dst_spans = np.empty((len(rows), 2), dtype = np.int64)
+        with mmap.mmap(src.fileno(), 0, access = mmap.ACCESS_READ) as mm, open(tmp_path, 'wb') as f:
+            def write(data) -> int:
+                if digest is not None:
+                    digest.update(data)
+                return f.write(data)
+
+            with memoryview(mm) as view:
+                position = write(view[: head if head is not None else len(view)])
+                for i, j in zip(bounds[:-1], bounds[1:]):
+                    start, end = spans[rows[i], 0], spans[rows[j - 1], 1]
+                    dst_spans[i : j] = spans[rows[i : j]] - start + position
+                    position += write(view[start : end])
+                    if mm[end - 1] != ord('\n'):
+                        position += write(b'\n')
+                        dst_spans[j - 1, 1] += 1
+                if head is not None:
+                    write(view[tail :])
+    os.replace(tmp_path, dst_path)
+    return dst_spans
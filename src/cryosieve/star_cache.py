@@ -0,0 +1,79 @@
+import hashlib
+import os
+import numpy as np
+from os import PathLike
+from pathlib import Path
+from typing import Optional
+
+# Version of the layout of star caches, caches of other versions are rebuilt.
+STAR_CACHE_VERSION = 2
+
+# Arrays of particles, stored as .npy files and loaded as memory maps.
+PARTICLE_ARRAYS = ('paras', 'i_slcs', 'stack_codes', 'image_names', 'row_spans', 'random_subsets')
+
+def star_cache_path(star_path : PathLike, cache_dir : PathLike) -> Path:
+    '''
+    Directory of the star cache of `star_path` in `cache_dir`, named after
+    the star file and a digest of its absolute path, so that star files of
+    the same name in different directories do not share it.
+    '''
+    digest = hashlib.blake2b(str(Path(star_path).absolute()).encode(), digest_size = 8).hexdigest()
+    return Path(cache_dir) / f'{Path(star_path).name}.{digest}'
+
+def file_digest():
+    '''Digest of the content of files in keys, see file_key.'''
+    return hashlib.blake2b(digest_size = 8)
+
+def file_key(path : PathLike, digest = None, block_size : int = 1 << 20) -> np.ndarray:
+    '''
+    Key (size, mtime in ns, digest) of a file. The digest hashes the whole
+    file, unless `digest` from file_digest is given that already hashed it
+    (e.g. by read_star or write_star_rows).
+    '''
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if digest is None:
+            digest = file_digest()
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    return np.array([stat.st_size, stat.st_mtime_ns, int.from_bytes(digest.digest(), 'little', signed = True)], dtype = np.int64)
+
+def load_star_cache(star_path : PathLike, cache_dir : PathLike, pixel_size : Optional[float]) -> Optional[dict]:
+    '''
+    Parsed particle parameters of `star_path` from its star cache in
+    `cache_dir`, None if there is no valid cache. Arrays of particles are
+    memory-mapped.
+    '''
+    path = star_cache_path(star_path, cache_dir)
+    if not (path / 'index.npz').is_file():
+        return None
+    index = dict(np.load(path / 'index.npz'))
+    if int(index['cache_version']) != STAR_CACHE_VERSION or not np.array_equal(index['key'], file_key(star_path)):
+        return None
+    # Pixel size of a star file before RELION 3.1 is given, and is in paras.
+    if int(index['version']) == 2 and float(index['pixel_size']) != pixel_size:
+        return None
+    for name in PARTICLE_ARRAYS:
+        if (path / f'{name}.npy').is_file():
+            index[name] = np.load(path / f'{name}.npy', mmap_mode = 'r')
+    return index
+
+def save_star_cache(star_path : PathLike, cache_dir : PathLike, cache : dict, key : Optional[np.ndarray] = None):
+    '''
+    Save parsed particle parameters `cache` of `star_path` into its star
+    cache in `cache_dir`, keyed by `key` from file_key (the current state
+    of `star_path` by default).
+    '''
+    path = star_cache_path(star_path, cache_dir)
+    path.mkdir(parents = True, exist_ok = True)
+
+    # The index is written last, an interrupted cache is not valid.
+    if (path / 'index.npz').exists():
+        (path / 'index.npz').unlink()
+    for name in PARTICLE_ARRAYS:
+        if (path / f'{name}.npy').exists():
+            (path / f'{name}.npy').unlink()
+        if cache.get(name) is not None:
+            np.save(path / f'{name}.npy', cache[name])
+    index = {key : value for key, value in cache.items() if key not in PARTICLE_ARRAYS and value is not None}
+    np.savez(path / 'index.npz', cache_version = STAR_CACHE_VERSION, key = file_key(star_path) if key is None else key, **index)
@@ -6,7 +6,7 @@ def check_cupy():
     try:
         import cupy as cp
     except ModuleNotFoundError:
-        logger.error('cannot find CuPy module')
+        logger.error('cannot find CuPy module, please install it (e.g. pip install cryosieve[cuda]) or use --backend cpu')
         exit(1)
     except ImportError:
         logger.error('cannot import CuPy module, please check your CUDA environment or GPU card')
@@ -36,6 +36,104 @@ def mrcread(fpath, i_slc : Optional[int] = None, cached_mrc_handles : Optional[d
 
     return data
 
+# Data types of MRC modes supported for particle stacks.
+MRC_MODES = {0 : np.int8, 1 : np.int16, 2 : np.float32, 6 : np.uint16, 12 : np.float16}
+
+def mrc_header(fpath):
+    '''Shape (nz, ny, nx), dtype and data offset of a MRC file, parsed from its header.'''
+    import os
+    with open(fpath, 'rb') as f:
+        header = f.read(1024)
+        size = os.fstat(f.fileno()).st_size
+    if len(header) < 1024:
+        raise ValueError(f'{str(fpath)} is not a MRC file')
+    order = '>' if header[212] == 0x11 else '<'
+    nx, ny, nz, mode = (int(x) for x in np.frombuffer(header, dtype = order + 'i4', count = 4))
+    nsymbt = int(np.frombuffer(header, dtype = order + 'i4', count = 1, offset = 92)[0])
+    if mode not in MRC_MODES:
+        raise ValueError(f'{str(fpath)} has unsupported MRC mode {mode}')
+    dtype = np.dtype(MRC_MODES[mode]).newbyteorder(order)
+    offset = 1024 + nsymbt
+    if size < offset + nz * ny * nx * dtype.itemsize:
+        raise ValueError(f'{str(fpath)} is truncated, {size} bytes for {nz} images of size {ny}x{nx}')
+    return (nz, ny, nx), dtype, offset
+
+class StackFile(object):
+    '''
+    Particle stack with `header` from mrc_header, whose slices are read
+    at computed offsets straight into caller-provided arrays, by pread
+    where available. Reads from several threads are safe.
+    '''
+
+    def __init__(self, fpath, header):
+        from threading import Lock
+        self.file = open(fpath, 'rb', buffering = 0)
+        self.shape, self.dtype, self.offset = header
+        self.lock = Lock()
+
+    def readinto(self, out : np.ndarray, i_slc : int, count : int = 1) -> np.ndarray:
+        '''Read `count` images from slice `i_slc` (from 0) into `out` of shape
+        (count, ny, nx), converting to the dtype of `out`.'''
+        import os
+        nz, ny, nx = self.shape
+        assert out.shape == (count, ny, nx) and 0 <= i_slc and i_slc + count <= nz
+        direct = out.dtype == self.dtype and out.flags.c_contiguous
+        target = out if direct else np.empty((count, ny, nx), dtype = self.dtype)
+        view = memoryview(target.reshape(-1).view(np.uint8))
+        position = self.offset + i_slc * ny * nx * self.dtype.itemsize
+        done = 0
+        while done < len(view):
+            if hasattr(os, 'preadv'):
+                size = os.preadv(self.file.fileno(), [view[done :]], position + done)
+            else:
+                with self.lock:
+                    self.file.seek(position + done)
+                    size = self.file.readinto(view[done :])
+            if not size:
+                raise EOFError(f'{self.file.name} ends before slice {i_slc + count}')
+            done += size
+        if not direct:
+            out[...] = target
+        return out
+
+    def close(self):
+        self.file.close()
+
+def stackread(fpath, header, i_slc : int, out : np.ndarray, handle_cache = None) -> np.ndarray:
+    '''Read images from slice `i_slc` (from 0) of a stack with `header` into
+    `out` of shape (count, ny, nx), see StackFile. Stacks are kept open in
+    `handle_cache` (a HandleCache) if given.'''
+    opener = lambda fpath : StackFile(fpath, header)
+    if handle_cache is None:
+        stack = opener(fpath)
+        try:
+            return stack.readinto(out, i_slc, len(out))
+        finally:
+            stack.close()
+    with handle_cache.open(fpath, opener) as stack:
+        return stack.readinto(out, i_slc, len(out))
+
+def mask_radius(mask : np.ndarray) -> float:
+    '''Radius of the support of a mask, centered at n // 2 as volumes.'''
+    n = mask.shape[0]
+    support = np.argwhere(mask > 0)
+    if len(support) == 0:
+        return 0.
+    return float(np.sqrt(((support - n // 2) ** 2).sum(axis = 1).max()))
+
+def ctf_delocalization(ctf_table : np.ndarray, threshold_high : float = 1.) -> float:
+    '''
+    Largest CTF delocalization (in pixels) of frequencies up to
+    `threshold_high` (in cycles per pixel) over rows of `ctf_table`, i.e.
+    the distance lambda * defocus * q + Cs * lambda ** 3 * q ** 3 by which
+    the CTF spreads the signal of frequency q.
+    '''
+    voltage, defocusU, defocusV, _, Cs, _, _, pixelSize = np.asarray(ctf_table, dtype = np.float64).T
+    waveLength = 12.2643247 / np.sqrt(voltage * (1 + voltage * 0.978466e-6))
+    q = min(threshold_high, np.sqrt(0.5)) / pixelSize
+    defocus = np.maximum(np.abs(defocusU), np.abs(defocusV))
+    return float(np.max((waveLength * defocus * q + Cs * waveLength ** 3 * q ** 3) / pixelSize, initial = 0.))
+
 def run_commands(commands, jobname = '', stdout = None, cwd = None):
     import subprocess
     from .logger import logger
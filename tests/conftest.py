@@ -0,0 +1,39 @@
+'''Fixtures of small datasets for running the programs of cryosieve.'''
+import sys
+import mrcfile
+import numpy as np
+import pytest
+
+def write_dataset(path, n = 32, m = 40, angpix = 1.5):
+    rng = np.random.default_rng(0)
+    for name in ['A1', 'A2', 'B1', 'B2']:
+        with mrcfile.new(path / f'{name}.mrc') as mrc:
+            mrc.set_data(rng.normal(size = (n, n, n)).astype(np.float32))
+            mrc.voxel_size = angpix
+    with mrcfile.new(path / 'stack.mrcs') as mrc:
+        mrc.set_data(rng.normal(size = (m, n, n)).astype(np.float32))
+    rows = ''.join(
+        f'{i + 1:06d}@stack.mrcs {a:.3f} {b:.3f} {c:.3f} {x:.3f} {y:.3f} {u:.1f} {u + 300:.1f} 30 1 {i % 2 + 1}\n'
+        for i, (a, b, c, x, y, u) in enumerate(zip(*rng.uniform([-180, 0, -180, -4, -4, 1e4], [180, 180, 180, 4, 4, 2e4], (m, 6)).T))
+    )
+    (path / 'particles.star').write_text(
+        'data_optics\n\nloop_\n_rlnOpticsGroup\n_rlnVoltage\n_rlnImagePixelSize\n_rlnSphericalAberration\n_rlnAmplitudeContrast\n'
+        f'1 300 {angpix} 2.7 0.1\n\ndata_particles\n\nloop_\n_rlnImageName\n_rlnAngleRot\n_rlnAngleTilt\n_rlnAnglePsi\n'
+        '_rlnOriginXAngst\n_rlnOriginYAngst\n_rlnDefocusU\n_rlnDefocusV\n_rlnDefocusAngle\n_rlnOpticsGroup\n_rlnRandomSubset\n' + rows
+    )
+
+@pytest.fixture
+def toy_dataset(tmp_path, monkeypatch):
+    '''A dataset of 40 particles of 32 pixels with 2 random subsets, and
+    volumes A1, A2 (subset 1) and B1, B2 (subset 2), in the working directory.'''
+    write_dataset(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def run(monkeypatch):
+    '''Run the process of a program module with command line arguments.'''
+    def run(module, argv):
+        monkeypatch.setattr(sys, 'argv', [module.__name__] + argv)
+        module.process(module.parse_arguments())
+    return run
@@ -0,0 +1,59 @@
+'''Bounded LRU cache of open file handles.'''
+import pytest
+from cryosieve.handle_cache import HandleCache
+
+class Handle(object):
+    def __init__(self, key):
+        self.key = key
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_lru_eviction():
+    cache = HandleCache(2)
+    handles = {}
+    def opener(key):
+        handles[key] = Handle(key)
+        return handles[key]
+
+    for key in ['a', 'b', 'a', 'c']:
+        with cache.open(key, opener) as handle:
+            assert handle.key == key and not handle.closed
+    # b is the least recently used when c is opened.
+    assert len(cache) == 2 and handles['b'].closed
+    assert not handles['a'].closed and not handles['c'].closed
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 3, 1)
+
+    with cache.open('b', opener):
+        pass
+    assert handles['a'].closed and cache.evictions == 2
+    assert cache.stats() == '1 hits, 4 misses (20.0% hit rate), 2 evictions'
+
+def test_handles_in_use_not_evicted():
+    cache = HandleCache(1)
+    with cache.open('a', Handle) as a:
+        with cache.open('b', Handle) as b:
+            assert len(cache) == 2 and not a.closed
+            with cache.open('a', Handle) as a_again:
+                assert a_again is a
+        # b is released, a is still in use, so b is evicted.
+        assert b.closed and not a.closed and len(cache) == 1
+    assert not a.closed and len(cache) == 1
+
+def test_failed_open_is_released():
+    cache = HandleCache(1)
+    def opener(key):
+        raise OSError(key)
+    with pytest.raises(OSError):
+        with cache.open('a', opener):
+            pass
+    assert len(cache) == 0 and cache.users == {}
+
+def test_clear():
+    cache = HandleCache(4)
+    with cache.open('a', Handle) as a:
+        with cache.open('b', Handle) as b:
+            pass
+        cache.clear()
+        assert b.closed and not a.closed and len(cache) == 1
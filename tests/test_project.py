@@ -0,0 +1,64 @@
+'''Parity of the gather projector with the former scatter kernel.
+
+The former kernel splatted every voxel bilinearly onto the image plane,
+the gather projector integrates trilinearly interpolated rays with unit
+steps. They agree exactly along the axes, and differ by interpolation
+error otherwise, so projections (and scores) change slightly.
+'''
+import numpy as np
+import pytest
+from cryosieve.kernels.cpu.project import project, quats_to_rots, volume_support
+
+def scatter_project(volume, quats):
+    '''NumPy port of the former scatter kernel of kernels/project.py.'''
+    n = volume.shape[0]
+    rots = quats_to_rots(np.asarray(quats, dtype = np.float64))
+    c = np.arange(n) - n // 2
+    z, y, x = np.meshgrid(c, c, c, indexing = 'ij')
+    xyz = np.stack([x.ravel(), y.ravel(), z.ravel()]).astype(np.float64)
+    voxels = volume.ravel()
+    stack = np.zeros((len(rots), n * n))
+    for image, rot in zip(stack, rots):
+        vx = rot[0 : 3] @ xyz + n // 2
+        vy = rot[3 : 6] @ xyz + n // 2
+        x0 = np.floor(vx).astype(np.int64)
+        y0 = np.floor(vy).astype(np.int64)
+        dx = vx - x0
+        dy = vy - y0
+        for ox, oy, w in ((0, 0, (1 - dx) * (1 - dy)), (1, 0, dx * (1 - dy)), (0, 1, (1 - dx) * dy), (1, 1, dx * dy)):
+            xi = x0 + ox
+            yi = y0 + oy
+            inside = (0 <= xi) & (xi < n) & (0 <= yi) & (yi < n)
+            np.add.at(image, yi[inside] * n + xi[inside], voxels[inside] * w[inside])
+    return stack.reshape(-1, n, n)
+
+def blobs(n, seed = 0):
+    '''A fixed volume of 8 Gaussian blobs.'''
+    rng = np.random.default_rng(seed)
+    c = np.arange(n) - n // 2
+    z, y, x = np.meshgrid(c, c, c, indexing = 'ij')
+    volume = np.zeros((n, n, n))
+    for (cx, cy, cz), s in zip(rng.uniform(-n / 5, n / 5, (8, 3)), rng.uniform(1.5, 3, 8)):
+        volume += np.exp(-((x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2) / (2 * s * s))
+    return volume
+
+def random_quats(m, seed = 1):
+    quats = np.random.default_rng(seed).normal(size = (m, 4))
+    return quats / np.linalg.norm(quats, axis = 1, keepdims = True)
+
+@pytest.mark.parametrize('n', [32, 33])
+def test_axis_aligned_exact(n):
+    volume = blobs(n)
+    quats = np.array([[1., 0., 0., 0.], [0., 0., 0., 1.]])
+    np.testing.assert_allclose(project(volume, quats), scatter_project(volume, quats), rtol = 0, atol = 1e-10)
+
+def test_scatter_parity():
+    # Relative L2 errors are 1.0% on the whole stack and 0.2% - 1.7% per
+    # projection on this volume, the tolerance leaves a margin of about 2x.
+    volume = blobs(32)
+    quats = random_quats(8)
+    expected = scatter_project(volume, quats)
+    stack = project(volume, quats, support = volume_support(volume))
+    assert np.linalg.norm(stack - expected) <= 0.02 * np.linalg.norm(expected)
+    errors = np.linalg.norm(stack - expected, axis = (1, 2)) / np.linalg.norm(expected, axis = (1, 2))
+    assert errors.max() <= 0.035
@@ -0,0 +1,35 @@
+'''Scores of cryosieve-reselect from radial shells against cryosieve-core.'''
+import numpy as np
+import pandas as pd
+import pytest
+from cryosieve import core, reselect
+from cryosieve.star import read_star
+
+# The highpass threshold 1.5 / 12 * 32 = 4 is a shell boundary, so that
+# reselect does not round it. The cap 1.5 / 5 * 32 = 9.6 is not, and the
+# cropped box of 20 pixels holds frequencies up to 14 beyond it.
+@pytest.mark.parametrize('max_resolution', [None, 5.])
+def test_reselect_matches_core(toy_dataset, run, max_resolution):
+    argv = ['--i', 'particles.star', '--directory', '.', '--angpix', '1.5', '--retention_ratio', '0.5', '--frequency', '12']
+    cap = [] if max_resolution is None else ['--max_resolution', str(max_resolution)]
+    run(core, argv + ['--o', 'core.star', '--volume', 'A1.mrc', 'A2.mrc', '--volume', 'B1.mrc', 'B2.mrc',
+                      '--backend', 'cpu', '--num_threads', '1', '--shells', 'shells.npz'] + cap)
+    scores = pd.read_csv('core_scores.csv')
+
+    for k in range(2):
+        shells = np.load(f'shells_k{k}.npz')
+        positions = pd.Index(shells['names']).get_indexer(scores['rlnImageName'])
+        expected = scores[f'score_k{k}'].to_numpy()
+        # Shells are saved in float32.
+        np.testing.assert_allclose(reselect.scores_from_shells(shells['residual'][positions], shells['power'][positions], 1.5 / 12, int(shells['n'])),
+                                   expected, rtol = 1e-5, atol = 1e-5 * np.abs(expected).max())
+
+        run(reselect, ['--i', 'particles.star', '--shells', f'shells_k{k}.npz', '--o', f'reselect_k{k}.star', '--retention_ratio', '0.5', '--frequency', '12'])
+        for name in [f'_k{k}.star', f'_k{k}_sieved.star']:
+            assert list(read_star('reselect' + name)['particles']['rlnImageName']) == list(read_star('core' + name)['particles']['rlnImageName'])
+
+def test_reselect_beyond_max_resolution(toy_dataset, run):
+    run(core, ['--i', 'particles.star', '--directory', '.', '--angpix', '1.5', '--retention_ratio', '0.5', '--frequency', '12', '--o', 'core.star',
+               '--volume', 'A1.mrc', '--volume', 'B1.mrc', '--backend', 'cpu', '--num_threads', '1', '--shells', 'shells.npz', '--max_resolution', '5'])
+    with pytest.raises(ValueError, match = 'highest resolution'):
+        run(reselect, ['--i', 'particles.star', '--shells', 'shells.npz', '--o', 'reselect.star', '--retention_ratio', '0.5', '--frequency', '4'])
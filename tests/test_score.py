@@ -0,0 +1,80 @@
+'''Fused Fourier scoring of the cpu backend against the former pipeline.'''
+import numpy as np
+import pytest
+from cryosieve.kernels import PRECISIONS, complex_dtype, get_backend
+
+backend = get_backend('cpu')
+
+def particles(n = 32, m = 6, seed = 0):
+    '''Random images, projections, CTF parameters and translations.'''
+    rng = np.random.default_rng(seed)
+    imgs = rng.normal(size = (m, n, n))
+    projs = rng.normal(size = (m, n, n))
+    ctfs = np.column_stack([
+        np.full(m, 300e3),               # voltage
+        rng.uniform(1e4, 2e4, m),        # defocus 1
+        rng.uniform(1e4, 2e4, m),        # defocus 2
+        rng.uniform(0, np.pi, m),        # astigmatism angle
+        np.full(m, 2.7e7),               # Cs
+        np.full(m, 0.1),                 # amplitude contrast
+        np.zeros(m),                     # phase shift
+        np.full(m, 1.3)                  # pixel size
+    ])
+    trans = rng.uniform(-3, 3, (m, 2))
+    return imgs, projs, ctfs, trans
+
+def reference_scores(imgs, projs, ctfs, trans, threshold):
+    '''Scores by the former translate/convolute_ctf/highpass2d pipeline.'''
+    imgs = backend.translate(imgs, trans)
+    residuals = backend.convolute_ctf(projs, ctfs) - imgs
+    imgs = backend.highpass2d(imgs, threshold)
+    residuals = backend.highpass2d(residuals, threshold)
+    return np.linalg.norm(residuals, axis = (1, 2)) ** 2 - np.linalg.norm(imgs, axis = (1, 2)) ** 2
+
+def fused_scores(imgs, projs, ctfs, trans, threshold, precision = 'float64'):
+    dtype, acc_dtype = PRECISIONS[precision]
+    n = imgs.shape[1]
+    f_imgs = backend.rfft2(np.asarray(imgs, dtype = dtype)).astype(complex_dtype(dtype))
+    f_projs = backend.rfft2(np.asarray(projs, dtype = dtype)).astype(complex_dtype(dtype))
+    f_ctf = backend.get_ctf(ctfs, n, dtype = dtype)
+    return backend.score_fourier(f_imgs, f_projs, f_ctf, trans, threshold, acc_dtype = acc_dtype)
+
+@pytest.mark.parametrize('n', [32, 33])
+@pytest.mark.parametrize('threshold', [0., 0.1])
+def test_fused_score_parity(n, threshold):
+    imgs, projs, ctfs, trans = particles(n)
+    expected = reference_scores(imgs, projs, ctfs, trans, threshold)
+    scores = fused_scores(imgs, projs, ctfs, trans, threshold)
+    # Scores agree to about 1e-15 relative to the largest one.
+    np.testing.assert_allclose(scores, expected, rtol = 1e-12, atol = 1e-12 * np.abs(expected).max())
+
+def test_ctf_index():
+    imgs, projs, ctfs, trans = particles()
+    n = imgs.shape[1]
+    f_imgs = backend.rfft2(imgs)
+    f_projs = backend.rfft2(projs)
+    unique, ctf_index = np.unique(ctfs[[0, 1, 0, 1, 0, 1]], axis = 0, return_inverse = True)
+    scores = backend.score_fourier(f_imgs, f_projs, backend.get_ctf(unique, n), trans, 0.1, ctf_index = ctf_index.ravel())
+    expected = backend.score_fourier(f_imgs, f_projs, backend.get_ctf(ctfs[[0, 1, 0, 1, 0, 1]], n), trans, 0.1)
+    np.testing.assert_allclose(scores, expected, rtol = 1e-12)
+
+# Relative errors are about 7e-6 in both modes.
+@pytest.mark.parametrize('precision, rtol', [('float32', 5e-5), ('mixed', 5e-5)])
+def test_precision(precision, rtol):
+    imgs, projs, ctfs, trans = particles()
+    expected = fused_scores(imgs, projs, ctfs, trans, 0.1)
+    scores = fused_scores(imgs, projs, ctfs, trans, 0.1, precision)
+    assert scores.dtype == PRECISIONS[precision][1]
+    np.testing.assert_allclose(scores, expected, rtol = rtol, atol = rtol * np.abs(expected).max())
+
+@pytest.mark.parametrize('threshold_high', [1., 0.3])
+def test_shells(threshold_high):
+    imgs, projs, ctfs, trans = particles()
+    n = imgs.shape[1]
+    f_imgs = backend.rfft2(imgs)
+    f_projs = backend.rfft2(projs)
+    f_ctf = backend.get_ctf(ctfs, n)
+    shells = backend.score_shells(f_imgs, f_projs, f_ctf, trans, threshold_high)
+    for k in [0, 4, 9]:
+        expected = backend.score_fourier(f_imgs, f_projs, f_ctf, trans, k / n, threshold_high)
+        np.testing.assert_allclose((shells[:, 0, k:] - shells[:, 1, k:]).sum(axis = 1), expected, rtol = 1e-12)
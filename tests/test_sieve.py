@@ -0,0 +1,37 @@
+'''Memory plans of scoring under a budget.'''
+import re
+import numpy as np
+import pytest
+from cryosieve.kernels.cpu.project import CHUNK, SAMPLE_BYTES
+from cryosieve.sieve import plan_memory
+
+volumes = [np.zeros((32, 32, 32)), np.zeros((32, 32, 32))]
+
+def plan(budget, host = True, projection = 'real'):
+    return plan_memory(budget, 32, 32, volumes, np.float64, np.float64, projection, image_bytes = 32 * 32 * 4, host = host)
+
+def test_host_chunk_scales_with_budget():
+    sub_batch, slab, chunk = plan(2 ** 30)
+    assert chunk == CHUNK and slab is None and sub_batch == 1000
+
+    # A budget below the default chunk of ray samples still plans, with a smaller chunk.
+    sub_batch, slab, chunk = plan(int(0.05 * 2 ** 30))
+    assert chunk * SAMPLE_BYTES <= 0.05 * 2 ** 30 / 4 and slab is None and sub_batch > 1
+
+    # Volumes are streamed in slabs under smaller budgets.
+    sub_batch, slab, chunk = plan(2 ** 21)
+    assert slab is not None and sub_batch >= 1
+
+def test_device_chunk_not_bounded():
+    assert plan(2 ** 30, host = False)[2] is None
+    assert plan(2 ** 30, projection = 'fourier')[2] is None
+
+@pytest.mark.parametrize('host', [True, False])
+def test_least_budget(host):
+    with pytest.raises(ValueError, match = 'use a budget of at least') as error:
+        plan(2 ** 10, host)
+    least = float(re.search(r'at least ([\d.e-]+) GB', str(error.value)).group(1)) * 2 ** 30
+    # The budget reported (to 3 significant digits) suffices, and is close to the least one.
+    assert plan(int(least * 1.01), host)[0] >= 1
+    with pytest.raises(ValueError):
+        plan(int(least * 0.9), host)
@@ -0,0 +1,25 @@
+'''Scores with the spectrum cache against scores from images.'''
+import numpy as np
+import pandas as pd
+import pytest
+from cryosieve import core
+
+def scores(run, output, precision, cache = None):
+    run(core, ['--i', 'particles.star', '--directory', '.', '--angpix', '1.5', '--retention_ratio', '0.5', '--frequency', '12',
+               '--o', output, '--volume', 'A1.mrc', 'A2.mrc', '--volume', 'B1.mrc', 'B2.mrc', '--backend', 'cpu', '--num_threads', '1',
+               '--precision', precision] + ([] if cache is None else ['--spectrum_cache', cache]))
+    return pd.read_csv(output.replace('.star', '_scores.csv'))[['score_k0', 'score_k1']].to_numpy()
+
+@pytest.mark.parametrize('precision, rtol', [('float64', 1e-12), ('float32', 1e-5)])
+def test_cached_scores(toy_dataset, run, precision, rtol):
+    expected = scores(run, 'images.star', precision)
+    # Scores while the cache is written, then from the cache.
+    for output in ['write.star', 'read.star']:
+        np.testing.assert_allclose(scores(run, output, precision, 'cache'), expected, rtol = rtol, atol = rtol * np.abs(expected).max())
+    assert np.load('cache/spectra.npy', mmap_mode = 'r').dtype == (np.complex128 if precision == 'float64' else np.complex64)
+
+def test_cache_rebuilt_for_precision(toy_dataset, run):
+    scores(run, 'single.star', 'float32', 'cache')
+    expected = scores(run, 'images.star', 'float64')
+    np.testing.assert_allclose(scores(run, 'double.star', 'float64', 'cache'), expected, rtol = 1e-12, atol = 1e-12 * np.abs(expected).max())
+    assert np.load('cache/spectra.npy', mmap_mode = 'r').dtype == np.complex128
@@ -0,0 +1,80 @@
+'''Streaming STAR reader and verbatim row writer.'''
+import numpy as np
+import pandas as pd
+import pytest
+from cryosieve.star import read_star, write_star_rows
+
+def star_text(m = 50):
+    rows = ''.join(
+        f'{i + 1:06d}@Particles/stack_{i // 20:03d}.mrcs  {i * 1.5:.2f}  -{i * 0.25:.3f}  {i % 2 + 1}\n' +
+        ('# a comment between rows\n\n' if i == 7 else '')
+        for i in range(m)
+    )
+    return (
+        '# version 30001\n\n'
+        'data_general\n\n_rlnTitle   sieved\n_rlnCount   3\n\n'
+        'data_optics\n\nloop_\n_rlnOpticsGroup #1\n_rlnImagePixelSize #2\n1 1.32\n2 0.66\n\n'
+        'data_particles\n\nloop_\n_rlnImageName #1\n_rlnAngleRot #2\n_rlnAngleTilt #3\n_rlnRandomSubset #4\n' + rows
+    )
+
+@pytest.fixture
+def star_path(tmp_path):
+    path = tmp_path / 'particles.star'
+    path.write_text(star_text())
+    return path
+
+@pytest.mark.parametrize('chunk_size', [1 << 25, 100, 37])
+def test_read_star(star_path, chunk_size):
+    star = read_star(star_path, chunk_size = chunk_size)
+    assert list(star) == ['general', 'optics', 'particles']
+    assert star['general'].loc[0, 'rlnTitle'] == 'sieved' and star['general'].loc[0, 'rlnCount'] == 3
+    np.testing.assert_array_equal(star['optics']['rlnImagePixelSize'], [1.32, 0.66])
+    particles = star['particles']
+    assert len(particles) == 50
+    assert particles.loc[12, 'rlnImageName'] == '000013@Particles/stack_000.mrcs'
+    np.testing.assert_allclose(particles['rlnAngleRot'], np.arange(50) * 1.5)
+    np.testing.assert_allclose(particles['rlnAngleTilt'], -np.arange(50) * 0.25)
+
+def test_column_projection(star_path):
+    star = read_star(star_path, ['rlnRandomSubset'], chunk_size = 64)
+    assert list(star['particles'].columns) == ['rlnRandomSubset']
+    np.testing.assert_array_equal(star['particles']['rlnRandomSubset'], np.arange(50) % 2 + 1)
+    # Rows are kept even if no column of a loop is read.
+    assert star['optics'].shape == (2, 0)
+
+def test_row_spans(star_path):
+    star, spans = read_star(star_path, ['rlnImageName'], chunk_size = 64, row_spans = True)
+    assert spans['general'] is None
+    data = star_path.read_bytes()
+    names = [data[a : b].split()[0].decode() for a, b in spans['particles']]
+    assert names == list(star['particles']['rlnImageName'])
+
+@pytest.mark.parametrize('rows', [np.arange(50), np.arange(0, 50, 3), np.array([49, 3, 4, 5, 0]), np.array([], dtype = np.int64)])
+def test_write_star_rows(star_path, tmp_path, rows):
+    star, spans = read_star(star_path, row_spans = True)
+    output_path = tmp_path / 'subset.star'
+    output_spans = write_star_rows(star_path, output_path, spans['particles'], rows)
+
+    subset = read_star(output_path)
+    pd.testing.assert_frame_equal(subset['optics'], star['optics'])
+    pd.testing.assert_frame_equal(subset['particles'], star['particles'].iloc[rows].reset_index(drop = True), check_dtype = len(rows) > 0)
+
+    # Rows are copied byte by byte, and their new spans are returned.
+    data = star_path.read_bytes()
+    output = output_path.read_bytes()
+    assert [output[a : b] for a, b in output_spans] == [data[a : b] for a, b in spans['particles'][rows]]
+    assert output.startswith(data[: spans['particles'][0, 0]])
+
+def test_write_star_rows_in_place(star_path):
+    star, spans = read_star(star_path, row_spans = True)
+    write_star_rows(star_path, star_path, spans['particles'], np.arange(10, 20))
+    particles = read_star(star_path)['particles']
+    pd.testing.assert_frame_equal(particles, star['particles'].iloc[10 : 20].reset_index(drop = True))
+
+def test_last_row_without_line_break(tmp_path):
+    path = tmp_path / 'particles.star'
+    path.write_text(star_text().rstrip('\n'))
+    _, spans = read_star(path, row_spans = True)
+    output_path = tmp_path / 'subset.star'
+    write_star_rows(path, output_path, spans['particles'], [49, 0])
+    np.testing.assert_array_equal(read_star(output_path)['particles']['rlnAngleRot'], [49 * 1.5, 0.])
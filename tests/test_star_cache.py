@@ -0,0 +1,142 @@
+'''Opt-in star caches of ParticleDataset and their invalidation.'''
+import os
+import mrcfile
+import numpy as np
+import pytest
+import cryosieve.ParticleDataset as particle_dataset
+from cryosieve.ParticleDataset import ParticleDataset
+from cryosieve.star import read_star, write_star_rows
+from cryosieve.star_cache import file_digest, file_key, star_cache_path
+
+OPTICS = 'data_optics\n\nloop_\n_rlnOpticsGroup\n_rlnVoltage\n_rlnImagePixelSize\n_rlnSphericalAberration\n_rlnAmplitudeContrast\n1 300 1.3 2.7 0.1\n\n'
+PARTICLE_COLUMNS = ['rlnImageName', 'rlnAngleRot', 'rlnAngleTilt', 'rlnAnglePsi', 'rlnOriginXAngst',
+                    'rlnOriginYAngst', 'rlnDefocusU', 'rlnDefocusV', 'rlnDefocusAngle', 'rlnOpticsGroup', 'rlnRandomSubset']
+
+def write_star(path, m = 20, defocus = 1e4, optics = True):
+    columns = PARTICLE_COLUMNS if optics else [
+        'rlnImageName', 'rlnAngleRot', 'rlnAngleTilt', 'rlnAnglePsi', 'rlnOriginX', 'rlnOriginY', 'rlnVoltage',
+        'rlnDefocusU', 'rlnDefocusV', 'rlnDefocusAngle', 'rlnSphericalAberration', 'rlnAmplitudeContrast', 'rlnRandomSubset']
+    if optics:
+        rows = ''.join(f'{i + 1:06d}@stack.mrcs {i * 10.} 0 0 0 0 {defocus + i} {defocus + i} 0 1 {i % 2 + 1}\n' for i in range(m))
+    else:
+        rows = ''.join(f'{i + 1:06d}@stack.mrcs {i * 10.} 0 0 0 0 300 {defocus + i} {defocus + i} 0 2.7 0.1 {i % 2 + 1}\n' for i in range(m))
+    path.write_text((OPTICS + 'data_particles' if optics else 'data_') + '\n\nloop_\n' + ''.join(f'_{c}\n' for c in columns) + rows)
+
+@pytest.fixture
+def star_path(tmp_path):
+    with mrcfile.new(tmp_path / 'stack.mrcs') as mrc:
+        mrc.set_data(np.zeros((20, 8, 8), dtype = np.float32))
+    path = tmp_path / 'particles.star'
+    write_star(path)
+    return path
+
+@pytest.fixture
+def parses(monkeypatch):
+    '''Number of times the star file is parsed.'''
+    calls = []
+    read_star = particle_dataset.read_star
+    def counted(*args, **kwargs):
+        calls.append(args[0])
+        return read_star(*args, **kwargs)
+    monkeypatch.setattr(particle_dataset, 'read_star', counted)
+    return calls
+
+def load(star_path, cache_dir, **kwargs):
+    return ParticleDataset(star_path, star_path.parent, star_cache = cache_dir, index_stacks = False, **kwargs)
+
+def test_cache_reused(star_path, tmp_path, parses):
+    cache_dir = tmp_path / 'cache'
+    dataset = load(star_path, cache_dir)
+    assert (star_cache_path(star_path, cache_dir) / 'index.npz').is_file()
+    assert len(parses) == 1
+
+    cached = load(star_path, cache_dir)
+    assert len(parses) == 1
+    assert isinstance(cached.paras, np.memmap)
+    np.testing.assert_array_equal(cached.paras, dataset.paras)
+    np.testing.assert_array_equal(cached.image_names, dataset.image_names)
+    np.testing.assert_array_equal(cached.random_subsets, dataset.random_subsets)
+
+def test_no_cache_by_default(star_path, parses):
+    files = set(os.listdir(star_path.parent))
+    load(star_path, None)
+    load(star_path, None)
+    assert len(parses) == 2
+    assert set(os.listdir(star_path.parent)) == files
+
+@pytest.mark.parametrize('change', ['content', 'size', 'mtime'])
+def test_cache_invalidated(star_path, tmp_path, parses, change):
+    cache_dir = tmp_path / 'cache'
+    load(star_path, cache_dir)
+    stat = os.stat(star_path)
+    if change == 'content':
+        # Same size and mtime, only the digest of the file differs.
+        write_star(star_path, defocus = 2e4)
+        os.utime(star_path, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+        assert os.stat(star_path).st_size == stat.st_size
+    elif change == 'size':
+        write_star(star_path, m = 10)
+    else:
+        os.utime(star_path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    dataset = load(star_path, cache_dir)
+    assert len(parses) == 2
+    assert len(dataset.paras) == (10 if change == 'size' else 20)
+    if change == 'content':
+        assert dataset.ctfs[0, 1] == 2e4
+    load(star_path, cache_dir)
+    assert len(parses) == 2
+
+def test_cache_invalidated_by_pixel_size(tmp_path, parses):
+    star_path = tmp_path / 'particles.star'
+    write_star(star_path, optics = False)
+    cache_dir = tmp_path / 'cache'
+    load(star_path, cache_dir, pixel_size = 1.3)
+    load(star_path, cache_dir, pixel_size = 1.3)
+    assert len(parses) == 1
+    dataset = load(star_path, cache_dir, pixel_size = 0.65)
+    assert len(parses) == 2 and dataset.pixel_size == 0.65
+
+def test_same_name_in_other_directory(star_path, tmp_path, parses):
+    cache_dir = tmp_path / 'cache'
+    other = tmp_path / 'other'
+    other.mkdir()
+    write_star(other / 'particles.star', m = 10)
+    load(star_path, cache_dir)
+    assert len(load(other / 'particles.star', cache_dir).paras) == 10
+    assert len(parses) == 2
+
+def test_unreadable_cache(star_path, tmp_path, parses):
+    cache_dir = tmp_path / 'cache'
+    load(star_path, cache_dir)
+    (star_cache_path(star_path, cache_dir) / 'index.npz').write_bytes(b'not a cache')
+    assert len(load(star_path, cache_dir).paras) == 20
+    assert len(parses) == 2
+
+def test_streamed_digest(star_path, tmp_path):
+    # Digests updated while reading and writing star files hash the whole file.
+    digest = file_digest()
+    _, spans = read_star(star_path, ['rlnImageName'], chunk_size = 64, row_spans = True, digest = digest)
+    np.testing.assert_array_equal(file_key(star_path, digest), file_key(star_path))
+    digest = file_digest()
+    write_star_rows(star_path, tmp_path / 'subset.star', spans['particles'], [3, 1, 4], digest)
+    np.testing.assert_array_equal(file_key(tmp_path / 'subset.star', digest), file_key(tmp_path / 'subset.star'))
+
+def test_cache_invalidated_by_any_byte(tmp_path, parses):
+    # An in-place fixed-width edit of a 5.7 MB star file that keeps its size
+    # and mtime. It is between the blocks of 64 KiB a sampled digest of 64
+    # evenly spaced blocks would hash.
+    star_path = tmp_path / 'particles.star'
+    write_star(star_path, m = 100000)
+    cache_dir = tmp_path / 'cache'
+    load(star_path, cache_dir)
+    stat = os.stat(star_path)
+    data = bytearray(star_path.read_bytes())
+    offset = data.index(b'@stack.mrcs 500630.0 0 0 0 0 60063.0')
+    data[offset : offset + 36] = b'@stack.mrcs 500630.0 0 0 0 0 70063.0'
+    star_path.write_bytes(data)
+    os.utime(star_path, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+
+    dataset = load(star_path, cache_dir)
+    assert len(parses) == 2
+    assert dataset.ctfs[50063, 1] == 70063.